@@ -1,30 +1,45 @@
 import os
-import psycopg2
-from flask import Flask, request, jsonify, send_file, render_template, redirect, url_for
+import json
+import base64
+from datetime import datetime
+from flask import Flask, Response, request, jsonify, send_file, render_template, redirect, url_for
 from werkzeug.utils import secure_filename
-from email.message import EmailMessage
-from io import BytesIO
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask import Flask, session
 from urllib.parse import urlparse
+import psycopg2
+
+from db import db_conn, pool_stats, PoolTimeout
+import search as ticket_search
+from mailer import enqueue_email, notify_outbox, start_outbox
+from blobstore import get_blob_store, hold_blob, BlobNotFound
+from downloads import send_ranged, ATTACHMENT_MAX_AGE
+import cache
+import bulk
+import export
+import events
+import sync
+import stats
+import uploads
+import notifications
+import migrations
+import metrics
+import profiler
+import routing
+from passwords import hash_password, verify_password, PasswordPoolBusy
+from models import Attachment, Ticket, Project, User, FastJSONProvider
+from thumbnails import (THUMBNAIL_SIZES, thumbnail_path, thumbnail_mimetype, schedule_thumbnails,
+                        schedule_missing, delete_thumbnails)
 
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # max 16MB upload
+app.json = FastJSONProvider(app)
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # max 16MB upload; larger files use /api/uploads
 app.secret_key = 'dev-secret-key-123'
 
-# DB connection info 
-DB_HOST = 'localhost'
-DB_NAME = 'JiraCloneDB'
-DB_USER = 'postgres'
-DB_PASS = 'root'
-
-def get_db_conn():
-    return psycopg2.connect(
-        host=DB_HOST,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS
-    )
+migrations.on_startup()
+metrics.init_app(app)
+profiler.init_app(app)
+routing.init_app(app)
+start_outbox()
 
 # def get_connection():
 #     url = os.environ.get('DATABASE_URL')
@@ -42,22 +57,6 @@ def get_db_conn():
 #     return psycopg2.connect(**db_config)
 
 
-def send_email(to_email, subject, html_content):
-    import smtplib
-    from email.message import EmailMessage
-
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = 'muthuvelraj2818@gmail.com'
-    msg['To'] = to_email
-    msg.set_content("This email requires an HTML-compatible viewer.")
-    msg.add_alternative(html_content, subtype='html')
-
-    with smtplib.SMTP('smtp.gmail.com', 587) as server:
-        server.starttls()
-        server.login('muthuvelraj2818@gmail.com', 'kxgh igwf elbh xibo')
-        server.send_message(msg)
-
 @app.route('/')
 def index():
     return redirect(url_for('register'))
@@ -85,37 +84,39 @@ def invite_user():
     email = data.get('email', '').strip().lower()
     print(f"Received invite request for: {email}")
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-
-    cur.execute("SELECT id FROM users WHERE LOWER(email) = %s", (email,))
-    existing = cur.fetchone()
-    print(f"Existing user check result: {existing}")
-
-    if existing:
-        return jsonify({'error': 'User already exists'}), 409
-
-    cur.execute("INSERT INTO users (email) VALUES (%s)", (email,))
-    conn.commit()
-    cur.close()
-    conn.close()
-
-    invite_link = f"http://localhost:5000/accept_invite?email={email}"
-    html_body = f"""
-    <html>
-    <body>
-        <p>You've been invited to join BUG FREE.</p>
-        <p>
-        <a href="{invite_link}" style="display:inline-block;padding:10px 15px;
-            background-color:#28a745;color:white;text-decoration:none;border-radius:4px;">
-            Accept Invite
-        </a>
-        </p>
-    </body>
-    </html>
-    """
-
-    send_email(email, "You're invited!", html_body)
+    with db_conn() as conn:
+        cur = conn.cursor()
+
+        cur.execute("SELECT id FROM users WHERE LOWER(email) = %s", (email,))
+        existing = cur.fetchone()
+        print(f"Existing user check result: {existing}")
+
+        if existing:
+            cur.close()
+            return jsonify({'error': 'User already exists'}), 409
+
+        cur.execute("INSERT INTO users (email) VALUES (%s)", (email,))
+
+        invite_link = f"http://localhost:5000/accept_invite?email={email}"
+        html_body = f"""
+        <html>
+        <body>
+            <p>You've been invited to join BUG FREE.</p>
+            <p>
+            <a href="{invite_link}" style="display:inline-block;padding:10px 15px;
+                background-color:#28a745;color:white;text-decoration:none;border-radius:4px;">
+                Accept Invite
+            </a>
+            </p>
+        </body>
+        </html>
+        """
+
+        enqueue_email(cur, email, "You're invited!", html_body)
+        conn.commit()
+        cur.close()
+
+    notify_outbox()
     return jsonify({'message': 'Invitation sent'})
 
 @app.route('/accept_invite', methods=['POST'])
@@ -127,25 +128,26 @@ def accept_invite():
     if not email or not name:
         return jsonify({'error': 'Missing email or name'}), 400
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-
-    cur.execute("UPDATE users SET name = %s, is_active = TRUE WHERE email = %s", (name, email))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE users SET name = %s, is_active = TRUE WHERE email = %s", (name, email))
+        conn.commit()
+        cur.close()
 
+    cache.invalidate('users', 'assignees')
     return jsonify({'message': 'Invitation accepted'})
 
 @app.route('/active_users', methods=['GET'])
 def active_users():
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name FROM users WHERE is_active = TRUE")
-    users = [{'id': r[0], 'name': r[1]} for r in cur.fetchall()]
-    cur.close()
-    conn.close()
-    return jsonify(users)
+    def load():
+        with db_conn(readonly=True) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id, name FROM users WHERE is_active = TRUE")
+            users = [User(r[0], r[1]) for r in cur.fetchall()]
+            cur.close()
+        return users
+
+    return cache.json_response(cache.cached_json('users', 'active', load))
 
 @app.route('/assign_user', methods=['POST'])
 def assign_user():
@@ -156,44 +158,46 @@ def assign_user():
     if not user_id or not project_name:
         return jsonify({'error': 'Missing user_id or project_name'}), 400
 
-    conn = get_db_conn()
-    cur = conn.cursor()
+    with db_conn() as conn:
+        cur = conn.cursor()
 
-    # Get email and name of the user
-    cur.execute("SELECT email, name FROM users WHERE id = %s", (user_id,))
-    row = cur.fetchone()
-    if not row:
-        return jsonify({'error': 'User not found'}), 404
-    email, name = row
-
-    # Assign user to the project
-    cur.execute("INSERT INTO project_assignments (user_id, project_name) VALUES (%s, %s)", (user_id, project_name))
-    conn.commit()
-
-    # project/game info to include in the email
-    cur.execute("SELECT phase, category FROM projects WHERE game_name = %s", (project_name,))
-    proj_info = cur.fetchone()
-    phase = proj_info[0] if proj_info else 'N/A'
-    category = proj_info[1] if proj_info else 'N/A'
-
-    cur.close()
-    conn.close()
-
-    # Build email content
-    html_body = f"""
-    <html>
-    <body>
-        <p>Hi {name},</p>
-        <p>You have been assigned to the project: <strong>{project_name}</strong>.</p>
-        <p><strong>Phase:</strong> {phase} <br>
-           <strong>Category:</strong> {category}</p>
-        <p>Please login to your BUG FREE application to view your tickets.</p>
-        <p>Thanks!</p>
-    </body>
-    </html>
-    """
-
-    send_email(email, "Project Assignment Notification", html_body)
+        # Get email and name of the user
+        cur.execute("SELECT email, name FROM users WHERE id = %s", (user_id,))
+        row = cur.fetchone()
+        if not row:
+            cur.close()
+            return jsonify({'error': 'User not found'}), 404
+        email, name = row
+
+        # Assign user to the project
+        cur.execute("INSERT INTO project_assignments (user_id, project_name) VALUES (%s, %s)", (user_id, project_name))
+
+        # project/game info to include in the email
+        cur.execute("SELECT phase, category FROM projects WHERE game_name = %s", (project_name,))
+        proj_info = cur.fetchone()
+        phase = proj_info[0] if proj_info else 'N/A'
+        category = proj_info[1] if proj_info else 'N/A'
+
+        # Build email content
+        html_body = f"""
+        <html>
+        <body>
+            <p>Hi {name},</p>
+            <p>You have been assigned to the project: <strong>{project_name}</strong>.</p>
+            <p><strong>Phase:</strong> {phase} <br>
+               <strong>Category:</strong> {category}</p>
+            <p>Please login to your BUG FREE application to view your tickets.</p>
+            <p>Thanks!</p>
+        </body>
+        </html>
+        """
+
+        enqueue_email(cur, email, "Project Assignment Notification", html_body)
+        conn.commit()
+        cur.close()
+
+    cache.invalidate('assignees')
+    notify_outbox()
     return jsonify({'message': 'User assigned and notified'})
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -208,39 +212,36 @@ def register():
     if not name or not email or not password:
         return "Missing fields", 400
 
-    hashed_pw = generate_password_hash(password)
+    hashed_pw = hash_password(password)
 
-    conn = get_db_conn()
-    cur = conn.cursor()
+    with db_conn() as conn:
+        cur = conn.cursor()
 
-    cur.execute("SELECT id FROM users WHERE email = %s", (email,))
-    if cur.fetchone():
+        cur.execute("SELECT id FROM users WHERE email = %s", (email,))
+        if cur.fetchone():
+            cur.close()
+            return "Email already registered", 409
+
+        cur.execute("INSERT INTO users (name, email, password, is_active) VALUES (%s, %s, %s, TRUE)", (name, email, hashed_pw))
+
+        # Send welcome email
+        html_body = f"""
+        <html>
+        <body>
+            <p>Hi {name},</p>
+            <p>Welcome to <strong>BUG FREE</strong>! </p>
+            <p>Your account has been successfully created. You can now <a href="http://localhost:5000/login">login here</a>.</p>
+            <p>Happy bug tracking!<br>The BUG FREE Team</p>
+        </body>
+        </html>
+        """
+
+        enqueue_email(cur, email, "Welcome to BUG FREE!", html_body)
+        conn.commit()
         cur.close()
-        conn.close()
-        return "Email already registered", 409
-
-    cur.execute("INSERT INTO users (name, email, password, is_active) VALUES (%s, %s, %s, TRUE)", (name, email, hashed_pw))
-    conn.commit()
-    cur.close()
-    conn.close()
-
-    # Send welcome email
-    html_body = f"""
-    <html>
-    <body>
-        <p>Hi {name},</p>
-        <p>Welcome to <strong>BUG FREE</strong>! </p>
-        <p>Your account has been successfully created. You can now <a href="http://localhost:5000/login">login here</a>.</p>
-        <p>Happy bug tracking!<br>The BUG FREE Team</p>
-    </body>
-    </html>
-    """
-
-    try:
-        send_email(email, "Welcome to BUG FREE!", html_body)
-    except Exception as e:
-        print(f"Failed to send welcome email: {e}")
 
+    cache.invalidate('users')
+    notify_outbox()
     return redirect('/login')
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -251,14 +252,23 @@ def login():
     email = request.form.get('email').strip().lower()
     password = request.form.get('password')
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, password FROM users WHERE email = %s AND is_active = TRUE", (email,))
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, name, password FROM users WHERE email = %s AND is_active = TRUE", (email,))
+        user = cur.fetchone()
+        cur.close()
+
+    matches, new_hash = verify_password(user[2], password) if user else (False, None)
+    if matches and new_hash:
+        # Hash parameters changed since this password was stored; upgrade it
+        with db_conn() as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE users SET password = %s WHERE id = %s AND password = %s",
+                        (new_hash, user[0], user[2]))
+            conn.commit()
+            cur.close()
 
-    if user and check_password_hash(user[2], password):
+    if matches:
         session['user_id'] = user[0]
         session['user_name'] = user[1]
         return redirect('/projects')
@@ -277,64 +287,520 @@ def logout():
     return redirect(url_for('login'))
 
 
-@app.route('/get_tickets', methods=['GET'])
-def get_tickets():
-    work_type = request.args.get('workType')
-    game_name = request.args.get('gameName')
-    search = request.args.get('search')
+TICKET_COLUMNS = "id, summary, project, work_type, status, description, assignee, team, game_name"
 
-    conn = get_db_conn()
-    cur = conn.cursor()
+# Board columns in display order
+BOARD_STATUSES = bulk.TICKET_STATUSES
+BOARD_PAGE_SIZE = 50
+BOARD_MAX_PAGE_SIZE = 200
 
-    query = """
-        SELECT id, summary, project, work_type, status, description, assignee, team, game_name
-        FROM tickets
-        WHERE 1=1
+
+# Multi-value filters that also get facet counts: (query arg, column)
+FACET_FILTERS = [
+    ('status', 'status'),
+    ('workType', 'work_type'),
+    ('team', 'team'),
+    ('assignee', 'assignee'),
+]
+
+
+class FilterError(ValueError):
+    pass
+
+
+def parse_date_arg(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise FilterError(f"{name} must be an ISO 8601 date")
+
+
+def parse_multi_arg(args, name):
     """
-    params = []
+    Values of a filter given as repeated parameters, comma separated, or both:
+    ?status=To Do&status=Done or ?status=To Do,Done.
+    """
+    values = []
+    for value in args.getlist(name):
+        values.extend(v.strip() for v in value.split(',') if v.strip())
+    return values
+
 
-    if work_type:
-        query += " AND work_type = %s"
-        params.append(work_type)
+def value_clause(column, values):
+    if len(values) == 1:
+        return f"{column} = %s", values[0]
+    return f"{column} = ANY(%s)", values
+
+
+def build_base_filters(args):
+    """
+    WHERE clauses for every filter except the faceted ones.
+    """
+    game_name = args.get('gameName')
+    search = args.get('search')
+
+    clauses = []
+    params = []
 
     if game_name:
-        query += " AND game_name = %s"
+        clauses.append("game_name = %s")
         params.append(game_name)
 
+    for name, column, op in (('createdFrom', 'created_at', '>='), ('createdTo', 'created_at', '<'),
+                             ('updatedFrom', 'updated_at', '>='), ('updatedTo', 'updated_at', '<')):
+        value = parse_date_arg(args, name)
+        if value:
+            clauses.append(f"{column} {op} %s")
+            params.append(value)
+
     if search:
-        query += " AND (summary ILIKE %s OR description ILIKE %s)"
-        params.extend([f"%{search}%", f"%{search}%"])
+        clause, search_params = ticket_search.ticket_search_clause(search)
+        if clause:
+            clauses.append(clause)
+            params.extend(search_params)
+
+    return clauses, params
+
+
+def facet_filters(args):
+    """
+    (column, clause, param) for each faceted filter in the query string.
+    """
+    filters = []
+    for name, column in FACET_FILTERS:
+        values = parse_multi_arg(args, name)
+        if values:
+            clause, param = value_clause(column, values)
+            filters.append((column, clause, param))
+    return filters
+
 
+def build_ticket_filters(args):
+    """
+    Build the WHERE clauses shared by the ticket listing routes from the
+    request query string.
+    """
+    clauses, params = build_base_filters(args)
+    for _, clause, param in facet_filters(args):
+        clauses.append(clause)
+        params.append(param)
+    return clauses, params
+
+
+def ticket_facets_query(args):
+    """
+    One grouped query counting matching tickets per status, type, team and
+    assignee.
+
+    Each dimension is counted with every filter applied except its own, so a
+    badge shows how many tickets selecting that value would add, not just
+    the ones already selected.
+    """
+    filters = {column: (clause, param) for column, clause, param in facet_filters(args)}
+    columns = [column for _, column in FACET_FILTERS]
+    base_clauses, base_params = build_base_filters(args)
+
+    matches = []
+    match_params = []
+    for column in columns:
+        if column in filters:
+            clause, param = filters[column]
+            matches.append(f"COALESCE({clause}, FALSE) AS {column}_match")
+            match_params.append(param)
+        else:
+            matches.append(f"TRUE AS {column}_match")
+
+    counts = []
+    for column in columns:
+        others = [f"{other}_match" for other in columns if other != column]
+        counts.append(f"count(*) FILTER (WHERE {' AND '.join(others)})")
+
+    query = f"""
+        SELECT GROUPING({', '.join(columns)}), {', '.join(columns)}, {', '.join(counts)}
+        FROM (
+            SELECT {', '.join(columns)}, {', '.join(matches)}
+            FROM tickets
+            WHERE {' AND '.join(base_clauses) or 'TRUE'}
+        ) AS t
+        GROUP BY GROUPING SETS ({', '.join(f'({column})' for column in columns)})
+    """
+    return query, match_params + base_params
+
+
+def facet_counts(rows):
+    """
+    Shape ticket_facets_query() rows as {arg: [{'value', 'count'}, ...]},
+    largest count first and empty values left out.
+    """
+    width = len(FACET_FILTERS)
+    facets = {name: [] for name, _ in FACET_FILTERS}
+    for row in rows:
+        grouping = row[0]
+        for i, (name, _) in enumerate(FACET_FILTERS):
+            # GROUPING() sets a bit for every column not grouped in this row
+            if not grouping & (1 << (width - 1 - i)):
+                value, count = row[1 + i], row[1 + width + i]
+                if value is not None and count:
+                    facets[name].append({'value': value, 'count': count})
+                break
+    for values in facets.values():
+        values.sort(key=lambda v: (-v['count'], v['value']))
+    return facets
+
+
+def fetch_ticket_facets(cur, args):
+    query, params = ticket_facets_query(args)
     cur.execute(query, params)
-    tickets = cur.fetchall()
-
-    ticket_list = []
-    for row in tickets:
-        ticket = {
-            'id': row[0],
-            'summary': row[1],
-            'project': row[2],
-            'work_type': row[3],
-            'status': row[4],
-            'description': row[5],
-            'assignee': row[6],
-            'team': row[7],
-            'game_name': row[8],
-            'attachments': []
+    return facet_counts(cur.fetchall())
+
+
+def wants_facets(args):
+    return args.get('facets') in ('1', 'true')
+
+
+def load_attachments(cur, ticket_ids):
+    # Fetch attachment metadata for all tickets in one round trip
+    attachments_by_ticket = {}
+    if ticket_ids:
+        cur.execute(
+            "SELECT ticket_id, id, filename FROM ticket_attachments WHERE ticket_id = ANY(%s) ORDER BY id",
+            (list(ticket_ids),)
+        )
+        for ticket_id, attachment_id, filename in cur.fetchall():
+            attachments_by_ticket.setdefault(ticket_id, []).append(Attachment(attachment_id, filename))
+    return attachments_by_ticket
+
+
+def store_upload(file):
+    """
+    Stream an uploaded file into the blob store. Call this before opening the
+    transaction that records it, so a slow upload (or S3) holds no locks and
+    no pooled connection. Returns (blob_sha256, size).
+    """
+    return get_blob_store().put(file.stream)
+
+
+def save_attachment(cur, ticket_id, file, stored):
+    """
+    Record an attachment whose body store_upload() already stored.
+    """
+    blob_sha256, size = stored
+    if not hold_blob(cur, blob_sha256):
+        # Garbage collected between the upload and now; store it again
+        file.stream.seek(0)
+        blob_sha256, size = get_blob_store().put(file.stream)
+    cur.execute(
+        """
+        INSERT INTO ticket_attachments (ticket_id, filename, blob_sha256, size, content_type)
+        VALUES (%s, %s, %s, %s, %s) RETURNING id
+        """,
+        (ticket_id, secure_filename(file.filename), blob_sha256, size, file.mimetype or None)
+    )
+    return cur.fetchone()[0]
+
+
+def publish_ticket_change(cur, ticket_id, event_type='updated'):
+    """
+    Tell live boards showing this ticket's game that it changed.
+    """
+    cur.execute("SELECT game_name FROM tickets WHERE id = %s", (ticket_id,))
+    row = cur.fetchone()
+    if row:
+        events.publish(cur, event_type, row[0], ticket_id)
+
+
+def ticket_from_row(row, attachments_by_ticket):
+    return Ticket.from_row(row, attachments_by_ticket.get(row[0], []))
+
+
+def encode_cursor(ticket_id):
+    raw = json.dumps({'id': ticket_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded))['id'])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def parse_page_size(value):
+    try:
+        limit = int(value) if value else BOARD_PAGE_SIZE
+    except ValueError:
+        limit = BOARD_PAGE_SIZE
+    return max(1, min(limit, BOARD_MAX_PAGE_SIZE))
+
+
+def column_pages_query(statuses, clauses, params, limit, after_id=None):
+    """
+    Query for one page per status column, newest ticket first.
+
+    Pages are keyed on the ticket id rather than an OFFSET, so the cost of a
+    page does not depend on how deep into the column the client has scrolled.
+    One extra row per column is read to know whether another page exists.
+    """
+    where = ["status = s.col_status"] + clauses
+    lateral_params = list(params)
+    if after_id is not None:
+        where.append("id < %s")
+        lateral_params.append(after_id)
+
+    query = f"""
+        SELECT page.*
+        FROM unnest(%s::text[]) AS s(col_status)
+        CROSS JOIN LATERAL (
+            SELECT {TICKET_COLUMNS}
+            FROM tickets
+            WHERE {' AND '.join(where)}
+            ORDER BY id DESC
+            LIMIT %s
+        ) AS page
+    """
+    return query, [list(statuses)] + lateral_params + [limit + 1]
+
+
+def rows_by_column(rows, statuses):
+    rows_by_status = {status: [] for status in statuses}
+    for row in rows:
+        rows_by_status[row[4]].append(row)
+    return rows_by_status
+
+
+def column_page_ids(rows_by_status, limit):
+    return [row[0] for status_rows in rows_by_status.values() for row in status_rows[:limit]]
+
+
+def column_pages(rows_by_status, limit, attachments_by_ticket):
+    columns = {}
+    for status, status_rows in rows_by_status.items():
+        page = status_rows[:limit]
+        columns[status] = {
+            'tickets': [ticket_from_row(row, attachments_by_ticket) for row in page],
+            'next_cursor': encode_cursor(page[-1][0]) if len(status_rows) > limit else None
         }
+    return columns
+
+
+def fetch_column_pages(cur, statuses, clauses, params, limit, after_id=None):
+    query, query_params = column_pages_query(statuses, clauses, params, limit, after_id)
+    cur.execute(query, query_params)
+    rows_by_status = rows_by_column(cur.fetchall(), statuses)
+    attachments_by_ticket = load_attachments(cur, column_page_ids(rows_by_status, limit))
+    return column_pages(rows_by_status, limit, attachments_by_ticket)
+
+
+def ticket_list_query(args, clauses, params):
+    query = f"""
+        SELECT {TICKET_COLUMNS}
+        FROM tickets
+        WHERE 1=1
+    """
+    for clause in clauses:
+        query += f" AND {clause}"
+
+    # Best matches first when searching
+    rank, rank_params = ticket_search.ticket_rank_expression(args.get('search'))
+    if rank:
+        query += f" ORDER BY {rank} DESC, id DESC"
+        params = params + rank_params
+
+    if args.get('limit'):
+        query += " LIMIT %s"
+        params = params + [ticket_search.parse_limit(args.get('limit'))]
+    return query, params
+
+
+@app.route('/get_tickets', methods=['GET'])
+def get_tickets():
+    """
+    Tickets matching the filters. status, workType, team and assignee take
+    several values; facets=1 wraps the list as {tickets, facets} with the
+    counts for the filter badges.
+    """
+    clauses, params = build_ticket_filters(request.args)
+    if 'since' in request.args:
+        return get_ticket_changes(clauses, params)
 
-        # Fetch attachments for this ticket
-        cur.execute("SELECT id, filename FROM ticket_attachments WHERE ticket_id = %s", (ticket['id'],))
-        attachments = cur.fetchall()
-        ticket['attachments'] = [{'id': a[0], 'filename': a[1]} for a in attachments]
+    query, params = ticket_list_query(request.args, clauses, params)
 
-        ticket_list.append(ticket)
+    with db_conn(readonly=True) as conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        tickets = cur.fetchall()
+
+        attachments_by_ticket = load_attachments(cur, [row[0] for row in tickets])
+        ticket_list = [ticket_from_row(row, attachments_by_ticket) for row in tickets]
+
+        if wants_facets(request.args):
+            facets = fetch_ticket_facets(cur, request.args)
+            cur.close()
+            return jsonify({'tickets': ticket_list, 'facets': facets})
 
-    cur.close()
-    conn.close()
+        cur.close()
     return jsonify(ticket_list)
 
 
+def get_ticket_changes(clauses, params):
+    """
+    Delta mode of /get_tickets. An empty since= returns every matching ticket
+    and a token; passing that token back returns only the tickets changed
+    since, the ids to drop (deleted or no longer matching) and a new token.
+    """
+    since = request.args.get('since')
+    xmin = sync.decode_token(since) if since else None
+
+    # Always the primary: replicas replay at different speeds, so a token
+    # taken on one could skip changes another has not replayed yet
+    with db_conn() as conn:
+        cur = conn.cursor()
+        watermark = sync.current_watermark(cur)
+        if xmin is None:
+            query = f"SELECT {TICKET_COLUMNS} FROM tickets WHERE 1=1"
+            for clause in clauses:
+                query += f" AND {clause}"
+            cur.execute(query + " ORDER BY id", params)
+            rows, deleted = cur.fetchall(), []
+        else:
+            rows, deleted = sync.changes_since(
+                cur, TICKET_COLUMNS, clauses, params, xmin, request.args.get('gameName')
+            )
+
+        attachments_by_ticket = load_attachments(cur, [row[0] for row in rows])
+        ticket_list = [ticket_from_row(row, attachments_by_ticket) for row in rows]
+        cur.close()
+
+    return jsonify({
+        'tickets': ticket_list,
+        'deleted': deleted,
+        'token': sync.encode_token(watermark),
+    })
+
+
+@app.route('/api/board', methods=['GET'])
+def get_board():
+    """
+    First page of every status column, with a cursor per column for loading
+    more, plus filter counts with facets=1.
+    """
+    clauses, params = build_ticket_filters(request.args)
+    limit = parse_page_size(request.args.get('limit'))
+
+    with db_conn(readonly=True) as conn:
+        cur = conn.cursor()
+        columns = fetch_column_pages(cur, BOARD_STATUSES, clauses, params, limit)
+        board = {'statuses': BOARD_STATUSES, 'columns': columns}
+        if wants_facets(request.args):
+            board['facets'] = fetch_ticket_facets(cur, request.args)
+        cur.close()
+
+    return jsonify(board)
+
+
+@app.route('/api/board/column', methods=['GET'])
+def get_board_column():
+    """
+    Next page of a single status column, starting after the given cursor.
+    """
+    status = request.args.get('status')
+    if not status:
+        return jsonify({'error': 'Missing status'}), 400
+
+    cursor = request.args.get('cursor')
+    try:
+        after_id = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    clauses, params = build_ticket_filters(request.args)
+    limit = parse_page_size(request.args.get('limit'))
+
+    with db_conn(readonly=True) as conn:
+        cur = conn.cursor()
+        columns = fetch_column_pages(cur, [status], clauses, params, limit, after_id)
+        cur.close()
+
+    return jsonify(columns[status])
+
+
+@app.route('/get_ticket/<int:ticket_id>', methods=['GET'])
+def get_ticket(ticket_id):
+    # Boards call this as soon as a change event arrives, often for another
+    # user's write, so a replica could still return the old row
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {TICKET_COLUMNS} FROM tickets WHERE id = %s", (ticket_id,))
+        row = cur.fetchone()
+        attachments_by_ticket = load_attachments(cur, [ticket_id]) if row else {}
+        cur.close()
+
+    if not row:
+        return jsonify({'error': 'Ticket not found'}), 404
+    return jsonify(ticket_from_row(row, attachments_by_ticket))
+
+
+@app.route('/events', methods=['GET'])
+def ticket_events():
+    """
+    Server-Sent Events stream of ticket changes for one game's board.
+    """
+    game_name = request.args.get('game_name')
+    if not game_name:
+        return jsonify({'error': 'Missing game_name'}), 400
+
+    return Response(
+        events.sse_stream(game_name),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/export_tickets', methods=['GET'])
+def export_tickets():
+    """
+    Stream every matching ticket as CSV or NDJSON (format=csv|ndjson), gzipped
+    with gzip=1. Accepts the same filters as /get_tickets.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.EXPORT_FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+
+    clauses, params = build_ticket_filters(request.args)
+
+    filename = f"tickets.{fmt}" + ('.gz' if compress else '')
+    mimetype = 'application/gzip' if compress else export.EXPORT_FORMATS[fmt]
+    return Response(
+        export.stream_tickets(clauses, params, fmt, compress),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+@app.route('/api/search', methods=['GET'])
+def search_tickets():
+    """
+    Ranked ticket search for search-as-you-type; the last word matches as a prefix.
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify([])
+
+    limit = ticket_search.parse_limit(request.args.get('limit'))
+
+    with db_conn(readonly=True) as conn:
+        cur = conn.cursor()
+        results = ticket_search.search_tickets(cur, text, request.args.get('gameName'), limit)
+        cur.close()
+
+    return jsonify(results)
+
+
 @app.route('/update_ticket/<int:ticket_id>', methods=['POST'])
 def update_ticket(ticket_id):
     if request.content_type.startswith('multipart/form-data'):
@@ -342,18 +808,14 @@ def update_ticket(ticket_id):
         if not attachment:
             return jsonify({'error': 'No attachment file provided'}), 400
 
-        filename = secure_filename(attachment.filename)
-        data = attachment.read()
-
-        conn = get_db_conn()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO ticket_attachments (ticket_id, filename, data) VALUES (%s, %s, %s)",
-            (ticket_id, filename, data)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        stored = store_upload(attachment)
+        with db_conn() as conn:
+            cur = conn.cursor()
+            attachment_id = save_attachment(cur, ticket_id, attachment, stored)
+            publish_ticket_change(cur, ticket_id)
+            conn.commit()
+            cur.close()
+        schedule_thumbnails([attachment_id])
         return jsonify({'message': 'Attachment saved'}), 200
 
     data = request.json or {}
@@ -362,79 +824,49 @@ def update_ticket(ticket_id):
 
     allowed_fields = ['summary','project','work_type','status','description','assignee','team','game_name']
 
-    conn = get_db_conn()
-    cur = conn.cursor()
+    with db_conn() as conn:
+        cur = conn.cursor()
 
-    cur.execute("SELECT assignee, status, summary FROM tickets WHERE id = %s", (ticket_id,))
-    old_ticket = cur.fetchone()
-    if not old_ticket:
-        cur.close()
-        conn.close()
-        return jsonify({'error': 'Ticket not found'}), 404
+        cur.execute("SELECT assignee, status, summary, game_name FROM tickets WHERE id = %s", (ticket_id,))
+        old_ticket = cur.fetchone()
+        if not old_ticket:
+            cur.close()
+            return jsonify({'error': 'Ticket not found'}), 404
 
-    old_assignee, old_status, summary = old_ticket
+        old_assignee, old_status, summary, old_game_name = old_ticket
 
-    updates = []
-    params = []
-    for field in allowed_fields:
-        if field in data:
-            updates.append(f"{field} = %s")
-            params.append(data[field])
+        updates = []
+        params = []
+        for field in allowed_fields:
+            if field in data:
+                updates.append(f"{field} = %s")
+                params.append(data[field])
+
+        if not updates:
+            cur.close()
+            return jsonify({'message': 'No fields to update'}), 400
+
+        params.append(ticket_id)
+        update_query = f"UPDATE tickets SET {', '.join(updates)} WHERE id = %s"
+        cur.execute(update_query, params)
+
+        events.publish(cur, 'updated', data.get('game_name', old_game_name), ticket_id)
+        if data.get('game_name', old_game_name) != old_game_name:
+            # Boards for the old game need to drop the card
+            events.publish(cur, 'updated', old_game_name, ticket_id)
+
+        new_status = data.get('status', old_status)
+        new_assignee = data.get('assignee', old_assignee)
+
+        if new_assignee and ((new_status != old_status) or (str(new_assignee) != str(old_assignee))):
+            notifications.notify(cur, 'updated', {new_assignee: [ticket_id]})
 
-    if not updates:
+        conn.commit()
         cur.close()
-        conn.close()
-        return jsonify({'message': 'No fields to update'}), 400
-
-    params.append(ticket_id)
-    update_query = f"UPDATE tickets SET {', '.join(updates)} WHERE id = %s"
-    cur.execute(update_query, params)
-    conn.commit()
-
-    new_status = data.get('status', old_status)
-    new_assignee = data.get('assignee', old_assignee)
-
-    if (new_status != old_status) or (new_assignee != old_assignee):
-        if new_assignee:
-            cur.execute("SELECT email, name FROM users WHERE id = %s", (new_assignee,))
-            user = cur.fetchone()
-            if user:
-                to_email, user_name = user
-
-                cur.execute("""
-                    SELECT summary, description, project, status, work_type, game_name
-                    FROM tickets WHERE id = %s
-                """, (ticket_id,))
-                ticket_details = cur.fetchone()
-
-                if ticket_details:
-                    summary, description, project, status, work_type, game_name = ticket_details
-
-                    html_content = f"""
-                    <html>
-                    <body>
-                        <p>Hello {user_name},</p>
-                        <p>This ticket has been updated:</p>
-                        <ul>
-                            <li><strong>Summary:</strong> {summary}</li>
-                            <li><strong>Description:</strong> {description}</li>
-                            <li><strong>Project:</strong> {project}</li>
-                            <li><strong>Status:</strong> {status}</li>
-                            <li><strong>Work Type:</strong> {work_type}</li>
-                            <li><strong>Game Name:</strong> {game_name}</li>
-                        </ul>
-                    </body>
-                    </html>
-                    """
-                    try:
-                        send_email(to_email, f"Ticket Updated: {summary}", html_content)
-                        print(f"Notification email sent to {to_email}")
-                    except Exception as e:
-                        print(f"Error sending update email: {e}")
-
-    cur.close()
-    conn.close()
 
+    if 'game_name' in data:
+        cache.invalidate('game_names')
+    notify_outbox()
     return jsonify({'message': 'Ticket updated successfully'})
 
 @app.route('/api/assignees')
@@ -443,9 +875,6 @@ def get_project_assignees():
     if not project:
         return jsonify([])
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-
     query = '''
         SELECT users.id, users.name
         FROM users
@@ -453,13 +882,38 @@ def get_project_assignees():
         WHERE project_invitations.status = 'accepted'
         AND project_invitations.project_name = %s
     '''
-    cur.execute(query, (project,))
-    rows = cur.fetchall()
 
-    cur.close()
-    conn.close()
+    def load():
+        with db_conn(readonly=True) as conn:
+            cur = conn.cursor()
+            cur.execute(query, (project,))
+            rows = cur.fetchall()
+            cur.close()
+        return [User(row[0], row[1]) for row in rows]
+
+    return cache.json_response(cache.cached_json('assignees', project, load))
+
+def project_list_query(search, game_filter, limit=None):
+    query = "SELECT id, game_name, phase, category FROM projects WHERE 1=1"
+    params = []
+
+    if search:
+        clause, search_params = ticket_search.project_search_clause(search)
+        query += f" AND {clause}"
+        params.extend(search_params)
+    if game_filter:
+        query += " AND game_name = %s"
+        params.append(game_filter)
+    if search:
+        # Closest names first, so typos still surface the intended project
+        rank, rank_params = ticket_search.project_rank_expression(search)
+        query += f" ORDER BY {rank} DESC, game_name"
+        params.extend(rank_params)
+    if limit:
+        query += " LIMIT %s"
+        params.append(ticket_search.parse_limit(limit))
+    return query, params
 
-    return jsonify([{'id': row[0], 'name': row[1]} for row in rows])
 
 @app.route('/api/projects', methods=['GET'])
 def get_projects():
@@ -468,33 +922,36 @@ def get_projects():
     """
     search = request.args.get('search', '').strip()
     game_filter = request.args.get('game_name', '').strip()
+    query, params = project_list_query(search, game_filter, request.args.get('limit'))
+
+    def load():
+        with db_conn(readonly=True) as conn:
+            cur = conn.cursor()
+            if search:
+                ticket_search.set_project_similarity(cur)
+            cur.execute(query, tuple(params))
+            rows = cur.fetchall()
+            cur.close()
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-
-    query = "SELECT id, game_name, phase, category FROM projects WHERE 1=1"
-    params = []
+        return [Project(r[0], r[1], r[2], r[3]) for r in rows]
 
-    if search:
-        query += " AND LOWER(game_name) LIKE %s"
-        params.append(f"%{search.lower()}%")
-    if game_filter:
-        query += " AND game_name = %s"
-        params.append(game_filter)
+    key = json.dumps([search, game_filter, request.args.get('limit')])
+    return cache.json_response(cache.cached_json('projects', key, load))
 
-    cur.execute(query, tuple(params))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+@app.route('/api/projects/stats', methods=['GET'])
+def get_project_stats():
+    """
+    Ticket counts per project from the maintained counters, optionally for
+    one game_name; never scans tickets.
+    """
+    game_name = request.args.get('game_name', '').strip() or None
 
-    projects = [{
-        "id": r[0],
-        "game_name": r[1],
-        "phase": r[2],
-        "categories": r[3]
-    } for r in rows]
+    with db_conn(readonly=True) as conn:
+        cur = conn.cursor()
+        result = stats.project_stats(cur, game_name)
+        cur.close()
 
-    return jsonify(projects)
+    return jsonify(result)
 
 @app.route('/create_project', methods=['POST'])
 def create_project():
@@ -512,27 +969,27 @@ def create_project():
     print(f"Creating project with: game_name={game_name}, phase={phase}, categories={categories}")
 
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
+        with db_conn() as conn:
+            cur = conn.cursor()
 
-        # Check if project already exists
-        cur.execute("SELECT 1 FROM projects WHERE game_name = %s", (game_name,))
-        exists = cur.fetchone()
+            # Check if project already exists
+            cur.execute("SELECT 1 FROM projects WHERE game_name = %s", (game_name,))
+            exists = cur.fetchone()
 
-        if exists:
-            cur.close()
-            conn.close()
-            return jsonify({'error': 'Project already exists'}), 400
+            if exists:
+                cur.close()
+                return jsonify({'error': 'Project already exists'}), 400
 
-        # Insert new project
-        cur.execute(
-            "INSERT INTO projects (game_name, phase, category) VALUES (%s, %s, %s)",
-            (game_name, phase, categories)
-        )
+            # Insert new project
+            cur.execute(
+                "INSERT INTO projects (game_name, phase, category) VALUES (%s, %s, %s)",
+                (game_name, phase, categories)
+            )
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            conn.commit()
+            cur.close()
+
+        cache.invalidate('projects')
         return jsonify({'message': 'Project created successfully'})
 
     except Exception as e:
@@ -542,13 +999,15 @@ def create_project():
 
 @app.route('/get_game_names', methods=['GET'])
 def get_game_names():
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT DISTINCT game_name FROM tickets WHERE game_name IS NOT NULL AND game_name != ''")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([row[0] for row in rows])
+    def load():
+        with db_conn(readonly=True) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT DISTINCT game_name FROM tickets WHERE game_name IS NOT NULL AND game_name != ''")
+            rows = cur.fetchall()
+            cur.close()
+        return [row[0] for row in rows]
+
+    return cache.json_response(cache.cached_json('game_names', 'all', load))
 
 
 @app.route('/submit_ticket', methods=['POST'])
@@ -565,167 +1024,426 @@ def submit_ticket():
 
 
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
+        # Upload before the INSERT: its stats triggers lock the game's
+        # counters until commit, and other writes to the game queue behind them
+        files = [(file, store_upload(file)) for file in request.files.getlist('attachment')
+                 if file and file.filename]
 
-        cur.execute(
-            """
-            INSERT INTO tickets 
-            (project, work_type, status, summary, description, assignee, team, game_name)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
-            """,
-            (project, work_type, status, summary, description, assignee, team, game_name)
-        )
-        ticket_id = cur.fetchone()[0]
-
-        files = request.files.getlist('attachment')  
-        for file in files:
-            if file and file.filename:
-                filename = secure_filename(file.filename)
-                file_data = file.read()
-                cur.execute(
-                    "INSERT INTO ticket_attachments (ticket_id, filename, data) VALUES (%s, %s, %s)",
-                    (ticket_id, filename, file_data)
-                )
+        with db_conn() as conn:
+            cur = conn.cursor()
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            cur.execute(
+                """
+                INSERT INTO tickets 
+                (project, work_type, status, summary, description, assignee, team, game_name)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
+                """,
+                (project, work_type, status, summary, description, assignee, team, game_name)
+            )
+            ticket_id = cur.fetchone()[0]
 
-        if assignee:
-            try:
-                conn = get_db_conn()
-                cur = conn.cursor()
-                cur.execute("SELECT name, email FROM users WHERE id = %s", (assignee,))
-                user = cur.fetchone()
-                cur.close()
-                conn.close()
-
-                if user:
-                    assignee_name, assignee_email = user
-                    html_content = f"""
-                    <html>
-                    <body>
-                        <p>Hello {assignee_name},</p>
-                        <p>You have been assigned a new ticket:</p>
-                        <ul>
-                            <li><strong>Summary:</strong> {summary}</li>
-                            <li><strong>Description:</strong> {description}</li>
-                            <li><strong>Project:</strong> {project}</li>
-                            <li><strong>Work Type:</strong> {work_type}</li>
-                            <li><strong>Status:</strong> {status}</li>
-                            <li><strong>Game Name:</strong> {game_name}</li>
-                        </ul>
-                        <p>Please log in to <a href="http://localhost:5000">BUG FREE</a> to view the details.</p>
-                    </body>
-                    </html>
-                    """
-                    send_email(assignee_email, f"New Ticket Assigned: {summary}", html_content)
-                    print(f"Email sent to {assignee_email}")
-            except Exception as e:
-                print(f"Error sending email to assignee: {e}")
+            attachment_ids = [save_attachment(cur, ticket_id, file, stored) for file, stored in files]
+
+            events.publish(cur, 'created', game_name, ticket_id)
+
+            if assignee:
+                notifications.notify(cur, 'assigned', {assignee: [ticket_id]})
 
+            conn.commit()
+            cur.close()
+
+        cache.invalidate('game_names')
+        notify_outbox()
+        schedule_thumbnails(attachment_ids)
         return jsonify({'ticket_id': ticket_id}), 201
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/ticket_attachment/<int:ticket_id>', methods=['GET'])
-def ticket_attachment(ticket_id):
+BYTEA_CHUNK_SIZE = 1024 * 1024
+
+
+def bytea_reader(query, row_id):
+    """
+    Range reader for bodies still stored as BYTEA. Each chunk is fetched with
+    substring() so only the requested bytes leave the database. Chunks always
+    come from the primary, so one download never mixes replicas at different
+    lag.
+    """
+    def read_range(start, length):
+        offset, end = start, start + length
+        while offset < end:
+            size = min(BYTEA_CHUNK_SIZE, end - offset)
+            with db_conn() as conn:
+                cur = conn.cursor()
+                # substring() offsets are 1-based
+                cur.execute(query, (offset + 1, size, row_id))
+                row = cur.fetchone()
+                cur.close()
+            if not row or not row[0]:
+                break
+            yield bytes(row[0])
+            offset += size
+    return read_range
+
+
+@app.route('/api/tickets/bulk_import', methods=['POST'])
+def bulk_import_tickets():
+    """
+    Create many tickets from a CSV, NDJSON or JSON array body. Invalid rows are
+    skipped and reported with their row number.
+    """
     try:
-        conn = get_db_conn()
+        rows = bulk.parse_rows(request)
+    except bulk.BulkError as e:
+        return jsonify({'error': str(e)}), 400
+
+    with db_conn() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT attachment, attachment_filename FROM tickets WHERE id = %s", (ticket_id,))
-        row = cur.fetchone()
+        try:
+            created, errors = bulk.import_tickets(cur, rows)
+        except bulk.BulkError as e:
+            cur.close()
+            return jsonify({'error': str(e)}), 400
+
+        ticket_ids_by_assignee = {}
+        for _, ticket_id, ticket in created:
+            if ticket.get('assignee'):
+                ticket_ids_by_assignee.setdefault(ticket['assignee'], []).append(ticket_id)
+        notifications.notify(cur, 'assigned', ticket_ids_by_assignee)
+
+        # One reload hint per game rather than one event per imported ticket
+        for game_name in {ticket['game_name'] for _, _, ticket in created}:
+            events.publish(cur, 'bulk', game_name)
+
+        conn.commit()
         cur.close()
-        conn.close()
+
+    if created:
+        cache.invalidate('game_names')
+    notify_outbox()
+    return jsonify({
+        'created': len(created),
+        'tickets': [{'row': number, 'id': ticket_id} for number, ticket_id, _ in created],
+        'errors': errors
+    }), 201 if created else 400
+
+
+@app.route('/api/tickets/bulk_update', methods=['POST'])
+def bulk_update_tickets():
+    """
+    Update many tickets at once. Accepts {"ids": [...], "set": {...}} to apply
+    the same change everywhere, or per-ticket rows (each with an id) as CSV,
+    NDJSON or a JSON array.
+    """
+    data = request.get_json(silent=True) if request.mimetype == 'application/json' else None
+    if isinstance(data, dict) and 'ids' in data:
+        changes = data.get('set') or {}
+        if not isinstance(data['ids'], list) or not isinstance(changes, dict):
+            return jsonify({'error': 'Expected "ids" as a list and "set" as an object'}), 400
+        rows = [dict(changes, id=ticket_id) for ticket_id in data['ids']]
+    else:
+        try:
+            rows = bulk.parse_rows(request)
+        except bulk.BulkError as e:
+            return jsonify({'error': str(e)}), 400
+
+    with db_conn() as conn:
+        cur = conn.cursor()
+        try:
+            changes, errors = bulk.update_tickets(cur, rows)
+        except bulk.BulkError as e:
+            cur.close()
+            return jsonify({'error': str(e)}), 400
+
+        ticket_ids_by_assignee = {}
+        game_names = set()
+        game_moved = False
+        for ticket_id, old_assignee, old_status, old_game, new_assignee, new_status, new_game in changes:
+            if new_assignee and (new_status != old_status or str(new_assignee) != str(old_assignee)):
+                ticket_ids_by_assignee.setdefault(new_assignee, []).append(ticket_id)
+            # Boards of the game a ticket left need the reload hint too
+            game_names.update((old_game, new_game))
+            game_moved = game_moved or new_game != old_game
+        notifications.notify(cur, 'updated', ticket_ids_by_assignee)
+
+        for game_name in game_names:
+            events.publish(cur, 'bulk', game_name)
+
+        conn.commit()
+        cur.close()
+
+    if game_moved:
+        cache.invalidate('game_names')
+    notify_outbox()
+    return jsonify({
+        'updated': len(changes),
+        'ticket_ids': [change[0] for change in changes],
+        'errors': errors
+    })
+
+
+@app.route('/ticket_attachment/<int:ticket_id>', methods=['GET'])
+def ticket_attachment(ticket_id):
+    try:
+        with db_conn(readonly=True) as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT octet_length(attachment), attachment_filename
+                FROM tickets WHERE id = %s
+            """, (ticket_id,))
+            row = cur.fetchone()
+            cur.close()
 
         if not row or not row[0]:
             return jsonify({'error': 'No attachment found'}), 404
 
-        attachment_data, filename = row
-        return send_file(
-            BytesIO(attachment_data),
-            download_name=filename,  
-            as_attachment=True
+        size, filename = row
+        # Same validator as legacy rows in get_attachment: nothing rewrites
+        # the legacy column, so no need to hash it on every request
+        return send_ranged(
+            bytea_reader("SELECT substring(attachment from %s for %s) FROM tickets WHERE id = %s", ticket_id),
+            size,
+            f"bytea-ticket-{ticket_id}-{size}",
+            filename
         )
-    except Exception as e:
+    except (psycopg2.Error, OSError) as e:
         return jsonify({'error': str(e)}), 500
     
 
 @app.route('/upload_attachment/<int:ticket_id>', methods=['POST'])
 def upload_attachment(ticket_id):
     try:
-        files = request.files.getlist('attachments')
-        conn = get_db_conn()
-        cur = conn.cursor()
+        files = [(file, store_upload(file)) for file in request.files.getlist('attachments') if file.filename]
+        with db_conn() as conn:
+            cur = conn.cursor()
 
-        inserted_ids = []
-        for file in files:
-            if file.filename:
-                data = file.read()
-                filename = secure_filename(file.filename)
-                cur.execute(
-                    "INSERT INTO ticket_attachments (ticket_id, filename, data) VALUES (%s, %s, %s) RETURNING id",
-                    (ticket_id, filename, data)
-                )
-                new_id = cur.fetchone()[0]
+            inserted_ids = []
+            for file, stored in files:
+                new_id = save_attachment(cur, ticket_id, file, stored)
                 inserted_ids.append(new_id)
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            if inserted_ids:
+                publish_ticket_change(cur, ticket_id)
+
+            conn.commit()
+            cur.close()
 
+        schedule_thumbnails(inserted_ids)
         return jsonify({'status': 'ok', 'inserted_ids': inserted_ids})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
-@app.route('/attachment/<int:attachment_id>', methods=['GET'])
-def get_attachment(attachment_id):
-    try:
-        conn = get_db_conn()
+@app.route('/api/notification_preferences', methods=['GET', 'POST'])
+def notification_preferences():
+    """
+    The logged-in user's ticket email mode: 'immediate' or 'digest'.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    with db_conn() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT data, filename FROM ticket_attachments WHERE id = %s", (attachment_id,))
+        if request.method == 'POST':
+            mode = (request.get_json(silent=True) or {}).get('mode')
+            try:
+                notifications.set_mode(cur, user_id, mode)
+            except ValueError as e:
+                cur.close()
+                return jsonify({'error': str(e)}), 400
+            conn.commit()
+        cur.execute("SELECT COALESCE(notify_mode, %s) FROM users WHERE id = %s",
+                    (notifications.NOTIFY_DEFAULT_MODE, user_id))
         row = cur.fetchone()
         cur.close()
-        conn.close()
+
+    if not row:
+        return jsonify({'error': 'User not found'}), 404
+    return jsonify({'mode': row[0], 'digest_window_seconds': notifications.NOTIFY_DIGEST_WINDOW})
+
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """
+    Start a resumable upload for a large attachment; see uploads.py.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    if not data.get('ticket_id') or not filename:
+        return jsonify({'error': 'ticket_id and filename are required'}), 400
+    try:
+        ticket_id = int(data['ticket_id'])
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'ticket_id and size must be integers'}), 400
+
+    sha256 = (data.get('sha256') or '').lower() or None
+    session_info = uploads.create_session(ticket_id, filename, size, data.get('content_type') or None, sha256)
+    return jsonify(session_info), 201
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    return jsonify(uploads.session_status(upload_id))
+
+
+@app.route('/api/uploads/<upload_id>/chunks/<int:offset>', methods=['PUT'])
+def put_upload_chunk(upload_id, offset):
+    status = uploads.write_chunk(upload_id, offset, request.stream, request.headers.get('X-Chunk-SHA256'))
+    return jsonify(status)
+
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    _, attachment_id, created = uploads.finalize(upload_id)
+    if created:
+        schedule_thumbnails([attachment_id])
+    return jsonify({'status': 'ok', 'attachment_id': attachment_id}), 201 if created else 200
+
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    uploads.abort(upload_id)
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/attachment/<int:attachment_id>', methods=['GET'])
+def get_attachment(attachment_id):
+    try:
+        with db_conn(readonly=True) as conn:
+            cur = conn.cursor()
+            # Rows not yet migrated to the blob store still carry BYTEA data
+            cur.execute("""
+                SELECT blob_sha256, size, filename, content_type,
+                       CASE WHEN blob_sha256 IS NULL THEN octet_length(data) END
+                FROM ticket_attachments WHERE id = %s
+            """, (attachment_id,))
+            row = cur.fetchone()
+            cur.close()
 
         if not row:
             return jsonify({'error': 'Attachment not found'}), 404
 
-        data, filename = row
-        return send_file(
-            BytesIO(data),
-            download_name=filename,
-            as_attachment=True
-        )
-    except Exception as e:
+        blob_sha256, size, filename, content_type, bytea_size = row
+        if blob_sha256:
+            store = get_blob_store()
+            try:
+                if size is None:
+                    size = store.size(blob_sha256)
+            except BlobNotFound:
+                return jsonify({'error': 'Attachment data missing'}), 404
+            read_range = lambda start, length: store.read_range(blob_sha256, start, length)
+            etag = blob_sha256
+        elif bytea_size is not None:
+            size = bytea_size
+            read_range = bytea_reader(
+                "SELECT substring(data from %s for %s) FROM ticket_attachments WHERE id = %s", attachment_id)
+            # Attachment data is never rewritten in place, so id and size
+            # identify it without hashing the whole value on every request
+            etag = f"bytea-{attachment_id}-{size}"
+        else:
+            return jsonify({'error': 'Attachment data missing'}), 404
+
+        return send_ranged(read_range, size, etag, filename, content_type)
+    except BlobNotFound:
+        return jsonify({'error': 'Attachment data missing'}), 404
+    except (psycopg2.Error, OSError) as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/attachment/<int:attachment_id>/thumbnail', methods=['GET'])
+def get_attachment_thumbnail(attachment_id):
+    """
+    Fixed-size preview of an image attachment, falling back to the original
+    until the preview has been rendered.
+    """
+    try:
+        requested = int(request.args.get('size', THUMBNAIL_SIZES[0]))
+    except ValueError:
+        requested = THUMBNAIL_SIZES[0]
+    # Smallest rendered size that covers the request
+    size = next((s for s in sorted(THUMBNAIL_SIZES) if s >= requested), max(THUMBNAIL_SIZES))
+
+    path = thumbnail_path(attachment_id, size)
+    if not os.path.exists(path):
+        with db_conn(readonly=True) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT filename, content_type, blob_sha256 FROM ticket_attachments WHERE id = %s",
+                (attachment_id,)
+            )
+            row = cur.fetchone()
+            cur.close()
+        if not row:
+            return jsonify({'error': 'Attachment not found'}), 404
+        schedule_missing(attachment_id, *row)
+        return redirect(url_for('get_attachment', attachment_id=attachment_id))
+
+    return send_file(path, mimetype=thumbnail_mimetype(), max_age=ATTACHMENT_MAX_AGE, conditional=True)
+
 @app.route('/delete_attachment/<int:attachment_id>', methods=['DELETE'])
 def delete_attachment(attachment_id):
     print(f"Delete request received for attachment: {attachment_id}")
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
+        with db_conn() as conn:
+            cur = conn.cursor()
 
-        # Optional: Check if attachment exists first
-        cur.execute("SELECT id FROM ticket_attachments WHERE id = %s", (attachment_id,))
-        if cur.fetchone() is None:
+            # Optional: Check if attachment exists first
+            cur.execute("SELECT ticket_id FROM ticket_attachments WHERE id = %s", (attachment_id,))
+            row = cur.fetchone()
+            if row is None:
+                cur.close()
+                return jsonify({'error': 'Attachment not found'}), 404
+
+            # Delete the attachment
+            cur.execute("DELETE FROM ticket_attachments WHERE id = %s", (attachment_id,))
+            publish_ticket_change(cur, row[0])
+            conn.commit()
             cur.close()
-            conn.close()
-            return jsonify({'error': 'Attachment not found'}), 404
 
-        # Delete the attachment
-        cur.execute("DELETE FROM ticket_attachments WHERE id = %s", (attachment_id,))
-        conn.commit()
-        cur.close()
-        conn.close()
+        delete_thumbnails(attachment_id)
 
         return jsonify({'message': 'Attachment deleted successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/pool_stats', methods=['GET'])
+def get_pool_stats():
+    return jsonify(pool_stats())
+
+@app.errorhandler(FilterError)
+def handle_filter_error(e):
+    return jsonify({'error': str(e)}), 400
+
+@app.errorhandler(sync.SyncTokenExpired)
+def handle_sync_token_expired(e):
+    return jsonify({'error': str(e)}), 410
+
+@app.errorhandler(sync.SyncTokenError)
+def handle_sync_token_error(e):
+    return jsonify({'error': str(e)}), 400
+
+@app.errorhandler(uploads.UploadNotFound)
+def handle_upload_not_found(e):
+    return jsonify({'error': str(e)}), 404
+
+@app.errorhandler(uploads.UploadConflict)
+def handle_upload_conflict(e):
+    return jsonify({'error': str(e)}), 409
+
+@app.errorhandler(uploads.UploadError)
+def handle_upload_error(e):
+    return jsonify({'error': str(e)}), 400
+
+@app.errorhandler(PasswordPoolBusy)
+def handle_password_pool_busy(e):
+    return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    print(f"Database pool exhausted: {e}")
+    return jsonify({'error': 'Database busy, please retry'}), 503
+
 if __name__ == '__main__':
     app.run(debug=True)
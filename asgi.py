@@ -0,0 +1,525 @@
+"""
+ASGI serving mode.
+
+    uvicorn asgi:application --workers 2
+
+The hot read routes (ticket listing, board pages, single tickets and attachment
+downloads) are served natively on the event loop through an asyncpg pool, and
+/events streams are fed from the process's event listener without holding a
+thread, so a
+slow client or a long query no longer pins a worker thread. Every other route
+is handed to the unchanged Flask app on a bounded thread pool, so URLs, request
+formats and JSON responses are identical in both modes. Request bodies reach
+Flask as a stream read off the connection on demand, and are refused once they
+pass MAX_CONTENT_LENGTH.
+
+Native routes still run inside a Flask request context, so they reuse the
+Flask app's filter parsing, error handlers, Range/ETag handling and request
+hooks. /metrics records their latency and status, but not their SQL, because
+asyncpg queries bypass the instrumented psycopg2 cursor.
+
+Needs asyncpg and an ASGI server (pip install asyncpg uvicorn; both are in
+requirements-optional.txt).
+"""
+import asyncio
+import io
+import itertools
+import json
+import os
+import queue
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from flask import Response, jsonify, request
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+
+import app as flask_app
+import events
+from app import app
+from blobstore import get_blob_store, BlobNotFound
+from db import connection_kwargs
+from downloads import send_ranged
+from models import Attachment
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+ASYNC_DB_POOL_MIN = int(os.environ.get('ASYNC_DB_POOL_MIN', '2'))
+ASYNC_DB_POOL_MAX = int(os.environ.get('ASYNC_DB_POOL_MAX', '10'))
+# Threads for routes served by the Flask app
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', '32'))
+# Threads that pull chunks of streamed responses (downloads, exports), kept
+# apart so long downloads cannot starve ordinary requests
+ASGI_STREAM_THREADS = int(os.environ.get('ASGI_STREAM_THREADS', '32'))
+
+_PARAM_RE = re.compile(r'%%|%s')
+
+
+def to_asyncpg(query):
+    """
+    Rewrite a psycopg2 query (%s placeholders, %% literals) for asyncpg ($n).
+    """
+    counter = itertools.count(1)
+    return _PARAM_RE.sub(lambda m: '%' if m.group() == '%%' else f'${next(counter)}', query)
+
+
+class AsyncDatabase:
+    def __init__(self):
+        self.pool = None
+
+    async def start(self):
+        if asyncpg is None:
+            raise RuntimeError("ASGI mode requires asyncpg (pip install asyncpg)")
+        kwargs = connection_kwargs()
+        self.pool = await asyncpg.create_pool(
+            host=kwargs['host'], port=kwargs['port'], database=kwargs['dbname'],
+            user=kwargs['user'], password=kwargs['password'],
+            min_size=ASYNC_DB_POOL_MIN, max_size=ASYNC_DB_POOL_MAX,
+        )
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def stats(self):
+        if self.pool is None:
+            return {}
+        return {
+            'min_size': self.pool.get_min_size(),
+            'max_size': self.pool.get_max_size(),
+            'size': self.pool.get_size(),
+            'idle': self.pool.get_idle_size(),
+        }
+
+
+database = AsyncDatabase()
+
+
+async def load_attachments(conn, ticket_ids):
+    attachments_by_ticket = {}
+    if ticket_ids:
+        rows = await conn.fetch(
+            "SELECT ticket_id, id, filename FROM ticket_attachments WHERE ticket_id = ANY($1::int[]) ORDER BY id",
+            list(ticket_ids)
+        )
+        for ticket_id, attachment_id, filename in rows:
+            attachments_by_ticket.setdefault(ticket_id, []).append(Attachment(attachment_id, filename))
+    return attachments_by_ticket
+
+
+async def fetch_ticket_facets(conn):
+    query, params = flask_app.ticket_facets_query(request.args)
+    return flask_app.facet_counts(await conn.fetch(to_asyncpg(query), *params))
+
+
+async def get_tickets():
+    clauses, params = flask_app.build_ticket_filters(request.args)
+    query, params = flask_app.ticket_list_query(request.args, clauses, params)
+    async with database.pool.acquire() as conn:
+        rows = await conn.fetch(to_asyncpg(query), *params)
+        attachments_by_ticket = await load_attachments(conn, [row[0] for row in rows])
+        facets = await fetch_ticket_facets(conn) if flask_app.wants_facets(request.args) else None
+    tickets = [flask_app.ticket_from_row(row, attachments_by_ticket) for row in rows]
+    if facets is not None:
+        return jsonify({'tickets': tickets, 'facets': facets})
+    return jsonify(tickets)
+
+
+async def fetch_column_pages(statuses, clauses, params, limit, after_id=None):
+    query, params = flask_app.column_pages_query(statuses, clauses, params, limit, after_id)
+    async with database.pool.acquire() as conn:
+        rows_by_status = flask_app.rows_by_column(await conn.fetch(to_asyncpg(query), *params), statuses)
+        attachments_by_ticket = await load_attachments(conn, flask_app.column_page_ids(rows_by_status, limit))
+    return flask_app.column_pages(rows_by_status, limit, attachments_by_ticket)
+
+
+async def get_board():
+    clauses, params = flask_app.build_ticket_filters(request.args)
+    limit = flask_app.parse_page_size(request.args.get('limit'))
+    columns = await fetch_column_pages(flask_app.BOARD_STATUSES, clauses, params, limit)
+    board = {'statuses': flask_app.BOARD_STATUSES, 'columns': columns}
+    if flask_app.wants_facets(request.args):
+        async with database.pool.acquire() as conn:
+            board['facets'] = await fetch_ticket_facets(conn)
+    return jsonify(board)
+
+
+async def get_board_column():
+    status = request.args.get('status')
+    if not status:
+        return jsonify({'error': 'Missing status'}), 400
+
+    cursor = request.args.get('cursor')
+    try:
+        after_id = flask_app.decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    clauses, params = flask_app.build_ticket_filters(request.args)
+    limit = flask_app.parse_page_size(request.args.get('limit'))
+    columns = await fetch_column_pages([status], clauses, params, limit, after_id)
+    return jsonify(columns[status])
+
+
+async def get_ticket(ticket_id):
+    async with database.pool.acquire() as conn:
+        row = await conn.fetchrow(
+            f"SELECT {flask_app.TICKET_COLUMNS} FROM tickets WHERE id = $1", ticket_id)
+        attachments_by_ticket = await load_attachments(conn, [ticket_id]) if row else {}
+    if not row:
+        return jsonify({'error': 'Ticket not found'}), 404
+    return jsonify(flask_app.ticket_from_row(row, attachments_by_ticket))
+
+
+async def get_attachment(attachment_id):
+    async with database.pool.acquire() as conn:
+        row = await conn.fetchrow(
+            "SELECT blob_sha256, size, filename, content_type FROM ticket_attachments WHERE id = $1",
+            attachment_id
+        )
+    if not row:
+        return jsonify({'error': 'Attachment not found'}), 404
+
+    blob_sha256, size, filename, content_type = row
+    if not blob_sha256:
+        # Legacy BYTEA rows are rare; let the Flask route stream them
+        return None
+
+    store = get_blob_store()
+    loop = asyncio.get_running_loop()
+    # send_ranged() only decides which slice the response needs; opening it
+    # may be a network call (S3), so that runs on the thread pool
+    wanted = []
+    try:
+        if size is None:
+            size = await loop.run_in_executor(_executor, store.size, blob_sha256)
+        response = send_ranged(lambda start, length: wanted.append((start, length)) or [],
+                               size, blob_sha256, filename, content_type)
+        if wanted:
+            response.response = await loop.run_in_executor(_executor, store.read_range, blob_sha256, *wanted[0])
+    except BlobNotFound:
+        return jsonify({'error': 'Attachment data missing'}), 404
+    return response
+
+
+class LoopQueue(queue.Queue):
+    """
+    Event hub queue that also wakes a task on the event loop when the
+    listener thread puts an event into it.
+    """
+
+    def __init__(self, maxsize, loop):
+        super().__init__(maxsize)
+        self.loop = loop
+        self.ready = asyncio.Event()
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+
+async def sse_frames(game_name, q):
+    try:
+        yield f"retry: {events.EVENTS_RETRY_MS}\n\n".encode()
+        while True:
+            try:
+                event = q.get_nowait()
+            except queue.Empty:
+                q.ready.clear()
+                try:
+                    await asyncio.wait_for(q.ready.wait(), events.EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # Comment frames keep proxies from closing an idle stream
+                    yield b": ping\n\n"
+                continue
+            yield f"data: {json.dumps(event)}\n\n".encode()
+    finally:
+        events.hub.unsubscribe(game_name, q)
+
+
+async def ticket_events():
+    game_name = request.args.get('game_name')
+    if not game_name:
+        return jsonify({'error': 'Missing game_name'}), 400
+    q = events.hub.subscribe(game_name, LoopQueue(events.EVENTS_QUEUE_SIZE, asyncio.get_running_loop()))
+    return Response(
+        sse_frames(game_name, q),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+# (method, path pattern, handler, parameter converters); requests that carry
+# a since= token use the Flask route, which owns the delta-sync logic
+NATIVE_ROUTES = [
+    ('GET', re.compile(r'/get_tickets'), get_tickets, ()),
+    ('GET', re.compile(r'/api/board'), get_board, ()),
+    ('GET', re.compile(r'/api/board/column'), get_board_column, ()),
+    ('GET', re.compile(r'/get_ticket/(\d+)'), get_ticket, (int,)),
+    ('GET', re.compile(r'/attachment/(\d+)'), get_attachment, (int,)),
+    ('GET', re.compile(r'/events'), ticket_events, ()),
+]
+
+_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+_stream_executor = ThreadPoolExecutor(max_workers=ASGI_STREAM_THREADS, thread_name_prefix='asgi-stream')
+
+
+def match_native(method, path, query_string):
+    if 'since' in parse_qs(query_string.decode('latin-1'), keep_blank_values=True):
+        return None
+    for route_method, pattern, handler, converters in NATIVE_ROUTES:
+        if route_method != method:
+            continue
+        match = pattern.fullmatch(path)
+        if match:
+            return handler, [convert(value) for convert, value in zip(converters, match.groups())]
+    return None
+
+
+def build_environ(scope, body_stream):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body_stream,
+        # The stream ends where the body does, so chunked bodies can be read
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class RequestBody(io.RawIOBase):
+    """
+    wsgi.input that pulls the body off the ASGI receive channel as the app
+    reads it, so a request body is never held in memory whole. Bodies larger
+    than ``limit`` (MAX_CONTENT_LENGTH) are refused as soon as the declared
+    Content-Length or the bytes received so far exceed it. Read from the
+    worker thread only, never on the event loop.
+    """
+
+    def __init__(self, receive, loop, limit=None, content_length=None):
+        self._receive = receive
+        self._loop = loop
+        self._limit = limit
+        self._content_length = content_length
+        self._chunk = memoryview(b'')
+        self._more = True
+        self.received = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._limit is not None and self._content_length is not None and self._content_length > self._limit:
+            raise RequestEntityTooLarge()
+        while not self._chunk and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                self._more = False
+                raise ClientDisconnected()
+            body = message.get('body', b'')
+            self.received += len(body)
+            self._more = message.get('more_body', False)
+            if self._limit is not None and self.received > self._limit:
+                self._more = False
+                raise RequestEntityTooLarge()
+            self._chunk = memoryview(body)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    async def wait_disconnect(self):
+        """
+        Wait until the client goes away, discarding any body the app left
+        unread. Only call once the app has stopped reading.
+        """
+        self._more = False
+        while True:
+            message = await self._receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+
+def request_content_length(scope):
+    for name, value in scope.get('headers', []):
+        if name.lower() == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def send_iterable(send, status, headers, iterable, body):
+    """
+    Send a response body chunk by chunk until it ends or the client
+    disconnects. Blocking iterables are pulled on the stream thread pool so
+    file and database reads never block the event loop; async iterables (the
+    event streams) are consumed on the loop.
+    """
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    disconnected = asyncio.ensure_future(body.wait_disconnect())
+    try:
+        if hasattr(iterable, '__aiter__'):
+            await _send_async_chunks(send, iterable, disconnected)
+        else:
+            await _send_chunks(send, iterable, disconnected)
+    finally:
+        client_gone = disconnected.done()
+        disconnected.cancel()
+    if not client_gone:
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _send_chunks(send, iterable, disconnected):
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterable)
+    done = object()
+    try:
+        while not disconnected.done():
+            chunk = await loop.run_in_executor(_stream_executor, next, iterator, done)
+            if chunk is done:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': bytes(chunk), 'more_body': True})
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            await loop.run_in_executor(_stream_executor, close)
+
+
+async def _send_async_chunks(send, iterable, disconnected):
+    iterator = iterable.__aiter__()
+    try:
+        while True:
+            pending = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({pending, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not pending.done():
+                pending.cancel()
+                try:
+                    await pending
+                except (asyncio.CancelledError, StopAsyncIteration):
+                    pass
+                return
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                return
+            if chunk:
+                await send({'type': 'http.response.body', 'body': bytes(chunk), 'more_body': True})
+    finally:
+        await iterable.aclose()
+
+
+async def call_native(handler, args, environ, body, send):
+    # The context is pushed and popped on this task, so concurrent requests
+    # each see their own flask.request
+    with app.request_context(environ):
+        try:
+            response = app.preprocess_request()
+            if response is None:
+                response = await handler(*args)
+                if response is None:
+                    return False
+            response = app.make_response(response)
+        except Exception as e:
+            try:
+                response = app.make_response(app.handle_user_exception(e))
+            except Exception as unhandled:
+                response = app.make_response(app.handle_exception(unhandled))
+        response = app.process_response(response)
+        await send_iterable(send, response.status_code, response.headers.to_wsgi_list(), response.response, body)
+    return True
+
+
+async def call_wsgi(environ, body, send):
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    response = await asyncio.get_running_loop().run_in_executor(_executor, app.wsgi_app, environ, start_response)
+    await send_iterable(send, started['status'], started['headers'], response, body)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await database.start()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await database.close()
+            _executor.shutdown(wait=False)
+            _stream_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    body = RequestBody(receive, asyncio.get_running_loop(),
+                       app.config.get('MAX_CONTENT_LENGTH'), request_content_length(scope))
+    environ = build_environ(scope, io.BufferedReader(body))
+    native = match_native(scope['method'], scope['path'], scope.get('query_string', b''))
+    if native is not None and database.pool is not None:
+        # Native handlers never read the body, so the stream is still unread
+        # if they hand the request over to Flask
+        handler, args = native
+        if await call_native(handler, args, environ, body, send):
+            return
+    await call_wsgi(environ, body, send)
+
+
+@app.route('/async_pool_stats', methods=['GET'])
+def get_async_pool_stats():
+    return jsonify(database.stats())
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi:application', host='0.0.0.0', port=int(os.environ.get('PORT', '8000')))
@@ -0,0 +1,49 @@
+"""
+Compare two benchmark reports written by bench/run.py.
+
+    python bench/compare.py bench/results/before.json bench/results/after.json
+"""
+import json
+import sys
+
+METRICS = [
+    ('throughput_rps', lambda s: s['throughput_rps']),
+    ('p50_ms', lambda s: s['latency_ms']['p50']),
+    ('p95_ms', lambda s: s['latency_ms']['p95']),
+    ('p99_ms', lambda s: s['latency_ms']['p99']),
+    ('queries/req', lambda s: s['queries_per_request']),
+    ('db connections', lambda s: s.get('db_connections_peak')),
+]
+
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return ''
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"{old['commit']} ({old.get('server')}) -> {new['commit']} ({new.get('server')})")
+    for scenario in new['scenarios']:
+        if scenario not in old['scenarios']:
+            continue
+        print(f"\n{scenario}")
+        for name, value in METRICS:
+            before = value(old['scenarios'][scenario])
+            after = value(new['scenarios'][scenario])
+            print(f"  {name:15s} {str(before):>12s} {str(after):>12s} {change(before, after):>9s}")
+    print(f"\npeak rss kb       {str(old.get('server_peak_rss_kb')):>12s} "
+          f"{str(new.get('server_peak_rss_kb')):>12s} "
+          f"{change(old.get('server_peak_rss_kb'), new.get('server_peak_rss_kb')):>9s}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python bench/compare.py OLD.json NEW.json")
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,377 @@
+"""
+Load-test driver for the benchmark suite.
+
+Starts the app against the database written by bench/seed.py (or targets an
+already running server with --url) and drives the real routes from
+--concurrency client threads for --duration seconds per scenario. The report
+has latency percentiles, throughput, database queries per request and the
+server's peak RSS and the peak number of Postgres connections it held, and is
+saved as JSON so runs can be compared with bench/compare.py.
+
+    python bench/seed.py
+    python bench/run.py --concurrency 16 --duration 30
+
+--server asgi runs the same scenarios against the ASGI mode (asgi.py under
+uvicorn) instead of the threaded Flask server, e.g. to compare the two on the
+listing and attachment routes:
+
+    python bench/run.py --server wsgi --scenarios get_tickets,attachment --output wsgi.json
+    python bench/run.py --server asgi --scenarios get_tickets,attachment --output asgi.json
+    python bench/compare.py wsgi.json asgi.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, 'bench', 'data')
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+
+def get_tickets(rng, manifest):
+    return 'GET', '/get_tickets?' + urlencode({'gameName': rng.choice(manifest['projects'])}), None, {}
+
+
+def get_tickets_search(rng, manifest):
+    query = {
+        'gameName': rng.choice(manifest['projects']),
+        'search': ' '.join(rng.sample(manifest['search_terms'], 2)),
+        'limit': 50,
+    }
+    return 'GET', '/get_tickets?' + urlencode(query), None, {}
+
+
+def submit_ticket(rng, manifest):
+    game = rng.choice(manifest['projects'])
+    form = {
+        'projectInput': game,
+        'gameName': game,
+        'workType': 'Bug',
+        'status': 'To Do',
+        'summary': ' '.join(rng.sample(manifest['search_terms'], 4)).capitalize(),
+        'description': ' '.join(rng.choices(manifest['search_terms'], k=30)),
+        'assignee': str(rng.choice(manifest['users'])['id']),
+        'team': 'QA',
+    }
+    return 'POST', '/submit_ticket', urlencode(form).encode(), {
+        'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def update_ticket(rng, manifest):
+    first_id, last_id = manifest['ticket_ids']
+    body = {'status': rng.choice(manifest['statuses'])}
+    return 'POST', f"/update_ticket/{rng.randint(first_id, last_id)}", json.dumps(body).encode(), {
+        'Content-Type': 'application/json'}
+
+
+def get_attachment(rng, manifest):
+    return 'GET', f"/attachment/{rng.choice(manifest['attachment_ids'])}", None, {}
+
+
+def login(rng, manifest):
+    form = {'email': rng.choice(manifest['users'])['email'], 'password': manifest['password']}
+    return 'POST', '/login', urlencode(form).encode(), {
+        'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+SCENARIOS = {
+    'get_tickets': get_tickets,
+    'get_tickets_search': get_tickets_search,
+    'submit_ticket': submit_ticket,
+    'update_ticket': update_ticket,
+    'attachment': get_attachment,
+    'login': login,
+}
+# Status codes that count as success; /login redirects to /projects
+EXPECTED_STATUS = {'login': {302}}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--manifest', default=os.path.join(DATA_DIR, 'manifest.json'))
+    parser.add_argument('--url', help='benchmark a running server instead of starting one')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20, help='seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before each scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='report path (default bench/results/<time>-<commit>.json)')
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def start_server(manifest, port, mode):
+    env = dict(os.environ)
+    env.update({
+        'DB_NAME': manifest['db'],
+        'BLOB_ROOT': manifest['blob_root'],
+        'MIGRATE_ON_START': 'off',
+        # Emails stay queued in the outbox instead of going to a real SMTP server
+        'OUTBOX_IN_PROCESS': '0',
+    })
+    if mode == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port), '--no-access-log']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port),
+                   '--with-threads', '--no-reload']
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class ConnectionSampler:
+    """
+    Polls pg_stat_activity for the number of connections open to the benchmark
+    database and keeps the peak.
+    """
+
+    def __init__(self, connection_kwargs, interval=0.2):
+        import psycopg2
+        self.conn = psycopg2.connect(**connection_kwargs)
+        self.conn.autocommit = True
+        self.dbname = connection_kwargs['dbname']
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT count(*) FROM pg_stat_activity WHERE datname = %s AND pid <> pg_backend_pid()",
+            (self.dbname,)
+        )
+        count = cur.fetchone()[0]
+        cur.close()
+        return count
+
+    def start(self):
+        self.peak = self.current()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peak
+
+    def close(self):
+        self.conn.close()
+
+
+def fetch_json(url, path):
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=30)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return fetch_json(url, '/pool_stats')
+        except (OSError, ValueError, http.client.HTTPException):
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not become ready within {timeout}s")
+
+
+def read_rss_kb(pid, field):
+    # VmRSS is current, VmHWM the peak resident set; Linux only
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def drive(url, scenario, manifest, concurrency, duration, seed):
+    """
+    Run one scenario from concurrency threads for duration seconds. Returns
+    (latencies in seconds, status counts, error count, elapsed seconds).
+    """
+    parsed = urlparse(url)
+    build = SCENARIOS[scenario]
+    expected = EXPECTED_STATUS.get(scenario, {200})
+    latencies = []
+    statuses = {}
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(n):
+        rng = random.Random(seed * 1000 + n)
+        conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=60)
+        local_latencies = []
+        local_statuses = {}
+        local_errors = 0
+        while time.monotonic() < deadline:
+            method, path, body, headers = build(rng, manifest)
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=60)
+                local_errors += 1
+                continue
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+            if status not in expected:
+                local_errors += 1
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+            errors[0] += local_errors
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, errors[0], time.monotonic() - started
+
+
+def run_scenario(url, scenario, manifest, args, sampler=None):
+    if args.warmup > 0:
+        drive(url, scenario, manifest, args.concurrency, args.warmup, args.seed + 7)
+
+    before = fetch_json(url, '/pool_stats').get('queries')
+    if sampler:
+        sampler.start()
+    latencies, statuses, errors, elapsed = drive(
+        url, scenario, manifest, args.concurrency, args.duration, args.seed)
+    connections = sampler.stop() if sampler else None
+    after = fetch_json(url, '/pool_stats').get('queries')
+
+    latencies.sort()
+    requests = len(latencies)
+    return {
+        'requests': requests,
+        'errors': errors,
+        'status_counts': {str(status): count for status, count in sorted(statuses.items())},
+        'throughput_rps': round(requests / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'mean': ms(sum(latencies) / requests) if requests else None,
+            'max': ms(latencies[-1]) if latencies else None,
+        },
+        'queries_per_request': round((after - before) / requests, 2)
+        if requests and before is not None and after is not None else None,
+        'db_connections_peak': connections,
+    }
+
+
+def main():
+    args = parse_args()
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}. Choose from {', '.join(SCENARIOS)}")
+    if 'attachment' in scenarios and not manifest['attachment_ids']:
+        scenarios.remove('attachment')
+
+    # Connection settings come from the same DB_* variables the app reads
+    os.environ['DB_NAME'] = manifest['db']
+    sys.path.insert(0, ROOT)
+    from db import connection_kwargs
+    sampler = ConnectionSampler(connection_kwargs())
+
+    server = None
+    url = args.url
+    if not url:
+        server = start_server(manifest, args.port, args.server)
+        url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        wait_until_ready(url)
+        results = {}
+        for scenario in scenarios:
+            print(f"Running {scenario} at concurrency {args.concurrency} for {args.duration}s")
+            results[scenario] = run_scenario(url, scenario, manifest, args, sampler)
+            if server:
+                results[scenario]['server_rss_kb'] = read_rss_kb(server.pid, 'VmRSS')
+            summary = results[scenario]
+            print(f"  {summary['throughput_rps']} req/s, p50 {summary['latency_ms']['p50']} ms, "
+                  f"p99 {summary['latency_ms']['p99']} ms, {summary['queries_per_request']} queries/req, "
+                  f"{summary['db_connections_peak']} db connections, {summary['errors']} errors")
+        peak_rss = read_rss_kb(server.pid, 'VmHWM') if server else None
+    finally:
+        sampler.close()
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'server': args.server if server else args.url,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'data': manifest['counts'],
+        'seed': manifest['seed'],
+        'server_peak_rss_kb': peak_rss,
+        'scenarios': results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+
+
+if __name__ == '__main__':
+    main()
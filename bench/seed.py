@@ -0,0 +1,237 @@
+"""
+Seeded synthetic data generator for the benchmark suite.
+
+Creates a throwaway database (dropped and recreated on every run), applies the
+migrations and loads projects, users, tickets and attachments. The same seed
+always produces the same data, so runs on different commits are comparable.
+
+    python bench/seed.py --tickets 1000000 --attachments 5000
+
+A manifest describing the data (ids, emails, search terms) is written for
+bench/run.py to draw request parameters from.
+"""
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import execute_values
+from werkzeug.security import generate_password_hash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, 'bench', 'data')
+
+BENCH_PASSWORD = 'bench-password'
+WORDS = [
+    'crash', 'login', 'texture', 'shader', 'physics', 'collision', 'save', 'load',
+    'menu', 'audio', 'network', 'lag', 'desync', 'inventory', 'quest', 'dialog',
+    'animation', 'camera', 'lighting', 'shadow', 'memory', 'leak', 'freeze', 'spawn',
+    'enemy', 'player', 'weapon', 'reload', 'matchmaking', 'lobby', 'controller',
+    'keyboard', 'resolution', 'framerate', 'stutter', 'localization', 'font',
+    'tutorial', 'achievement', 'checkpoint', 'boss', 'level', 'terrain', 'water',
+    'particle', 'cutscene', 'subtitle', 'settings', 'patch', 'update', 'install',
+]
+WORK_TYPES = [('Bug', 55), ('Task', 25), ('Story', 12), ('Epic', 3), ('Improvement', 5)]
+STATUSES = [('To Do', 30), ('In Process', 15), ('In Review', 10), ('Done', 35), ('On-Hold', 5), ('Suggestion', 5)]
+TEAMS = ['Gameplay', 'Engine', 'Art', 'Audio', 'Online', 'QA', 'UI']
+CONTENT_TYPES = [('image/png', 40), ('image/jpeg', 20), ('text/plain', 20), ('application/pdf', 10), ('application/zip', 10)]
+EXTENSIONS = {'image/png': 'png', 'image/jpeg': 'jpg', 'text/plain': 'log',
+              'application/pdf': 'pdf', 'application/zip': 'zip'}
+# Attachment sizes are log-normal around ~60 KB with a long tail, capped
+# below the upload limit
+ATTACHMENT_MEDIAN = 60 * 1024
+ATTACHMENT_SIGMA = 1.5
+ATTACHMENT_MIN = 200
+ATTACHMENT_MAX = 15 * 1024 * 1024
+COPY_BATCH = 50000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--projects', type=int, default=20)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--tickets', type=int, default=100000)
+    parser.add_argument('--attachments', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', default=os.environ.get('BENCH_DB_NAME', 'jiraclone_bench'))
+    parser.add_argument('--blob-root', default=os.path.join(DATA_DIR, 'blobs'))
+    parser.add_argument('--manifest', default=os.path.join(DATA_DIR, 'manifest.json'))
+    return parser.parse_args()
+
+
+def weighted(rng, choices):
+    return rng.choices([c for c, _ in choices], weights=[w for _, w in choices])[0]
+
+
+def recreate_database(connection_kwargs, name):
+    conn = psycopg2.connect(**{**connection_kwargs, 'dbname': 'postgres'})
+    conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = conn.cursor()
+    cur.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    cur.execute(f'CREATE DATABASE "{name}"')
+    cur.close()
+    conn.close()
+
+
+def seed_projects(cur, count):
+    names = [f"Game {n:03d}" for n in range(1, count + 1)]
+    execute_values(
+        cur,
+        "INSERT INTO projects (game_name, phase, category) VALUES %s",
+        [(name, 'Production', 'Action') for name in names]
+    )
+    return names
+
+
+def seed_users(cur, count, projects, rng):
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    rows = execute_values(
+        cur,
+        "INSERT INTO users (name, email, password, is_active) VALUES %s RETURNING id, email",
+        [(f"User {n}", f"user{n}@bench.local", password_hash, True) for n in range(1, count + 1)],
+        fetch=True
+    )
+    invitations = []
+    for user_id, _ in rows:
+        for project in rng.sample(projects, min(3, len(projects))):
+            invitations.append((user_id, project, 'accepted'))
+    execute_values(
+        cur,
+        "INSERT INTO project_invitations (user_id, project_name, status) VALUES %s",
+        invitations
+    )
+    execute_values(
+        cur,
+        "INSERT INTO project_assignments (user_id, project_name) VALUES %s",
+        [(user_id, project) for user_id, project, _ in invitations]
+    )
+    return rows
+
+
+def seed_tickets(cur, count, projects, user_ids, rng):
+    # A few projects hold most tickets, like a real studio
+    project_weights = [1 / (rank + 1) for rank in range(len(projects))]
+    now = datetime.now(timezone.utc)
+    columns = 'project, work_type, status, summary, description, assignee, team, game_name, created_at'
+    loaded = 0
+    while loaded < count:
+        batch = min(COPY_BATCH, count - loaded)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for _ in range(batch):
+            game = rng.choices(projects, weights=project_weights)[0]
+            summary = ' '.join(rng.choices(WORDS, k=rng.randint(3, 8)))
+            description = ' '.join(rng.choices(WORDS, k=rng.randint(10, 80)))
+            writer.writerow([
+                game,
+                weighted(rng, WORK_TYPES),
+                weighted(rng, STATUSES),
+                summary.capitalize(),
+                description,
+                str(rng.choice(user_ids)) if rng.random() < 0.8 else '',
+                rng.choice(TEAMS),
+                game,
+                (now - timedelta(seconds=rng.randint(0, 365 * 86400))).isoformat(),
+            ])
+        buffer.seek(0)
+        cur.copy_expert(f"COPY tickets ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        loaded += batch
+        print(f"Loaded {loaded}/{count} tickets")
+
+
+def seed_attachments(cur, count, ticket_ids, store, rng):
+    rows = []
+    total_bytes = 0
+    for n in range(count):
+        size = int(rng.lognormvariate(math.log(ATTACHMENT_MEDIAN), ATTACHMENT_SIGMA))
+        size = max(ATTACHMENT_MIN, min(size, ATTACHMENT_MAX))
+        content_type = weighted(rng, CONTENT_TYPES)
+        key, size = store.put(io.BytesIO(rng.randbytes(size)))
+        total_bytes += size
+        filename = f"attachment-{n}.{EXTENSIONS[content_type]}"
+        rows.append((rng.choice(ticket_ids), filename, key, size, content_type))
+    ids = []
+    for start in range(0, len(rows), 1000):
+        ids.extend(row[0] for row in execute_values(
+            cur,
+            "INSERT INTO ticket_attachments (ticket_id, filename, blob_sha256, size, content_type) "
+            "VALUES %s RETURNING id",
+            rows[start:start + 1000],
+            fetch=True
+        ))
+    return ids, total_bytes
+
+
+def main():
+    args = parse_args()
+    # The app modules read their configuration at import time
+    os.environ['DB_NAME'] = args.db
+    os.environ['BLOB_ROOT'] = args.blob_root
+    sys.path.insert(0, ROOT)
+    import db
+    import migrations
+    from blobstore import get_blob_store
+
+    rng = random.Random(args.seed)
+    started = time.monotonic()
+
+    recreate_database(db.connection_kwargs(), args.db)
+    migrations.migrate()
+
+    with db.db_conn() as conn:
+        cur = conn.cursor()
+        projects = seed_projects(cur, args.projects)
+        users = seed_users(cur, args.users, projects, rng)
+        conn.commit()
+
+        seed_tickets(cur, args.tickets, projects, [user_id for user_id, _ in users], rng)
+        conn.commit()
+
+        cur.execute("SELECT min(id), max(id) FROM tickets")
+        first_id, last_id = cur.fetchone()
+        ticket_ids = list(range(first_id, last_id + 1)) if first_id else []
+
+        attachment_ids, attachment_bytes = seed_attachments(
+            cur, args.attachments if ticket_ids else 0, ticket_ids, get_blob_store(), rng)
+        conn.commit()
+
+        conn.autocommit = True
+        cur.execute("VACUUM ANALYZE")
+        conn.autocommit = False
+        cur.close()
+
+    manifest = {
+        'seed': args.seed,
+        'db': args.db,
+        'blob_root': args.blob_root,
+        'projects': projects,
+        'users': [{'id': user_id, 'email': email} for user_id, email in users],
+        'password': BENCH_PASSWORD,
+        'ticket_ids': [first_id, last_id],
+        'attachment_ids': attachment_ids,
+        'search_terms': WORDS,
+        'statuses': [status for status, _ in STATUSES],
+        'counts': {
+            'projects': len(projects),
+            'users': len(users),
+            'tickets': args.tickets,
+            'attachments': len(attachment_ids),
+            'attachment_bytes': attachment_bytes,
+        },
+    }
+    os.makedirs(os.path.dirname(args.manifest), exist_ok=True)
+    with open(args.manifest, 'w') as f:
+        json.dump(manifest, f)
+    print(f"Seeded {args.db} in {time.monotonic() - started:.1f}s, manifest at {args.manifest}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Microbenchmark: building and encoding a ticket list response.
+
+Compares the previous code path (a dict per row, encoded by Flask's default
+stdlib JSON provider) with the row models and FastJSONProvider, on synthetic
+rows shaped like TICKET_COLUMNS with a few attachments each. No database needed.
+
+    python bench/serialize.py --rows 5000 --repeat 20
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import models
+from models import Attachment, Ticket, FastJSONProvider
+
+
+def make_rows(count, seed=1):
+    rng = random.Random(seed)
+    words = ['crash', 'texture', 'login', 'save', 'menu', 'audio', 'lag', 'quest', 'camera', 'shader']
+    rows = []
+    attachments = {}
+    for ticket_id in range(1, count + 1):
+        rows.append((
+            ticket_id,
+            ' '.join(rng.choices(words, k=6)).capitalize(),
+            'Game 001',
+            rng.choice(['Bug', 'Task', 'Story']),
+            rng.choice(['To Do', 'In Process', 'Done']),
+            ' '.join(rng.choices(words, k=60)),
+            str(rng.randint(1, 200)),
+            'QA',
+            'Game 001',
+        ))
+        if rng.random() < 0.3:
+            attachments[ticket_id] = [(ticket_id * 10 + n, f'shot-{n}.png') for n in range(rng.randint(1, 3))]
+    return rows, attachments
+
+
+def dict_path(rows, attachments):
+    by_ticket = {tid: [{'id': aid, 'filename': name} for aid, name in items] for tid, items in attachments.items()}
+    return [{
+        'id': row[0],
+        'summary': row[1],
+        'project': row[2],
+        'work_type': row[3],
+        'status': row[4],
+        'description': row[5],
+        'assignee': row[6],
+        'team': row[7],
+        'game_name': row[8],
+        'attachments': by_ticket.get(row[0], [])
+    } for row in rows]
+
+
+def model_path(rows, attachments):
+    by_ticket = {tid: [Attachment(aid, name) for aid, name in items] for tid, items in attachments.items()}
+    return [Ticket.from_row(row, by_ticket.get(row[0], [])) for row in rows]
+
+
+def measure(app, build, rows, attachments, repeat):
+    timings = []
+    with app.app_context():
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = app.json.response(build(rows, attachments)).get_data()
+            timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2], len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rows, attachments = make_rows(args.rows)
+
+    before = Flask('before')
+    before.json = DefaultJSONProvider(before)
+    after = Flask('after')
+    after.json = FastJSONProvider(after)
+
+    old_time, old_size = measure(before, dict_path, rows, attachments, args.repeat)
+    new_time, new_size = measure(after, model_path, rows, attachments, args.repeat)
+
+    encoder = 'orjson' if models.orjson is not None else 'stdlib json'
+    print(f"{args.rows} tickets, median of {args.repeat} runs")
+    print(f"  dicts + jsonify          {old_time * 1000:8.2f} ms  {old_size} bytes")
+    print(f"  models + {encoder:15s} {new_time * 1000:8.2f} ms  {new_size} bytes")
+    print(f"  speedup                  {old_time / new_time:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
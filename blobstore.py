@@ -0,0 +1,373 @@
+"""
+Content-addressed storage for attachment bodies.
+
+Attachment bytes live outside Postgres, keyed by their SHA-256, so identical
+files are stored once and ticket_attachments only keeps metadata. Uploads and
+downloads are streamed in fixed-size chunks and never held in memory whole.
+
+Backends:
+    local  files under BLOB_ROOT (default ./blobs), sharded by hash prefix
+    s3     any S3-compatible bucket (needs boto3), set BLOB_S3_BUCKET
+
+The blob columns on ticket_attachments are added by migrations.py.
+
+Maintenance commands:
+    python blobstore.py migrate    move existing BYTEA rows into the store
+    python blobstore.py gc         delete blobs no attachment references
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from db import db_conn
+
+BLOB_BACKEND = os.environ.get('BLOB_BACKEND', 'local')
+BLOB_ROOT = os.environ.get('BLOB_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blobs'))
+BLOB_S3_BUCKET = os.environ.get('BLOB_S3_BUCKET', '')
+BLOB_S3_PREFIX = os.environ.get('BLOB_S3_PREFIX', 'attachments/')
+BLOB_S3_ENDPOINT = os.environ.get('BLOB_S3_ENDPOINT') or None
+CHUNK_SIZE = 64 * 1024
+# Unreferenced blobs younger than this are left alone by gc, since an upload
+# may have stored the blob but not yet committed its attachment row
+BLOB_GC_GRACE_SECONDS = int(os.environ.get('BLOB_GC_GRACE_SECONDS', '86400'))
+# Advisory lock namespace shared by gc and every transaction that references a blob
+BLOB_LOCK_ID = 7306
+
+BLOB_SCHEMA = """
+ALTER TABLE ticket_attachments ADD COLUMN IF NOT EXISTS blob_sha256 CHAR(64);
+ALTER TABLE ticket_attachments ADD COLUMN IF NOT EXISTS size BIGINT;
+ALTER TABLE ticket_attachments ADD COLUMN IF NOT EXISTS content_type TEXT;
+ALTER TABLE ticket_attachments ALTER COLUMN data DROP NOT NULL;
+"""
+
+# Built with CREATE INDEX CONCURRENTLY by migrations.py
+BLOB_INDEXES = [
+    ('ticket_attachments_blob_sha256_idx', 'ON ticket_attachments (blob_sha256)'),
+]
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+def iter_chunks(fileobj, chunk_size=CHUNK_SIZE):
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class LocalBlobStore:
+    def __init__(self, root=BLOB_ROOT):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, fileobj):
+        """
+        Stream fileobj into the store. Returns (sha256, size).
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in iter_chunks(fileobj):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+            key = digest.hexdigest()
+            target = self.path(key)
+            try:
+                # Already stored: refresh the mtime so gc treats it as new
+                os.utime(target)
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return key, size
+
+    def open(self, key):
+        try:
+            return open(self.path(key), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def read_range(self, key, start, length):
+        """
+        Iterate over ``length`` bytes of the blob starting at ``start``.
+        """
+        try:
+            fileobj = open(self.path(key), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+        return self._iter_range(fileobj, start, length)
+
+    @staticmethod
+    def _iter_range(fileobj, start, length):
+        with fileobj:
+            fileobj.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = fileobj.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def modified(self, key):
+        try:
+            return os.path.getmtime(self.path(key))
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self):
+        """
+        Yield (key, modified_timestamp) for every stored blob.
+        """
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.tmp_dir:
+                dirnames[:] = []
+                continue
+            for name in filenames:
+                if len(name) == 64:
+                    yield name, os.path.getmtime(os.path.join(dirpath, name))
+
+
+class S3BlobStore:
+    def __init__(self, bucket=BLOB_S3_BUCKET, prefix=BLOB_S3_PREFIX, endpoint_url=BLOB_S3_ENDPOINT):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("The s3 blob backend requires boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("BLOB_S3_BUCKET must be set for the s3 blob backend")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def object_key(self, key):
+        return f"{self.prefix}{key}"
+
+    def put(self, fileobj):
+        # The key is the content hash, so spool to disk while hashing and
+        # upload once the hash is known
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.TemporaryFile() as tmp:
+            for chunk in iter_chunks(fileobj):
+                digest.update(chunk)
+                size += len(chunk)
+                tmp.write(chunk)
+            key = digest.hexdigest()
+            if self.exists(key):
+                self.touch(key)
+            else:
+                tmp.seek(0)
+                self.client.upload_fileobj(tmp, self.bucket, self.object_key(key))
+        return key, size
+
+    def touch(self, key):
+        # S3 has no utime; copying the object onto itself resets LastModified
+        object_key = self.object_key(key)
+        self.client.copy_object(
+            Bucket=self.bucket, Key=object_key,
+            CopySource={'Bucket': self.bucket, 'Key': object_key},
+            Metadata={'touched': str(int(time.time()))}, MetadataDirective='REPLACE')
+
+    def open(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))['Body']
+        except self.client.exceptions.NoSuchKey:
+            raise BlobNotFound(key)
+
+    def read_range(self, key, start, length):
+        try:
+            body = self.client.get_object(
+                Bucket=self.bucket, Key=self.object_key(key),
+                Range=f'bytes={start}-{start + length - 1}')['Body']
+        except self.client.exceptions.NoSuchKey:
+            raise BlobNotFound(key)
+        return body.iter_chunks(CHUNK_SIZE)
+
+    def _head(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError:
+            raise BlobNotFound(key)
+
+    def size(self, key):
+        return self._head(key)['ContentLength']
+
+    def modified(self, key):
+        return self._head(key)['LastModified'].timestamp()
+
+    def exists(self, key):
+        try:
+            self.size(key)
+            return True
+        except BlobNotFound:
+            return False
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def keys(self):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(self.prefix):], obj['LastModified'].timestamp()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if BLOB_BACKEND == 's3':
+                    _store = S3BlobStore()
+                elif BLOB_BACKEND == 'local':
+                    _store = LocalBlobStore()
+                else:
+                    raise RuntimeError(f"Unknown BLOB_BACKEND: {BLOB_BACKEND}")
+    return _store
+
+
+def hold_blob(cur, key):
+    """
+    Call after put() and before inserting a row that references ``key``.
+    Blocks gc from deleting the blob until cur's transaction ends and returns
+    whether the blob is still there. When it returns False, gc removed the
+    blob in between and the caller must put() it again.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock_shared(%s, hashtext(%s))", (BLOB_LOCK_ID, key))
+    return get_blob_store().exists(key)
+
+
+class _MemoryView:
+    """
+    Minimal read() wrapper over a psycopg2 memoryview for BlobStore.put().
+    """
+
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self._pos = 0
+
+    def read(self, size=-1):
+        end = len(self._data) if size < 0 else self._pos + size
+        chunk = self._data[self._pos:end].tobytes()
+        self._pos += len(chunk)
+        return chunk
+
+
+def migrate_bytea(batch_size=50):
+    """
+    Move BYTEA attachment bodies into the blob store, one row at a time so only
+    a single attachment is ever held in memory.
+    """
+    store = get_blob_store()
+    moved = 0
+    last_id = 0
+    while True:
+        with db_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT id FROM ticket_attachments
+                WHERE blob_sha256 IS NULL AND data IS NOT NULL AND id > %s
+                ORDER BY id LIMIT %s
+                """,
+                (last_id, batch_size)
+            )
+            ids = [row[0] for row in cur.fetchall()]
+            if not ids:
+                cur.close()
+                break
+
+            for attachment_id in ids:
+                cur.execute("SELECT data FROM ticket_attachments WHERE id = %s FOR UPDATE", (attachment_id,))
+                row = cur.fetchone()
+                if row and row[0] is not None:
+                    key, size = store.put(_MemoryView(row[0]))
+                    if not hold_blob(cur, key):
+                        key, size = store.put(_MemoryView(row[0]))
+                    cur.execute(
+                        "UPDATE ticket_attachments SET blob_sha256 = %s, size = %s, data = NULL WHERE id = %s",
+                        (key, size, attachment_id)
+                    )
+                    conn.commit()
+                    moved += 1
+                last_id = attachment_id
+            cur.close()
+        print(f"Moved {moved} attachments so far (last id {last_id})")
+    return moved
+
+
+def collect_garbage():
+    store = get_blob_store()
+    cutoff = time.time() - BLOB_GC_GRACE_SECONDS
+    removed = 0
+    with db_conn() as conn:
+        cur = conn.cursor()
+        for key, modified in store.keys():
+            if modified > cutoff:
+                continue
+            # Writers hold the shared lock from hold_blob() until their row
+            # commits, so under the exclusive lock a fresh check is final
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s, hashtext(%s))", (BLOB_LOCK_ID, key))
+            if cur.fetchone()[0]:
+                try:
+                    unused = store.modified(key) <= cutoff
+                except BlobNotFound:
+                    unused = False
+                if unused:
+                    cur.execute("SELECT 1 FROM ticket_attachments WHERE blob_sha256 = %s LIMIT 1", (key,))
+                    unused = cur.fetchone() is None
+                if unused:
+                    store.delete(key)
+                    removed += 1
+            conn.commit()
+        cur.close()
+    return removed
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'migrate':
+        print(f"Moved {migrate_bytea()} attachments into the {BLOB_BACKEND} blob store.")
+    elif command == 'gc':
+        print(f"Removed {collect_garbage()} unreferenced blobs.")
+    else:
+        print("Usage: python blobstore.py [migrate|gc]")
+        sys.exit(1)
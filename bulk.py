@@ -0,0 +1,295 @@
+"""
+Bulk ticket import and bulk update.
+
+Rows are validated one by one and reported back with their row number, while
+valid rows are written a batch at a time: one multi-row INSERT per batch for
+imports and one UPDATE ... FROM json_populate_recordset() per batch and field
+set for updates. Field values must be text (numbers are taken as their text)
+of at most BULK_MAX_FIELD_LENGTH characters. Should the database still reject a
+batch, it is written again row by row under savepoints, so the rows at fault
+are reported and the rest are kept. Assignees are notified through
+notifications.notify() with all their tickets at once.
+"""
+import csv
+import io
+import json
+import os
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+TICKET_FIELDS = ['project', 'work_type', 'status', 'summary', 'description', 'assignee', 'team', 'game_name']
+# Accept the same names the create ticket form posts
+FIELD_ALIASES = {
+    'projectInput': 'project',
+    'workType': 'work_type',
+    'gameName': 'game_name',
+}
+TICKET_STATUSES = ['To Do', 'In Process', 'In Review', 'Done', 'On-Hold', 'Suggestion']
+BULK_BATCH_SIZE = 1000
+BULK_MAX_ROWS = 100000
+BULK_MAX_FIELD_LENGTH = int(os.environ.get('BULK_MAX_FIELD_LENGTH', '100000'))
+
+
+class BulkError(Exception):
+    pass
+
+
+def parse_rows(req):
+    """
+    Read rows from a CSV, NDJSON or JSON array request body, or from a CSV /
+    NDJSON / JSON file uploaded as 'file'.
+    """
+    upload = req.files.get('file')
+    if upload:
+        name = (upload.filename or '').lower()
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig')
+        if name.endswith('.csv'):
+            return list(csv.DictReader(stream))
+        if name.endswith(('.ndjson', '.jsonl')):
+            return _parse_ndjson(stream)
+        return _json_array(stream.read())
+
+    content_type = req.mimetype or ''
+    if content_type == 'text/csv':
+        return list(csv.DictReader(io.TextIOWrapper(req.stream, encoding='utf-8-sig')))
+    if content_type in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        return _parse_ndjson(io.TextIOWrapper(req.stream, encoding='utf-8'))
+    if content_type == 'application/json':
+        return _json_array(req.get_data(as_text=True))
+    raise BulkError('Send CSV, NDJSON or a JSON array')
+
+
+def _parse_ndjson(stream):
+    rows = []
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            # Keep the slot so row numbers stay aligned with the input
+            rows.append(BulkError(f'Invalid JSON on line {number}'))
+    return rows
+
+
+def _json_array(text):
+    try:
+        data = json.loads(text)
+    except ValueError:
+        raise BulkError('Invalid JSON body')
+    if isinstance(data, dict):
+        data = data.get('tickets')
+    if not isinstance(data, list):
+        raise BulkError('Expected a JSON array of tickets')
+    return data
+
+
+def normalize(row):
+    if isinstance(row, BulkError):
+        raise row
+    if not isinstance(row, dict):
+        raise BulkError('Row must be an object')
+    clean = {}
+    for key, value in row.items():
+        field = FIELD_ALIASES.get(key, key)
+        if field == 'id':
+            clean[field] = value
+        elif field in TICKET_FIELDS:
+            clean[field] = _text_value(field, value)
+    return clean
+
+
+def _text_value(field, value):
+    """
+    Every ticket column is TEXT: accept strings and numbers, nothing else.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str):
+        raise BulkError(f'{field} must be text')
+    value = value.strip()
+    if '\x00' in value:
+        raise BulkError(f'{field} contains a NUL character')
+    if len(value) > BULK_MAX_FIELD_LENGTH:
+        raise BulkError(f'{field} is longer than {BULK_MAX_FIELD_LENGTH} characters')
+    return value if value != '' else None
+
+
+def validate_new_ticket(row):
+    ticket = normalize(row)
+    ticket.pop('id', None)
+    if not ticket.get('summary'):
+        raise BulkError('summary is required')
+    if not ticket.get('game_name'):
+        raise BulkError('game_name is required')
+    ticket['status'] = ticket.get('status') or 'To Do'
+    validate_status(ticket)
+    return ticket
+
+
+def validate_update(row):
+    update = normalize(row)
+    try:
+        update['id'] = int(update.get('id'))
+    except (TypeError, ValueError):
+        raise BulkError('id is required')
+    if len(update) == 1:
+        raise BulkError('No fields to update')
+    if 'summary' in update and not update['summary']:
+        raise BulkError('summary cannot be empty')
+    validate_status(update)
+    return update
+
+
+def validate_status(ticket):
+    if 'status' in ticket and ticket['status'] not in TICKET_STATUSES:
+        raise BulkError(f"status must be one of: {', '.join(TICKET_STATUSES)}")
+
+
+def batches(items, size=BULK_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def write_batches(cur, items, write, errors):
+    """
+    Call write(cur, batch) for each batch of (row_number, item) pairs and
+    return the (row_number, item, result) triples written. A batch the
+    database rejects is retried one row at a time so each bad row is reported
+    in errors and the others are still written.
+    """
+    written = []
+    for batch in batches(items):
+        cur.execute("SAVEPOINT bulk_batch")
+        try:
+            results = write(cur, batch)
+        except (psycopg2.DataError, psycopg2.IntegrityError):
+            cur.execute("ROLLBACK TO SAVEPOINT bulk_batch")
+        else:
+            cur.execute("RELEASE SAVEPOINT bulk_batch")
+            written.extend((number, item, result) for (number, item), result in zip(batch, results))
+            continue
+
+        for number, item in batch:
+            cur.execute("SAVEPOINT bulk_row")
+            try:
+                result, = write(cur, [(number, item)])
+            except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                cur.execute("ROLLBACK TO SAVEPOINT bulk_row")
+                errors.append({'row': number, 'error': e.diag.message_primary or str(e)})
+            else:
+                cur.execute("RELEASE SAVEPOINT bulk_row")
+                written.append((number, item, result))
+        cur.execute("RELEASE SAVEPOINT bulk_batch")
+    return written
+
+
+def _insert_tickets(cur, batch):
+    ids = execute_values(
+        cur,
+        f"INSERT INTO tickets ({', '.join(TICKET_FIELDS)}) VALUES %s RETURNING id",
+        [tuple(ticket.get(field) for field in TICKET_FIELDS) for _, ticket in batch],
+        page_size=len(batch),
+        fetch=True
+    )
+    return [ticket_id for ticket_id, in ids]
+
+
+def import_tickets(cur, rows):
+    """
+    Insert valid rows and return (created, errors), where created is a list of
+    (row_number, ticket_id, ticket) and errors a list of {row, error}.
+    """
+    if len(rows) > BULK_MAX_ROWS:
+        raise BulkError(f'At most {BULK_MAX_ROWS} rows per request')
+
+    valid = []
+    errors = []
+    for number, row in enumerate(rows, start=1):
+        try:
+            valid.append((number, validate_new_ticket(row)))
+        except BulkError as e:
+            errors.append({'row': number, 'error': str(e)})
+
+    created = [(number, ticket_id, ticket)
+               for number, ticket, ticket_id in write_batches(cur, valid, _insert_tickets, errors)]
+    errors.sort(key=lambda error: error['row'])
+    return created, errors
+
+
+def update_tickets(cur, rows):
+    """
+    Apply per-ticket updates and return (changes, errors). Each change is
+    (ticket_id, old_assignee, old_status, old_game_name, new_assignee,
+    new_status, new_game_name).
+    """
+    if len(rows) > BULK_MAX_ROWS:
+        raise BulkError(f'At most {BULK_MAX_ROWS} rows per request')
+
+    updates = {}
+    errors = []
+    for number, row in enumerate(rows, start=1):
+        try:
+            update = validate_update(row)
+        except BulkError as e:
+            errors.append({'row': number, 'error': str(e)})
+            continue
+        # A later row for the same ticket wins
+        updates.setdefault(update['id'], {'row': number}).update(update)
+
+    if not updates:
+        return [], errors
+
+    cur.execute(
+        "SELECT id, assignee, status, game_name FROM tickets WHERE id = ANY(%s) ORDER BY id FOR UPDATE",
+        (list(updates),)
+    )
+    before = {row[0]: row[1:] for row in cur.fetchall()}
+    for ticket_id in list(updates):
+        if ticket_id not in before:
+            errors.append({'row': updates.pop(ticket_id)['row'], 'error': 'Ticket not found'})
+
+    # One statement per batch of tickets that change the same set of fields;
+    # json_populate_recordset gives every value the column's own type
+    by_fields = {}
+    for update in updates.values():
+        fields = tuple(f for f in TICKET_FIELDS if f in update)
+        by_fields.setdefault(fields, []).append(update)
+
+    applied = []
+    for fields, group in by_fields.items():
+        assignments = ', '.join(f"{field} = v.{field}" for field in fields)
+
+        def write(cur, batch):
+            payload = [{'id': u['id'], **{f: u[f] for f in fields}} for _, u in batch]
+            cur.execute(
+                f"""
+                UPDATE tickets AS t SET {assignments}
+                FROM json_populate_recordset(NULL::tickets, %s) AS v
+                WHERE t.id = v.id
+                """,
+                (json.dumps(payload),)
+            )
+            return [None] * len(batch)
+
+        applied.extend(write_batches(cur, [(u['row'], u) for u in group], write, errors))
+    errors.sort(key=lambda error: error['row'])
+
+    changes = []
+    for _, update, _ in sorted(applied, key=lambda written: written[1]['id']):
+        ticket_id = update['id']
+        old_assignee, old_status, old_game_name = before[ticket_id]
+        changes.append((
+            ticket_id,
+            old_assignee,
+            old_status,
+            old_game_name,
+            update.get('assignee', old_assignee),
+            update.get('status', old_status),
+            update.get('game_name', old_game_name),
+        ))
+    return changes, errors
@@ -0,0 +1,179 @@
+"""
+Read-through cache for the small lookup endpoints.
+
+Responses are cached as encoded JSON under a namespace (projects, users, ...)
+with a TTL. Write routes call invalidate() on the namespaces they touch, which
+bumps the namespace version so every cached key in it is skipped at once.
+
+Backends:
+    memory  per-process, size-bounded LRU (default)
+    redis   shared between workers, set CACHE_BACKEND=redis and CACHE_REDIS_URL
+
+With the memory backend each process keeps its namespace versions in memory,
+so a cache hit makes no database call. invalidate() bumps the local version and
+sends a NOTIFY that the other workers' event listener (events.py) applies to
+theirs. While that listener is not connected, bumps from other workers could be
+missed, so the memory cache is bypassed until it is back and then starts empty.
+Set CACHE_LOCAL_VERSIONS=1 when the app runs as a single process to skip the
+NOTIFY and the listener.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, request
+
+import events
+import models
+from db import db_conn
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_TTL = int(os.environ.get('CACHE_TTL', '60'))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '1024'))
+CACHE_LOCAL_VERSIONS = os.environ.get('CACHE_LOCAL_VERSIONS', '0') == '1'
+CACHE_PREFIX = 'jiraclone:'
+CACHE_CHANNEL = 'cache_invalidations'
+
+
+class MemoryCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, local_versions=CACHE_LOCAL_VERSIONS):
+        self.max_entries = max_entries
+        self.local_versions = local_versions
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._versions = {}
+        self._lock = threading.Lock()
+        # Whether this process's listener is receiving other workers' bumps
+        self._synced = local_versions
+        self._listener_pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key) if self._synced else None
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            if not self._synced:
+                return
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def version(self, namespace):
+        if not self.local_versions:
+            self._ensure_listening()
+        with self._lock:
+            return self._versions.get(namespace, 0)
+
+    def bump(self, namespace):
+        self._bump_local(namespace)
+        if self.local_versions:
+            return
+        with db_conn() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_notify(%s, %s)", (CACHE_CHANNEL, namespace))
+            conn.commit()
+            cur.close()
+
+    def _bump_local(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def _ensure_listening(self):
+        # Once per process: a forked worker needs its own listener
+        if self._listener_pid != os.getpid():
+            with self._lock:
+                self._synced = False
+                self._listener_pid = os.getpid()
+            events.hub.add_channel(CACHE_CHANNEL, self._bump_local, self._listening)
+
+    def _listening(self, listening):
+        with self._lock:
+            self._synced = listening
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'local_versions': self.local_versions, 'synced': self._synced,
+                    'entries': len(self._entries),
+                    'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
+
+
+class RedisCache:
+    def __init__(self, url=CACHE_REDIS_URL):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis cache backend requires redis (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(CACHE_PREFIX + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(CACHE_PREFIX + key, value, ex=ttl)
+
+    def version(self, namespace):
+        return int(self.client.get(f"{CACHE_PREFIX}version:{namespace}") or 0)
+
+    def bump(self, namespace):
+        self.client.incr(f"{CACHE_PREFIX}version:{namespace}")
+
+    def stats(self):
+        return {'backend': 'redis'}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RedisCache() if CACHE_BACKEND == 'redis' else MemoryCache()
+    return _cache
+
+
+def cached_json(namespace, key, loader, ttl=CACHE_TTL):
+    """
+    Encoded JSON for loader()'s result, served from the cache when possible.
+    """
+    cache = get_cache()
+    full_key = f"{namespace}:v{cache.version(namespace)}:{key}"
+    body = cache.get(full_key)
+    if body is None:
+        body = models.dumps(loader())
+        cache.set(full_key, body, ttl)
+    return body
+
+
+def json_response(body):
+    """
+    JSON response with an ETag, answering 304 when the browser already has it.
+    """
+    response = Response(body, mimetype='application/json')
+    response.set_etag(hashlib.sha1(body).hexdigest())
+    # Browsers may keep the body but must revalidate, which is a cheap 304
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+def invalidate(*namespaces):
+    cache = get_cache()
+    for namespace in namespaces:
+        cache.bump(namespace)
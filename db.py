@@ -0,0 +1,524 @@
+"""
+Connection pooling for the Postgres database.
+
+Each gunicorn worker keeps its own pool of psycopg2 connections so routes no
+longer pay for a TCP handshake, authentication and a backend fork per request.
+
+Read replicas are optional. DB_REPLICAS is a comma-separated list of libpq DSNs
+("host=replica1 port=5432" or "postgresql://replica1/JiraCloneDB"). Any
+setting a DSN leaves out is taken from the primary's. db_conn(readonly=True)
+hands out a connection to the least busy healthy replica, unless a hook from
+set_replica_filter() says the caller must see its own writes. A monitor thread
+drops replicas that stop answering or fall more than DB_REPLICA_MAX_LAG seconds
+behind, and brings them back once they recover. With no healthy replica, reads
+go to the primary.
+"""
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+# DB connection info
+DB_HOST = os.environ.get('DB_HOST', 'localhost')
+DB_PORT = int(os.environ.get('DB_PORT', '5432'))
+DB_NAME = os.environ.get('DB_NAME', 'JiraCloneDB')
+DB_USER = os.environ.get('DB_USER', 'postgres')
+DB_PASS = os.environ.get('DB_PASS', 'root')
+
+# Pool sizing is per worker process
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+# Connections idle for longer than this are pinged before being handed out
+DB_POOL_CHECK_IDLE = float(os.environ.get('DB_POOL_CHECK_IDLE', '30'))
+
+DB_REPLICAS = [dsn.strip() for dsn in os.environ.get('DB_REPLICAS', '').split(',') if dsn.strip()]
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '2'))
+# A replica's pool gives up quickly so a dead replica costs little before the
+# request falls back to the primary
+DB_REPLICA_CONNECT_TIMEOUT = int(os.environ.get('DB_REPLICA_CONNECT_TIMEOUT', '2'))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+_query_count = 0
+_query_count_lock = threading.Lock()
+# Callables notified after every statement (query, seconds) and every pool
+# checkout (seconds waited); used by metrics.py
+_query_listeners = []
+_checkout_listeners = []
+
+
+class InstrumentedCursor(extensions.cursor):
+    """
+    Cursor that counts and times the statements it runs, for /pool_stats,
+    the benchmark suite and per-request metrics.
+    """
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record_query(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _record_query(query, time.perf_counter() - started)
+
+
+def _record_query(query, seconds):
+    global _query_count
+    with _query_count_lock:
+        _query_count += 1
+    for listener in _query_listeners:
+        listener(query, seconds)
+
+
+def query_count():
+    return _query_count
+
+
+def add_query_listener(listener):
+    if listener not in _query_listeners:
+        _query_listeners.append(listener)
+
+
+def add_checkout_listener(listener):
+    if listener not in _checkout_listeners:
+        _checkout_listeners.append(listener)
+
+
+class ConnectionPool:
+    def __init__(self, dsn_kwargs, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, check_idle=DB_POOL_CHECK_IDLE):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError('Invalid pool size: min=%s max=%s' % (minconn, maxconn))
+
+        self.dsn_kwargs = dsn_kwargs
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+
+        self._lock = threading.Condition()
+        self._idle = []          # list of (conn, last_used) tuples
+        self._in_use = set()
+        self._opening = 0
+        self._pid = os.getpid()
+
+        # Stats
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        return psycopg2.connect(cursor_factory=InstrumentedCursor, **self.dsn_kwargs)
+
+    def _reset_after_fork(self):
+        # Connections must never be shared between a parent and a forked worker
+        if self._pid != os.getpid():
+            self._idle = []
+            self._in_use = set()
+            self._opening = 0
+            self._pid = os.getpid()
+
+    def _healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _size(self):
+        return len(self._in_use) + len(self._idle) + self._opening
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            conn = None
+            with self._lock:
+                self._reset_after_fork()
+                self._waiting += 1
+                try:
+                    while True:
+                        if self._idle:
+                            conn, last_used = self._idle.pop()
+                            self._in_use.add(conn)
+                            break
+                        if self._size() < self.maxconn:
+                            # Reserve the slot, then connect outside the lock
+                            self._opening += 1
+                            break
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            raise PoolTimeout(
+                                'No database connection available after %.1fs' % timeout)
+                        self._lock.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                finally:
+                    with self._lock:
+                        self._opening -= 1
+                        if conn is not None:
+                            self._in_use.add(conn)
+                        else:
+                            self._lock.notify()
+                break
+
+            if self._healthy(conn, last_used):
+                break
+            # Broken connection: drop it and try again with the same deadline
+            self._discard(conn)
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        for listener in _checkout_listeners:
+            listener(waited)
+        return conn
+
+    def putconn(self, conn):
+        with self._lock:
+            if conn not in self._in_use:
+                return
+            self._in_use.discard(conn)
+            if self._pid != os.getpid() or conn.closed:
+                self._discarded += 1
+            else:
+                status = conn.info.transaction_status
+                if status != extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        self._close_quietly(conn)
+                if conn.closed:
+                    self._discarded += 1
+                else:
+                    self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    def _discard(self, conn):
+        with self._lock:
+            self._in_use.discard(conn)
+            self._discarded += 1
+            self._lock.notify()
+        self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def closeall(self):
+        with self._lock:
+            for conn, _ in self._idle:
+                self._close_quietly(conn)
+            self._idle = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'checkout_wait_avg_ms': round(
+                    self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                'checkout_wait_max_ms': round(self._wait_max * 1000, 3),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connection_kwargs():
+    return {
+        'host': DB_HOST,
+        'port': DB_PORT,
+        'dbname': DB_NAME,
+        'user': DB_USER,
+        'password': DB_PASS,
+    }
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(connection_kwargs())
+    return _pool
+
+
+def replica_kwargs(dsn):
+    kwargs = connection_kwargs()
+    kwargs.update(extensions.parse_dsn(dsn))
+    kwargs.setdefault('connect_timeout', DB_REPLICA_CONNECT_TIMEOUT)
+    # A read routed here by mistake fails loudly instead of writing to a
+    # stand-in that is not really a replica
+    kwargs['options'] = (kwargs.get('options', '') + ' -c default_transaction_read_only=on').strip()
+    return kwargs
+
+
+# Lag is measured against the primary's WAL position rather than from what the
+# replica reports about itself: a replica whose WAL receiver has stopped has
+# replayed all it received and would otherwise look fully caught up. Each round
+# the monitor samples pg_current_wal_lsn() on the primary; a replica's lag is
+# the age of the oldest sample it has not replayed yet, so it is accurate to
+# within DB_REPLICA_CHECK_INTERVAL. Not being in recovery counts as zero.
+PRIMARY_LSN_QUERY = "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')"
+REPLICA_LSN_QUERY = "SELECT pg_is_in_recovery(), pg_wal_lsn_diff(pg_last_wal_replay_lsn(), '0/0')"
+
+
+def _error_text(e):
+    lines = str(e).strip().splitlines()
+    return lines[0] if lines else type(e).__name__
+
+
+class Replica:
+    def __init__(self, dsn):
+        self.kwargs = replica_kwargs(dsn)
+        self.name = f"{self.kwargs.get('host', '')}:{self.kwargs.get('port', '')}"
+        self.pool = ConnectionPool(self.kwargs, minconn=0, timeout=DB_REPLICA_CONNECT_TIMEOUT)
+        self.healthy = True
+        self.lag = 0.0
+        self.error = None
+        self.checked_at = None
+
+
+class ReplicaSet:
+    def __init__(self, dsns, max_lag=DB_REPLICA_MAX_LAG, interval=DB_REPLICA_CHECK_INTERVAL):
+        self.replicas = [Replica(dsn) for dsn in dsns]
+        self.max_lag = max_lag
+        self.interval = interval
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._monitor = None
+        self._pid = None
+        # (monotonic time, primary WAL position) samples, oldest first
+        self._primary_lsns = []
+        self.fallbacks = 0
+
+    def _ensure_monitor(self):
+        # The thread does not survive a fork, so each worker starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._monitor = threading.Thread(target=self._run, name='db-replica-monitor', daemon=True)
+                    self._monitor.start()
+                    self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self.sample_primary()
+            for replica in self.replicas:
+                self.check(replica)
+            time.sleep(self.interval)
+
+    def _query(self, kwargs, query):
+        # A separate short-lived connection, so checks never wait behind a busy pool
+        conn = psycopg2.connect(**kwargs)
+        try:
+            cur = conn.cursor()
+            cur.execute(query)
+            row = cur.fetchone()
+            cur.close()
+            return row
+        finally:
+            conn.close()
+
+    def sample_primary(self):
+        try:
+            lsn = self._query(connection_kwargs(), PRIMARY_LSN_QUERY)[0]
+        except psycopg2.Error as e:
+            # Older samples still bound the lag; replicas are judged on those
+            print(f"Could not read the primary's WAL position: {_error_text(e)}")
+            return
+        now = time.monotonic()
+        # Samples older than this already prove a replica is too far behind
+        keep_after = now - self.max_lag - 2 * self.interval
+        samples = [sample for sample in self._primary_lsns if sample[0] >= keep_after]
+        samples.append((now, float(lsn)))
+        self._primary_lsns = samples
+
+    def lag_behind(self, replayed):
+        """
+        Seconds since the primary was at a WAL position the replica has not
+        replayed yet; 0 when it has replayed everything sampled.
+        """
+        for sampled_at, lsn in self._primary_lsns:
+            if lsn > replayed:
+                return time.monotonic() - sampled_at
+        return 0.0
+
+    def check(self, replica):
+        try:
+            in_recovery, replayed = self._query(replica.kwargs, REPLICA_LSN_QUERY)
+        except psycopg2.Error as e:
+            self._set_health(replica, False, replica.lag, _error_text(e))
+            return
+        if in_recovery and replayed is None:
+            self._set_health(replica, False, replica.lag, 'has not replayed any WAL')
+            return
+        lag = self.lag_behind(float(replayed)) if in_recovery else 0.0
+        if lag > self.max_lag:
+            self._set_health(replica, False, lag, f'lagging {lag:.1f}s')
+        else:
+            self._set_health(replica, True, lag, None)
+
+    def _set_health(self, replica, healthy, lag, error):
+        if healthy != replica.healthy:
+            print(f"Replica {replica.name} is {'back' if healthy else 'down'}" + (f": {error}" if error else ''))
+        replica.healthy, replica.lag, replica.error = healthy, lag, error
+        replica.checked_at = time.time()
+        if not healthy:
+            replica.pool.closeall()
+
+    def mark_down(self, replica, error):
+        self._set_health(replica, False, replica.lag, error)
+
+    def choose(self):
+        """
+        The healthy replica with the fewest connections in use, rotating
+        between equally busy ones; None when none is healthy.
+        """
+        self._ensure_monitor()
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            return None
+        start = next(self._turn) % len(healthy)
+        rotated = healthy[start:] + healthy[:start]
+        return min(rotated, key=lambda r: r.pool.stats()['in_use'])
+
+    def stats(self):
+        return {
+            'fallbacks': self.fallbacks,
+            'replicas': [
+                {
+                    'name': replica.name,
+                    'healthy': replica.healthy,
+                    'lag_seconds': round(replica.lag, 3),
+                    'error': replica.error,
+                    'pool': replica.pool.stats(),
+                }
+                for replica in self.replicas
+            ],
+        }
+
+
+_replicas = None
+# Returns False when the current caller must read from the primary
+_replica_filter = None
+
+
+def get_replicas():
+    global _replicas
+    if _replicas is None and DB_REPLICAS:
+        with _pool_lock:
+            if _replicas is None:
+                _replicas = ReplicaSet(DB_REPLICAS)
+    return _replicas
+
+
+def set_replica_filter(fn):
+    global _replica_filter
+    _replica_filter = fn
+
+
+def _replica_conn():
+    """
+    (pool, conn) on a replica, or None to use the primary.
+    """
+    replicas = get_replicas()
+    if replicas is None or (_replica_filter is not None and not _replica_filter()):
+        return None
+    while True:
+        replica = replicas.choose()
+        if replica is None:
+            replicas.fallbacks += 1
+            return None
+        try:
+            return replica.pool, replica.pool.getconn()
+        except PoolTimeout:
+            # Busy rather than broken; let the primary take this one
+            replicas.fallbacks += 1
+            return None
+        except psycopg2.OperationalError as e:
+            replicas.mark_down(replica, _error_text(e))
+
+
+@contextmanager
+def db_conn(readonly=False):
+    """
+    Check a connection out of the pool and always hand it back.
+
+    Uncommitted work is rolled back when the block exits, so an early return
+    or an exception can never leak a connection or an open transaction.
+    readonly=True may hand out a replica connection; only use it for reads
+    that can tolerate DB_REPLICA_MAX_LAG seconds of staleness.
+    """
+    checkout = _replica_conn() if readonly else None
+    if checkout is None:
+        pool = get_pool()
+        conn = pool.getconn()
+    else:
+        pool, conn = checkout
+    try:
+        yield conn
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def pool_stats():
+    stats = get_pool().stats()
+    stats['queries'] = query_count()
+    if get_replicas() is not None:
+        stats['replicas'] = get_replicas().stats()
+    return stats
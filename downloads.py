@@ -0,0 +1,93 @@
+"""
+Conditional and byte-range responses for stored files.
+
+Attachments are immutable once uploaded, so responses carry a strong ETag
+derived from their content and a Cache-Control lifetime. Revalidation with
+If-None-Match answers 304 without touching storage, and Range requests only
+read the requested bytes so large logs and videos can be resumed or seeked.
+"""
+import mimetypes
+import os
+from urllib.parse import quote
+
+from flask import Response, request
+
+ATTACHMENT_MAX_AGE = int(os.environ.get('ATTACHMENT_MAX_AGE', '86400'))
+
+
+def content_disposition(filename, as_attachment=True):
+    kind = 'attachment' if as_attachment else 'inline'
+    try:
+        filename.encode('ascii')
+        return f'{kind}; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"{kind}; filename*=UTF-8''{quote(filename)}"
+
+
+def requested_range(size, etag):
+    """
+    The single byte range the client asked for as (start, stop), None for the
+    whole body, or False if the range cannot be satisfied.
+
+    Multi-range requests are answered with the full body, which the spec allows.
+    """
+    rng = request.range
+    if rng is None or rng.units != 'bytes' or len(rng.ranges) != 1:
+        return None
+
+    # A Range with a stale If-Range validator gets the whole, current body
+    if_range = request.if_range
+    if if_range.etag is not None or if_range.date is not None:
+        if if_range.etag != etag:
+            return None
+
+    start, stop = rng.ranges[0]
+    if stop is None:
+        stop = size
+        if start < 0:
+            start = max(size + start, 0)
+    stop = min(stop, size)
+    if start >= stop:
+        return False
+    return start, stop
+
+
+def send_ranged(read_range, size, etag, filename, content_type=None,
+                as_attachment=True, max_age=ATTACHMENT_MAX_AGE):
+    """
+    Build a streaming response for a stored body of ``size`` bytes.
+
+    ``read_range(start, length)`` must return an iterable of byte chunks
+    covering exactly that slice of the body; it is only called when the
+    response actually needs a body.
+    """
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': f'private, max-age={max_age}',
+        'Content-Disposition': content_disposition(filename or 'download', as_attachment),
+    }
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    byte_range = requested_range(size, etag)
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    if byte_range is None:
+        start, stop, status = 0, size, 200
+    else:
+        start, stop = byte_range
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    body = read_range(start, stop - start) if stop > start else []
+    mimetype = content_type or mimetypes.guess_type(filename or '')[0] or 'application/octet-stream'
+    response = Response(body, status=status, headers=headers, mimetype=mimetype,
+                        direct_passthrough=True)
+    response.content_length = stop - start
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,189 @@
+"""
+Live board updates over Server-Sent Events.
+
+Write routes call publish() inside their transaction, which issues a Postgres
+NOTIFY that is only delivered if the transaction commits. Each process runs a
+single listener thread on its own connection that LISTENs for those events and
+fans them out to the browsers subscribed to the affected game.
+
+Other modules can receive their own NOTIFY channel on the same listener
+connection with hub.add_channel(); the cache uses this to spread invalidations.
+
+Under WSGI every open event stream occupies a worker thread for its lifetime,
+so serve the app with threaded or gevent gunicorn workers when live updates are
+enabled. The ASGI mode (asgi.py) serves streams on the event loop instead.
+"""
+import json
+import os
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+from db import connection_kwargs
+
+EVENTS_CHANNEL = 'ticket_events'
+EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', '15'))
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', '100'))
+EVENTS_RETRY_MS = 3000
+
+
+def publish(cur, event_type, game_name, ticket_id=None):
+    """
+    Queue an event on the caller's transaction; listeners receive it on commit.
+    """
+    payload = {'type': event_type, 'game_name': game_name}
+    if ticket_id is not None:
+        payload['ticket_id'] = ticket_id
+    cur.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, json.dumps(payload)))
+
+
+class EventHub:
+    def __init__(self):
+        self._subscribers = {}   # game_name -> set of queues
+        # channel -> (on_notify(payload), on_listening(bool)) for add_channel() users
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def subscribe(self, game_name, q=None):
+        self._ensure_listener()
+        if q is None:
+            q = queue.Queue(EVENTS_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(game_name, set()).add(q)
+        return q
+
+    def add_channel(self, channel, on_notify, on_listening):
+        """
+        Call on_notify(payload) for each NOTIFY on channel. on_listening(True)
+        runs once the listener is LISTENing on it and on_listening(False) when
+        the connection is lost, since anything sent meanwhile is missed.
+        """
+        with self._lock:
+            self._channels[channel] = (on_notify, on_listening)
+        self._ensure_listener()
+
+    def unsubscribe(self, game_name, q):
+        with self._lock:
+            subscribers = self._subscribers.get(game_name)
+            if subscribers:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[game_name]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def dispatch(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        with self._lock:
+            targets = list(self._subscribers.get(event.get('game_name'), ()))
+        for q in targets:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # A stalled client must not hold back everyone else; tell it
+                # to reload the board once it catches up
+                self._overflow(q)
+
+    @staticmethod
+    def _overflow(q):
+        try:
+            while True:
+                q.get_nowait()
+        except queue.Empty:
+            pass
+        q.put_nowait({'type': 'resync'})
+
+    def _ensure_listener(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._subscribers = {}
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._listen_forever, name='event-listener', daemon=True)
+                self._thread.start()
+
+    def _listen_forever(self):
+        delay = 1
+        while True:
+            try:
+                self._listen()
+                delay = 1
+            except (psycopg2.Error, OSError) as e:
+                print(f"Event listener lost its connection: {e}")
+                # Clients missed events while disconnected
+                self._broadcast({'type': 'resync'})
+                with self._lock:
+                    channels = list(self._channels.values())
+                for _, on_listening in channels:
+                    on_listening(False)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def _broadcast(self, event):
+        with self._lock:
+            targets = [q for subscribers in self._subscribers.values() for q in subscribers]
+        for q in targets:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                self._overflow(q)
+
+    def _listen(self):
+        conn = psycopg2.connect(**connection_kwargs())
+        try:
+            conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {EVENTS_CHANNEL}")
+            listening = set()
+            while True:
+                with self._lock:
+                    channels = dict(self._channels)
+                for channel in channels.keys() - listening:
+                    cur.execute(f"LISTEN {channel}")
+                    listening.add(channel)
+                    channels[channel][1](True)
+                if select.select([conn], [], [], EVENTS_HEARTBEAT) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    if notify.channel in channels:
+                        channels[notify.channel][0](notify.payload)
+                    else:
+                        self.dispatch(notify.payload)
+        finally:
+            conn.close()
+
+
+hub = EventHub()
+
+
+def sse_stream(game_name):
+    """
+    Generator of SSE frames for one browser subscribed to game_name.
+    """
+    q = hub.subscribe(game_name)
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        while True:
+            try:
+                event = q.get(timeout=EVENTS_HEARTBEAT)
+            except queue.Empty:
+                # Comment frames keep proxies from closing an idle stream
+                yield ": ping\n\n"
+                continue
+            yield f"data: {json.dumps(event)}\n\n"
+    finally:
+        hub.unsubscribe(game_name, q)
@@ -0,0 +1,98 @@
+"""
+Streaming ticket export.
+
+Rows are read from a named (server-side) cursor a batch at a time and written
+out as CSV or NDJSON while the response is being sent, optionally gzipped, so
+worker memory stays flat no matter how many tickets match.
+"""
+import csv
+import io
+import json
+import os
+import uuid
+import zlib
+
+from db import db_conn
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '2000'))
+EXPORT_COLUMNS = ['id', 'summary', 'project', 'work_type', 'status', 'description',
+                  'assignee', 'team', 'game_name', 'created_at']
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# created_at backs the export date-range filter; applied by migrations.py,
+# which indexes it per game with tickets_game_name_created_at_idx.
+# now() is not volatile, so existing rows take the default without a rewrite
+EXPORT_SCHEMA = """
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now();
+"""
+
+
+def _json_default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_cell(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def encode_csv(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([_csv_cell(value) for value in row])
+    return buffer.getvalue().encode()
+
+
+def encode_ndjson(rows):
+    return ''.join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=_json_default) + '\n' for row in rows
+    ).encode()
+
+
+def stream_tickets(clauses, params, fmt='csv', compress=False, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Generator of encoded chunks for every ticket matching the filter clauses.
+    """
+    query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM tickets WHERE 1=1"
+    for clause in clauses:
+        query += f" AND {clause}"
+    query += " ORDER BY id"
+
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def emit(data):
+        return compressor.compress(data) if compressor else data
+
+    with db_conn() as conn:
+        # Named cursors only live inside a transaction; the pool rolls it back
+        # when the connection is returned, which also closes the cursor
+        cur = conn.cursor(name=f'ticket_export_{uuid.uuid4().hex}')
+        cur.itersize = batch_size
+        cur.execute(query, params)
+
+        if fmt == 'csv':
+            yield emit(encode_csv([], header=True))
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            chunk = encode_csv(rows) if fmt == 'csv' else encode_ndjson(rows)
+            data = emit(chunk)
+            if data:
+                yield data
+        cur.close()
+
+    if compressor:
+        yield compressor.flush()
+
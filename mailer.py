@@ -0,0 +1,344 @@
+"""
+Durable email outbox.
+
+Routes never talk to the SMTP server. They insert a row into email_outbox in
+the same transaction as the change that triggered the email, and a pool of
+background workers drains the outbox over long-lived SMTP sessions, retrying
+with exponential backoff and dead-lettering messages that keep failing.
+
+Run ``python mailer.py`` to drain the outbox from a dedicated process instead
+of the web workers (set OUTBOX_IN_PROCESS=0 on the web workers in that case).
+
+Sending is off until SMTP_USER or SMTP_FROM is set; until then emails are only
+queued, and go out once a sender is configured.
+"""
+import os
+import smtplib
+import sys
+import threading
+import time
+from email.message import EmailMessage
+
+from db import db_conn
+import metrics
+
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_USER = os.environ.get('SMTP_USER', '')
+SMTP_PASS = os.environ.get('SMTP_PASS', '')
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') == '1'
+SMTP_FROM = os.environ.get('SMTP_FROM', SMTP_USER)
+SMTP_ENABLED = bool(SMTP_FROM)
+# Idle SMTP sessions are probed with NOOP before reuse after this many seconds
+SMTP_IDLE_CHECK = float(os.environ.get('SMTP_IDLE_CHECK', '30'))
+# Sessions are closed after this long without traffic
+SMTP_IDLE_CLOSE = float(os.environ.get('SMTP_IDLE_CLOSE', '300'))
+
+OUTBOX_IN_PROCESS = os.environ.get('OUTBOX_IN_PROCESS', '1') == '1'
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', '2'))
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '20'))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', '5'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', '30'))
+OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', '3600'))
+# Rows stuck in 'sending' longer than this belonged to a crashed worker
+OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', '300'))
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    html_body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'sending', 'sent', 'dead')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    locked_at TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    sent_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS email_outbox_due_idx
+    ON email_outbox (next_attempt_at) WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS email_outbox_sending_idx
+    ON email_outbox (locked_at) WHERE status = 'sending';
+"""
+
+
+def build_message(to_email, subject, html_content):
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = SMTP_FROM
+    msg['To'] = to_email
+    msg.set_content("This email requires an HTML-compatible viewer.")
+    msg.add_alternative(html_content, subtype='html')
+    return msg
+
+
+def enqueue_email(cur, to_email, subject, html_content):
+    """
+    Queue an email on the caller's cursor. It is only sent once the caller's
+    transaction commits, so a rolled-back change never produces an email.
+    """
+    cur.execute(
+        "INSERT INTO email_outbox (to_email, subject, html_body) VALUES (%s, %s, %s) RETURNING id",
+        (to_email, subject, html_content)
+    )
+    return cur.fetchone()[0]
+
+
+class SmtpSession:
+    """
+    One SMTP connection reused across messages, reconnecting when it drops.
+    """
+
+    def __init__(self):
+        self._server = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if SMTP_USER and SMTP_PASS:
+            server.login(SMTP_USER, SMTP_PASS)
+        return server
+
+    def _alive(self):
+        if self._server is None:
+            return False
+        if time.monotonic() - self._last_used < SMTP_IDLE_CHECK:
+            return True
+        try:
+            return self._server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def send(self, msg):
+        started = time.perf_counter()
+        result = 'failed'
+        try:
+            self._send(msg)
+            result = 'sent'
+        finally:
+            metrics.EMAIL_SEND_SECONDS.observe(time.perf_counter() - started, result=result)
+
+    def _send(self, msg):
+        if not self._alive():
+            self.close()
+            self._server = self._connect()
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped an idle connection; retry once on a fresh one
+            self.close()
+            self._server = self._connect()
+            self._server.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self._server is not None and time.monotonic() - self._last_used > SMTP_IDLE_CLOSE:
+            self.close()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+def backoff_seconds(attempts):
+    return min(OUTBOX_BACKOFF_BASE * (2 ** max(attempts - 1, 0)), OUTBOX_BACKOFF_MAX)
+
+
+def claim_batch(conn, batch_size=OUTBOX_BATCH_SIZE):
+    cur = conn.cursor()
+    # Requeue rows whose worker died mid-send. A message that has used up its
+    # attempts this way may be what crashes the worker, so it is dead-lettered
+    cur.execute(
+        """
+        UPDATE email_outbox
+        SET status = CASE WHEN attempts >= %s THEN 'dead' ELSE 'pending' END,
+            locked_at = NULL,
+            last_error = CASE WHEN attempts >= %s THEN 'Lease expired while sending' ELSE last_error END
+        WHERE status = 'sending' AND locked_at < now() - make_interval(secs => %s)
+        """,
+        (OUTBOX_MAX_ATTEMPTS, OUTBOX_MAX_ATTEMPTS, OUTBOX_LEASE_SECONDS)
+    )
+    cur.execute(
+        """
+        UPDATE email_outbox SET status = 'sending', attempts = attempts + 1, locked_at = now()
+        WHERE id IN (
+            SELECT id FROM email_outbox
+            WHERE status = 'pending' AND next_attempt_at <= now()
+            ORDER BY next_attempt_at, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, to_email, subject, html_body, attempts
+        """,
+        (batch_size,)
+    )
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    return rows
+
+
+def record_results(conn, sent_ids, failures):
+    cur = conn.cursor()
+    if sent_ids:
+        cur.execute(
+            "UPDATE email_outbox SET status = 'sent', sent_at = now(), locked_at = NULL, last_error = NULL "
+            "WHERE id = ANY(%s)",
+            (sent_ids,)
+        )
+    for outbox_id, attempts, error in failures:
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            cur.execute(
+                "UPDATE email_outbox SET status = 'dead', locked_at = NULL, last_error = %s WHERE id = %s",
+                (error, outbox_id)
+            )
+            print(f"Email {outbox_id} dead-lettered after {attempts} attempts: {error}")
+        else:
+            cur.execute(
+                """
+                UPDATE email_outbox
+                SET status = 'pending', locked_at = NULL, last_error = %s,
+                    next_attempt_at = now() + make_interval(secs => %s)
+                WHERE id = %s
+                """,
+                (error, backoff_seconds(attempts), outbox_id)
+            )
+    conn.commit()
+    cur.close()
+
+
+def drain_once(session, batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Claim and send one batch. Returns the number of messages claimed.
+    """
+    with db_conn() as conn:
+        rows = claim_batch(conn, batch_size)
+    if not rows:
+        return 0
+
+    sent_ids = []
+    failures = []
+    for outbox_id, to_email, subject, html_body, attempts in rows:
+        try:
+            msg = build_message(to_email, subject, html_body)
+        except Exception as e:
+            # A malformed address or header will never build; dead-letter it now
+            failures.append((outbox_id, OUTBOX_MAX_ATTEMPTS, f"Invalid message: {e}"))
+            continue
+        try:
+            session.send(msg)
+            sent_ids.append(outbox_id)
+        except smtplib.SMTPRecipientsRefused as e:
+            # The session is fine; the address is not. Only a temporary (4xx)
+            # refusal is worth retrying
+            temporary = any(400 <= code < 500 for code, _ in e.recipients.values())
+            failures.append((outbox_id, attempts if temporary else OUTBOX_MAX_ATTEMPTS,
+                             f"Recipient refused: {e.recipients}"))
+        except Exception as e:
+            failures.append((outbox_id, attempts, str(e)))
+            session.close()
+
+    with db_conn() as conn:
+        record_results(conn, sent_ids, failures)
+    return len(rows)
+
+
+class OutboxWorkerPool:
+    def __init__(self, workers=OUTBOX_WORKERS, poll_interval=OUTBOX_POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'outbox-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        session = SmtpSession()
+        try:
+            while not self._stop.is_set():
+                try:
+                    claimed = drain_once(session)
+                except Exception as e:
+                    print(f"Outbox worker error: {e}")
+                    claimed = 0
+                if claimed:
+                    continue
+                session.close_if_idle()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        finally:
+            session.close()
+
+
+_workers = None
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+
+def start_outbox():
+    """
+    Start the in-process workers once per worker process. app.py calls this on
+    import, so rows left pending or retrying by a restart are sent without
+    waiting for the next write. Returns the pool, or None when disabled.
+    """
+    global _workers, _workers_pid
+    if not OUTBOX_IN_PROCESS or not SMTP_ENABLED:
+        return None
+    if _workers is None or _workers_pid != os.getpid():
+        with _workers_lock:
+            if _workers is None or _workers_pid != os.getpid():
+                _workers = OutboxWorkerPool()
+                _workers.start()
+                _workers_pid = os.getpid()
+    return _workers
+
+
+def notify_outbox():
+    """
+    Wake the in-process workers after committing new outbox rows.
+    """
+    workers = start_outbox()
+    if workers:
+        workers.wake()
+
+
+if __name__ == '__main__':
+    if not SMTP_ENABLED:
+        print("Set SMTP_USER or SMTP_FROM to send email")
+        sys.exit(1)
+    pool = OutboxWorkerPool()
+    pool.start()
+    print(f"Draining email outbox with {pool.workers} workers")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop(timeout=10)
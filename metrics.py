@@ -0,0 +1,200 @@
+"""
+Request metrics in Prometheus text format.
+
+init_app() wraps every request to record its latency and status per route,
+and hooks the database cursor and pool to record how many queries each
+request ran, how long they took, and how long it waited for a connection.
+Requests slower than METRICS_SLOW_REQUEST_MS are logged along with their
+slowest SQL statements. Everything is exposed on /metrics.
+
+Metrics live in process memory, so with several gunicorn workers a scrape only
+sees the worker that answered it.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+
+import db
+
+METRICS_SLOW_REQUEST_MS = float(os.environ.get('METRICS_SLOW_REQUEST_MS', '500'))
+# How many of the slowest statements a slow-request log line includes
+METRICS_SLOW_SQL_SHOWN = 5
+METRICS_SQL_MAX_CHARS = 500
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_label_text(self.labels, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _label_text(self.labels + ('le',), key + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labels + ('le',), key + ('+Inf',))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {series[-1]}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route.', ('route', 'method'))
+REQUESTS = Counter(
+    'http_requests_total', 'Responses by route and status code.', ('route', 'method', 'status'))
+REQUEST_QUERIES = Histogram(
+    'http_request_sql_queries', 'SQL statements run per request.', ('route',), COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram(
+    'http_request_sql_seconds', 'Total SQL time per request.', ('route',))
+POOL_WAIT_SECONDS = Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.',
+    buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+EMAIL_SEND_SECONDS = Histogram(
+    'email_send_duration_seconds', 'Time to hand one message to the SMTP server.', ('result',))
+
+REGISTRY = [REQUEST_SECONDS, REQUESTS, REQUEST_QUERIES, REQUEST_SQL_SECONDS, POOL_WAIT_SECONDS, EMAIL_SEND_SECONDS]
+
+_local = threading.local()
+
+
+def _on_query(query, seconds):
+    statements = getattr(_local, 'statements', None)
+    if statements is not None:
+        statements.append((seconds, query))
+
+
+def _on_checkout(seconds):
+    POOL_WAIT_SECONDS.observe(seconds)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _sql_text(query):
+    text = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+    text = ' '.join(text.split())
+    if len(text) > METRICS_SQL_MAX_CHARS:
+        text = text[:METRICS_SQL_MAX_CHARS] + '...'
+    return text
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    _local.statements = []
+
+
+def _after_request(response):
+    started = g.pop('metrics_started', None)
+    statements = getattr(_local, 'statements', None) or []
+    _local.statements = None
+    if started is None:
+        return response
+
+    elapsed = time.perf_counter() - started
+    route = _route()
+    sql_seconds = sum(seconds for seconds, _ in statements)
+
+    REQUEST_SECONDS.observe(elapsed, route=route, method=request.method)
+    REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    REQUEST_QUERIES.observe(len(statements), route=route)
+    REQUEST_SQL_SECONDS.observe(sql_seconds, route=route)
+
+    if elapsed * 1000 >= METRICS_SLOW_REQUEST_MS:
+        print(f"Slow request: {request.method} {request.full_path.rstrip('?')} -> {response.status_code} "
+              f"in {elapsed * 1000:.0f}ms, {len(statements)} queries, {sql_seconds * 1000:.0f}ms SQL")
+        for seconds, query in sorted(statements, key=lambda s: s[0], reverse=True)[:METRICS_SLOW_SQL_SHOWN]:
+            print(f"    {seconds * 1000:.1f}ms  {_sql_text(query)}")
+    return response
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    stats = db.pool_stats()
+    for name in ('in_use', 'idle', 'waiting'):
+        lines.append(f"# TYPE db_pool_{name} gauge")
+        lines.append(f"db_pool_{name} {stats[name]}")
+    for name in ('timeouts', 'discarded'):
+        lines.append(f"# TYPE db_pool_{name}_total counter")
+        lines.append(f"db_pool_{name}_total {stats[name]}")
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_endpoint():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    db.add_query_listener(_on_query)
+    db.add_checkout_listener(_on_checkout)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
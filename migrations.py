@@ -0,0 +1,382 @@
+"""
+Versioned schema migrations.
+
+Every schema change is a numbered migration, and applied versions are recorded
+in schema_migrations, so a database can be brought up to date, or checked
+against the code, with one command:
+
+    python migrations.py apply      apply pending migrations
+    python migrations.py status     list applied and pending migrations
+    python migrations.py explain    EXPLAIN the routes' hot queries and flag
+                                    sequential scans on large tables
+
+Apply migrations as a deploy step, before starting the new web workers. They
+run one at a time under an advisory lock, so two deploys at once do not race.
+Indexes on tables that may already be large are built with CREATE INDEX
+CONCURRENTLY outside a transaction, columns are added without rewriting
+existing rows, and new tables derived from existing data are backfilled in
+small transactions afterwards, so writes are not blocked while a migration
+runs.
+
+The web app never applies migrations itself. MIGRATE_ON_START controls what it
+does on import: 'check' (default) logs pending migrations, 'off' skips the
+check.
+"""
+import json
+import os
+import sys
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+from db import connection_kwargs
+import search
+import mailer
+import blobstore
+import export
+import sync
+import stats
+import uploads
+import notifications
+
+MIGRATE_ON_START = os.environ.get('MIGRATE_ON_START', 'check')
+# Sequential scans are only flagged on tables with at least this many rows
+EXPLAIN_MIN_ROWS = int(os.environ.get('EXPLAIN_MIN_ROWS', '10000'))
+MIGRATIONS_LOCK_ID = 74021
+
+MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    duration_ms INTEGER
+);
+"""
+
+# The tables the app was originally deployed against; IF NOT EXISTS lets
+# existing databases adopt the migration history as-is
+BASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    name TEXT,
+    email TEXT NOT NULL UNIQUE,
+    password TEXT,
+    is_active BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+CREATE TABLE IF NOT EXISTS projects (
+    id SERIAL PRIMARY KEY,
+    game_name TEXT NOT NULL UNIQUE,
+    phase TEXT,
+    category TEXT
+);
+
+CREATE TABLE IF NOT EXISTS project_invitations (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    project_name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending'
+);
+
+CREATE TABLE IF NOT EXISTS project_assignments (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    project_name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tickets (
+    id SERIAL PRIMARY KEY,
+    summary TEXT NOT NULL,
+    project TEXT,
+    work_type TEXT,
+    status TEXT NOT NULL DEFAULT 'To Do',
+    description TEXT,
+    assignee TEXT,
+    team TEXT,
+    game_name TEXT,
+    attachment BYTEA,
+    attachment_filename TEXT
+);
+
+CREATE TABLE IF NOT EXISTS ticket_attachments (
+    id SERIAL PRIMARY KEY,
+    ticket_id INTEGER NOT NULL REFERENCES tickets (id) ON DELETE CASCADE,
+    filename TEXT,
+    data BYTEA
+);
+"""
+
+
+class Migration:
+    def __init__(self, version, name, sql=None, concurrent_indexes=(), backfill=None):
+        self.version = version
+        self.name = name
+        self.sql = sql
+        # (index_name, definition) pairs built with CREATE INDEX CONCURRENTLY
+        self.concurrent_indexes = concurrent_indexes
+        # Called after the rest has committed, to fill new tables in small
+        # transactions instead of one that locks out writers
+        self.backfill = backfill
+
+
+MIGRATIONS = [
+    Migration(1, 'base tables', BASE_SCHEMA),
+    Migration(2, 'ticket full-text and project trigram search', search.SEARCH_SCHEMA,
+              concurrent_indexes=search.SEARCH_INDEXES),
+    Migration(3, 'email outbox', mailer.OUTBOX_SCHEMA),
+    Migration(4, 'blob store attachment columns', blobstore.BLOB_SCHEMA,
+              concurrent_indexes=blobstore.BLOB_INDEXES),
+    Migration(5, 'ticket created_at', export.EXPORT_SCHEMA),
+    Migration(6, 'delta sync versioning and tombstones', sync.SYNC_SCHEMA, concurrent_indexes=sync.SYNC_INDEXES),
+    Migration(7, 'indexes for hot route predicates', concurrent_indexes=[
+        ('tickets_game_name_work_type_idx', 'ON tickets (game_name, work_type)'),
+        ('tickets_game_name_status_id_idx', 'ON tickets (game_name, status, id DESC)'),
+        ('ticket_attachments_ticket_id_idx', 'ON ticket_attachments (ticket_id)'),
+        ('users_lower_email_idx', 'ON users (LOWER(email))'),
+        ('project_invitations_project_status_idx', 'ON project_invitations (project_name, status)'),
+        ('project_assignments_user_project_idx', 'ON project_assignments (user_id, project_name)'),
+    ]),
+    Migration(8, 'indexes for dashboard filters', concurrent_indexes=[
+        ('tickets_game_name_team_id_idx', 'ON tickets (game_name, team, id DESC)'),
+        ('tickets_game_name_assignee_id_idx', 'ON tickets (game_name, assignee, id DESC)'),
+        ('tickets_game_name_created_at_idx', 'ON tickets (game_name, created_at)'),
+        ('tickets_game_name_updated_at_idx', 'ON tickets (game_name, updated_at)'),
+    ]),
+    Migration(9, 'per-project ticket statistics', stats.STATS_SCHEMA, backfill=stats.reconcile),
+    Migration(10, 'resumable upload sessions', uploads.UPLOAD_SCHEMA),
+    Migration(11, 'notification preferences and digest events', notifications.NOTIFY_SCHEMA),
+]
+
+# Lookups whose SQL is written inline in their routes, with sample parameters.
+# Keep these in step with app.py; the listing, board, facet and project search
+# queries are built by route_queries() with the routes' own code instead.
+ROUTE_QUERIES = [
+    ('/get_tickets?since',
+     "SELECT id FROM tickets WHERE change_xid >= pg_snapshot_xmin(pg_current_snapshot())",
+     []),
+    ('attachment listing',
+     "SELECT ticket_id, id, filename FROM ticket_attachments WHERE ticket_id = ANY(%s) ORDER BY id",
+     [[1, 2, 3]]),
+    ('/invite_user',
+     "SELECT id FROM users WHERE LOWER(email) = %s",
+     ['someone@example.com']),
+    ('/login',
+     "SELECT id, name, password FROM users WHERE email = %s AND is_active = TRUE",
+     ['someone@example.com']),
+    ('/api/assignees',
+     """
+     SELECT users.id, users.name FROM users
+     JOIN project_invitations ON users.id = project_invitations.user_id
+     WHERE project_invitations.status = 'accepted' AND project_invitations.project_name = %s
+     """,
+     ['Sample Game']),
+    ('/assign_user',
+     "SELECT 1 FROM project_assignments WHERE user_id = %s AND project_name = %s",
+     [1, 'Sample Game']),
+    ('/api/projects/stats',
+     "SELECT dimension, value, ticket_count, open_count FROM ticket_stats WHERE game_name = %s",
+     ['Sample Game']),
+]
+
+# Sample query strings for the ticket listing routes
+LISTING_SAMPLES = [
+    ('/get_tickets?gameName&workType', [('gameName', 'Sample Game'), ('workType', 'Bug')]),
+    ('/get_tickets?gameName&team&assignee',
+     [('gameName', 'Sample Game'), ('team', 'Developer,Tester'), ('assignee', 'Sample User')]),
+    ('/get_tickets?gameName&updatedFrom', [('gameName', 'Sample Game'), ('updatedFrom', '2024-01-01')]),
+    ('/get_tickets?search', [('search', 'crash')]),
+]
+
+
+def route_queries():
+    """
+    (route, query, params) for every hot route. The ticket and project queries
+    come from the same builders the routes call, so the check sees the SQL the
+    app really runs.
+    """
+    # Imported here because app imports this module at startup
+    from werkzeug.datastructures import MultiDict
+    import app
+
+    queries = []
+    for route, sample in LISTING_SAMPLES:
+        args = MultiDict(sample)
+        clauses, params = app.build_ticket_filters(args)
+        queries.append((route, *app.ticket_list_query(args, clauses, params)))
+
+    args = MultiDict([('gameName', 'Sample Game')])
+    clauses, params = app.build_ticket_filters(args)
+    queries.append(('/api/board', *app.column_pages_query(app.BOARD_STATUSES, clauses, params, app.BOARD_PAGE_SIZE)))
+    queries.append(('/api/board/column',
+                    *app.column_pages_query(['To Do'], clauses, params, app.BOARD_PAGE_SIZE, after_id=1000)))
+
+    args = MultiDict([('gameName', 'Sample Game'), ('status', 'To Do,In Process'), ('facets', '1')])
+    queries.append(('/get_tickets?facets', *app.ticket_facets_query(args)))
+
+    queries.append(('/api/projects?search', *app.project_list_query('sample', '', 20)))
+    return queries + ROUTE_QUERIES
+
+
+def _connect():
+    # A dedicated autocommit connection: CREATE INDEX CONCURRENTLY cannot run
+    # inside a transaction, and the advisory lock is held for the session
+    conn = psycopg2.connect(**connection_kwargs())
+    conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    return conn
+
+
+def applied_versions(cur):
+    # Read-only: before the first apply there is no table and nothing applied
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return set()
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def pending_migrations(cur):
+    applied = applied_versions(cur)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def _create_index_concurrently(cur, name, definition):
+    # A failed concurrent build leaves an INVALID index behind that IF NOT
+    # EXISTS would happily keep, so drop it and build again
+    cur.execute(
+        """
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+        """,
+        (name,)
+    )
+    if cur.fetchone():
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}")
+
+
+def apply_migration(cur, migration):
+    started = time.monotonic()
+    if migration.sql:
+        cur.execute("BEGIN")
+        try:
+            cur.execute(migration.sql)
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        cur.execute("COMMIT")
+    for name, definition in migration.concurrent_indexes:
+        _create_index_concurrently(cur, name, definition)
+    if migration.backfill:
+        migration.backfill()
+    cur.execute(
+        "INSERT INTO schema_migrations (version, name, duration_ms) VALUES (%s, %s, %s)",
+        (migration.version, migration.name, int((time.monotonic() - started) * 1000))
+    )
+
+
+def migrate():
+    """
+    Apply every pending migration in order. Returns the versions applied.
+    """
+    conn = _connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+        try:
+            cur.execute(MIGRATIONS_TABLE)
+            applied = []
+            # Read the pending list under the lock, after any other runner finished
+            for migration in pending_migrations(cur):
+                print(f"Applying migration {migration.version}: {migration.name}")
+                apply_migration(cur, migration)
+                applied.append(migration.version)
+            return applied
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+            cur.close()
+    finally:
+        conn.close()
+
+
+def status():
+    conn = _connect()
+    try:
+        cur = conn.cursor()
+        applied = applied_versions(cur)
+        cur.close()
+    finally:
+        conn.close()
+    return [(m.version, m.name, m.version in applied) for m in MIGRATIONS]
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from _plan_nodes(child)
+
+
+def explain_routes(min_rows=EXPLAIN_MIN_ROWS):
+    """
+    EXPLAIN each route query and return the sequential scans on tables with at
+    least min_rows rows, as (route, table, estimated_rows) tuples.
+    """
+    conn = _connect()
+    problems = []
+    try:
+        cur = conn.cursor()
+        for route, query, params in route_queries():
+            try:
+                cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            except psycopg2.Error as e:
+                print(f"Could not EXPLAIN {route}: {e}")
+                continue
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            for node in _plan_nodes(plan[0]['Plan']):
+                if node.get('Node Type') != 'Seq Scan':
+                    continue
+                table = node.get('Relation Name')
+                cur.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", (table,))
+                row = cur.fetchone()
+                rows = row[0] if row else 0
+                if rows >= min_rows:
+                    problems.append((route, table, rows))
+        cur.close()
+    finally:
+        conn.close()
+    return problems
+
+
+def on_startup(mode=MIGRATE_ON_START):
+    if mode == 'off':
+        return
+    try:
+        pending = [(v, name) for v, name, done in status() if not done]
+    except psycopg2.Error as e:
+        print(f"Could not check schema migrations: {e}")
+        return
+    if pending:
+        names = ', '.join(f"{v} ({name})" for v, name in pending)
+        print(f"WARNING: pending schema migrations: {names}. Run 'python migrations.py apply'.")
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'apply':
+        applied = migrate()
+        print(f"Applied {len(applied)} migrations." if applied else "Schema is up to date.")
+    elif command == 'status':
+        for version, name, done in status():
+            print(f"{version:4d}  {'applied' if done else 'pending':8s} {name}")
+    elif command == 'explain':
+        problems = explain_routes()
+        for route, table, rows in problems:
+            print(f"Seq scan on {table} (~{rows} rows) in {route}")
+        if problems:
+            sys.exit(1)
+        print("No sequential scans on large tables.")
+    else:
+        print("Usage: python migrations.py [apply|status|explain]")
+        sys.exit(1)
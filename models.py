@@ -0,0 +1,99 @@
+"""
+Compact row models and fast JSON encoding for the list endpoints.
+
+Rows are wrapped in small __slots__ dataclasses instead of per-row dicts, and
+encoded straight to JSON bytes. orjson serializes these dataclasses natively
+in C when it is installed (pip install orjson). Otherwise the standard library
+encoder is used with a fallback that reads the slots directly.
+
+FastJSONProvider plugs the same encoder into Flask, so jsonify() and
+cache.cached_json() get it everywhere without touching each route.
+"""
+import json
+from dataclasses import dataclass, is_dataclass
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@dataclass
+class Attachment:
+    __slots__ = ('id', 'filename')
+    id: int
+    filename: str
+
+
+@dataclass
+class Ticket:
+    __slots__ = ('id', 'summary', 'project', 'work_type', 'status', 'description',
+                 'assignee', 'team', 'game_name', 'attachments')
+    id: int
+    summary: str
+    project: str
+    work_type: str
+    status: str
+    description: str
+    assignee: str
+    team: str
+    game_name: str
+    attachments: list
+
+    @classmethod
+    def from_row(cls, row, attachments):
+        """
+        Build from a TICKET_COLUMNS row (id ... game_name).
+        """
+        return cls(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], attachments)
+
+
+@dataclass
+class Project:
+    __slots__ = ('id', 'game_name', 'phase', 'categories')
+    id: int
+    game_name: str
+    phase: str
+    categories: str
+
+
+@dataclass
+class User:
+    __slots__ = ('id', 'name')
+    id: int
+    name: str
+
+
+def _default(value):
+    if is_dataclass(value) and hasattr(value, '__slots__'):
+        return {name: getattr(value, name) for name in value.__slots__}
+    # Dates and anything else keep the formats Flask's own provider uses
+    return DefaultJSONProvider.default(value)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(value):
+        return orjson.dumps(value, default=_default, option=_ORJSON_OPTIONS)
+else:
+    def dumps(value):
+        return json.dumps(value, default=_default, separators=(',', ':')).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by dumps(); jsonify() output is compact and
+    unsorted but otherwise identical.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, default=_default, **kwargs)
+        return dumps(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,322 @@
+"""
+Ticket notification emails, sent immediately or collected into digests.
+
+Routes call notify() with the tickets assigned to or changed for each user. Users
+whose notify_mode is 'immediate' get one email per call, as before: a single
+ticket gets the full ticket email, several get one email listing them. Everyone
+else gets a row per ticket in notification_events. Repeated changes to the
+same ticket update that row instead of adding another, so a ticket reassigned
+and moved three times is reported once, as it stands when the digest goes out.
+
+Once a user's oldest pending event is NOTIFY_DIGEST_WINDOW seconds old, the
+flusher turns all of their pending events into one email on the outbox and
+deletes the events, in one transaction. Tickets no longer assigned to them are
+left out. The flusher starts in each web worker the first time it records an
+event (NOTIFY_IN_PROCESS=1). Set NOTIFY_IN_PROCESS=0 to run it in a dedicated
+process with ``python notifications.py`` instead.
+
+Users without a stored preference get NOTIFY_DEFAULT_MODE.
+"""
+import os
+import sys
+import threading
+import time
+from html import escape
+
+from db import db_conn
+from mailer import enqueue_email, notify_outbox
+
+NOTIFY_MODES = ('immediate', 'digest')
+NOTIFY_DEFAULT_MODE = os.environ.get('NOTIFY_DEFAULT_MODE', 'digest')
+NOTIFY_DIGEST_WINDOW = int(os.environ.get('NOTIFY_DIGEST_WINDOW', '600'))
+NOTIFY_FLUSH_INTERVAL = float(os.environ.get('NOTIFY_FLUSH_INTERVAL', '30'))
+NOTIFY_FLUSH_BATCH = int(os.environ.get('NOTIFY_FLUSH_BATCH', '50'))
+NOTIFY_IN_PROCESS = os.environ.get('NOTIFY_IN_PROCESS', '1') == '1'
+# Advisory lock namespace so two flushers never split one user's digest
+NOTIFY_LOCK_ID = 7305
+
+APP_URL = os.environ.get('APP_URL', 'http://localhost:5000')
+
+HEADINGS = {
+    'assigned': "New tickets assigned to you",
+    'updated': "Tickets updated",
+}
+
+# Single-ticket emails in immediate mode: (subject prefix, opening line)
+TICKET_EMAILS = {
+    'assigned': ("New Ticket Assigned", "You have been assigned a new ticket:"),
+    'updated': ("Ticket Updated", "This ticket has been updated:"),
+}
+
+NOTIFY_SCHEMA = """
+ALTER TABLE users ADD COLUMN IF NOT EXISTS notify_mode TEXT
+    CHECK (notify_mode IN ('immediate', 'digest'));
+
+CREATE TABLE IF NOT EXISTS notification_events (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    ticket_id INTEGER NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('assigned', 'updated')),
+    changes INTEGER NOT NULL DEFAULT 1,
+    first_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, ticket_id)
+);
+
+CREATE INDEX IF NOT EXISTS notification_events_first_at_idx ON notification_events (first_at);
+"""
+
+
+def render_email(name, heading, tickets):
+    """
+    tickets: (summary, status, work_type, game_name, note) tuples.
+    """
+    items = ''.join(
+        f"<li><strong>{escape(str(summary))}</strong> "
+        f"({escape(str(status))}, {escape(str(work_type))}, {escape(str(game_name))})"
+        f"{f' &mdash; {escape(note)}' if note else ''}</li>"
+        for summary, status, work_type, game_name, note in tickets
+    )
+    return f"""
+    <html>
+    <body>
+        <p>Hello {escape(name or '')},</p>
+        <p>{heading} ({len(tickets)}):</p>
+        <ul>{items}</ul>
+        <p>Please log in to <a href="{APP_URL}">BUG FREE</a> to view the details.</p>
+    </body>
+    </html>
+    """
+
+
+def render_ticket_email(name, intro, ticket):
+    """
+    ticket: (summary, description, project, status, work_type, game_name).
+    """
+    summary, description, project, status, work_type, game_name = (escape(str(v)) for v in ticket)
+    return f"""
+    <html>
+    <body>
+        <p>Hello {escape(name or '')},</p>
+        <p>{intro}</p>
+        <ul>
+            <li><strong>Summary:</strong> {summary}</li>
+            <li><strong>Description:</strong> {description}</li>
+            <li><strong>Project:</strong> {project}</li>
+            <li><strong>Status:</strong> {status}</li>
+            <li><strong>Work Type:</strong> {work_type}</li>
+            <li><strong>Game Name:</strong> {game_name}</li>
+        </ul>
+        <p>Please log in to <a href="{APP_URL}">BUG FREE</a> to view the details.</p>
+    </body>
+    </html>
+    """
+
+
+def notify(cur, kind, ticket_ids_by_user):
+    """
+    Record that tickets were assigned to or changed for each user
+    ({user_id: [ticket_id, ...]}), on the caller's transaction. Returns the
+    number of emails queued right away.
+    """
+    user_ids = sorted({int(u) for u in ticket_ids_by_user if str(u).isdigit()})
+    if not user_ids:
+        return 0
+    start_flusher()
+
+    cur.execute(
+        "SELECT id, email, name, COALESCE(notify_mode, %s) FROM users WHERE id = ANY(%s)",
+        (NOTIFY_DEFAULT_MODE, user_ids)
+    )
+    users = {row[0]: row[1:] for row in cur.fetchall()}
+    ids_by_user = {}
+    for user, ticket_ids in ticket_ids_by_user.items():
+        if str(user).isdigit() and int(user) in users:
+            ids_by_user.setdefault(int(user), []).extend(ticket_ids)
+
+    pending = [(user_id, ticket_id, kind)
+               for user_id, ticket_ids in ids_by_user.items() if users[user_id][2] != 'immediate'
+               for ticket_id in ticket_ids]
+    if pending:
+        # Sorted so concurrent requests lock the same rows in the same order
+        cur.execute(
+            """
+            INSERT INTO notification_events AS e (user_id, ticket_id, kind)
+            SELECT * FROM unnest(%s::int[], %s::int[], %s::text[]) ORDER BY 1, 2
+            ON CONFLICT (user_id, ticket_id) DO UPDATE
+                SET changes = e.changes + 1, last_at = now(),
+                    kind = CASE WHEN e.kind = 'assigned' THEN 'assigned' ELSE EXCLUDED.kind END
+            """,
+            [list(column) for column in zip(*sorted(set(pending)))]
+        )
+
+    immediate = {user_id: ticket_ids for user_id, ticket_ids in ids_by_user.items()
+                 if users[user_id][2] == 'immediate' and users[user_id][0]}
+    if not immediate:
+        return 0
+
+    cur.execute(
+        "SELECT id, summary, description, project, status, work_type, game_name FROM tickets WHERE id = ANY(%s)",
+        ([tid for ids in immediate.values() for tid in ids],)
+    )
+    tickets = {row[0]: row[1:] for row in cur.fetchall()}
+    for user_id, ticket_ids in immediate.items():
+        email, name, _ = users[user_id]
+        rows = [tickets[tid] for tid in dict.fromkeys(ticket_ids) if tid in tickets]
+        if not rows:
+            continue
+        if len(rows) == 1:
+            prefix, intro = TICKET_EMAILS[kind]
+            enqueue_email(cur, email, f"{prefix}: {rows[0][0]}", render_ticket_email(name, intro, rows[0]))
+        else:
+            listed = [(summary, status, work_type, game_name, None)
+                      for summary, _, _, status, work_type, game_name in rows]
+            enqueue_email(cur, email, f"{HEADINGS[kind]}: {len(rows)} tickets",
+                          render_email(name, HEADINGS[kind], listed))
+    return len(immediate)
+
+
+def set_mode(cur, user_id, mode):
+    if mode not in NOTIFY_MODES:
+        raise ValueError(f"mode must be one of: {', '.join(NOTIFY_MODES)}")
+    cur.execute("UPDATE users SET notify_mode = %s WHERE id = %s", (mode, user_id))
+    if mode == 'immediate':
+        # Whatever was waiting goes out with the next flush
+        cur.execute("UPDATE notification_events SET first_at = '-infinity' WHERE user_id = %s", (user_id,))
+
+
+def _flush_user(cur, user_id):
+    cur.execute(
+        """
+        DELETE FROM notification_events WHERE user_id = %s
+        RETURNING ticket_id, kind, changes
+        """,
+        (user_id,)
+    )
+    events = {ticket_id: (kind, changes) for ticket_id, kind, changes in cur.fetchall()}
+    cur.execute("SELECT email, name FROM users WHERE id = %s", (user_id,))
+    user = cur.fetchone()
+    if not events or not user or not user[0]:
+        return False
+
+    # Final state only: tickets since deleted or reassigned are not mentioned
+    cur.execute(
+        """
+        SELECT id, summary, status, work_type, game_name FROM tickets
+        WHERE id = ANY(%s) AND assignee = %s
+        ORDER BY id
+        """,
+        (list(events), str(user_id))
+    )
+    rows = []
+    for ticket_id, summary, status, work_type, game_name in cur.fetchall():
+        kind, changes = events[ticket_id]
+        notes = []
+        if kind == 'assigned':
+            notes.append('newly assigned')
+        if changes > 1:
+            notes.append(f'changed {changes} times')
+        rows.append((summary, status, work_type, game_name, ', '.join(notes)))
+    if not rows:
+        return False
+
+    email, name = user
+    enqueue_email(cur, email, f"BUG FREE digest: {len(rows)} ticket{'s' if len(rows) != 1 else ''}",
+                  render_email(name, "Ticket activity since your last update", rows))
+    return True
+
+
+def flush_due(window=NOTIFY_DIGEST_WINDOW, batch_size=NOTIFY_FLUSH_BATCH):
+    """
+    Send a digest to every user whose oldest pending event is older than the
+    window. Returns the number of digests queued.
+    """
+    queued = 0
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT user_id FROM notification_events
+            GROUP BY user_id
+            HAVING min(first_at) <= now() - make_interval(secs => %s)
+            ORDER BY min(first_at)
+            LIMIT %s
+            """,
+            (window, batch_size)
+        )
+        user_ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+
+        for user_id in user_ids:
+            # The events and the digest email commit together, so a crash can
+            # neither lose a digest nor send it twice
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", (NOTIFY_LOCK_ID, user_id))
+            if cur.fetchone()[0] and _flush_user(cur, user_id):
+                queued += 1
+            conn.commit()
+        cur.close()
+
+    if queued:
+        notify_outbox()
+    return queued
+
+
+class DigestFlusher:
+    def __init__(self, interval=NOTIFY_FLUSH_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='digest-flusher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                # Keep going while full batches come back
+                while flush_due() >= NOTIFY_FLUSH_BATCH:
+                    pass
+            except Exception as e:
+                print(f"Digest flusher error: {e}")
+            self._stop.wait(self.interval)
+
+
+_flusher = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def start_flusher():
+    """
+    Start the in-process flusher once per worker process.
+    """
+    global _flusher, _flusher_pid
+    if not NOTIFY_IN_PROCESS:
+        return
+    if _flusher is None or _flusher_pid != os.getpid():
+        with _flusher_lock:
+            if _flusher is None or _flusher_pid != os.getpid():
+                _flusher = DigestFlusher()
+                _flusher.start()
+                _flusher_pid = os.getpid()
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'flush':
+        print(f"Queued {flush_due()} digests.")
+    elif command == '':
+        flusher = DigestFlusher()
+        flusher.start()
+        print(f"Sending notification digests every {NOTIFY_DIGEST_WINDOW}s window")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            flusher.stop(timeout=10)
+    else:
+        print("Usage: python notifications.py [flush]")
+        sys.exit(1)
@@ -0,0 +1,137 @@
+"""
+Password hashing off the request workers.
+
+Hashing and verification are deliberately slow KDF calls, so they run in a
+small process pool instead of on the request thread, where they would hold
+the GIL and stall every other request in the worker. At most
+PASSWORD_MAX_PENDING calls may be queued or running per worker process; past
+that, callers get PasswordPoolBusy immediately (a 503) instead of piling up.
+
+PASSWORD_HASH_METHOD and PASSWORD_SALT_LENGTH take werkzeug's
+generate_password_hash() parameters, e.g. "scrypt:32768:8:1" or
+"pbkdf2:sha256:600000". When they change, stored hashes are upgraded the next
+time their owner logs in.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', '16'))
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', '2'))
+PASSWORD_MAX_PENDING = int(os.environ.get('PASSWORD_MAX_PENDING', str(PASSWORD_WORKERS * 4)))
+PASSWORD_TIMEOUT = float(os.environ.get('PASSWORD_TIMEOUT', '10'))
+# Forking a threaded web worker is unsafe, so pool processes are spawned fresh
+PASSWORD_START_METHOD = os.environ.get('PASSWORD_START_METHOD', 'spawn')
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _hash_params(pwhash):
+    """
+    (method, salt_length) a stored hash was made with.
+    """
+    method, _, rest = pwhash.partition('$')
+    salt = rest.partition('$')[0]
+    return method, len(salt)
+
+
+def _verify(pwhash, password, method, salt_length, current_method):
+    """
+    Check a password and, if it matches but was hashed with other parameters,
+    hash it again with the current ones. Returns (matches, new_hash or None).
+    """
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if _hash_params(pwhash) != (current_method, salt_length):
+        return True, generate_password_hash(password, method=method, salt_length=salt_length)
+    return True, None
+
+
+class PasswordHasher:
+    def __init__(self, workers=PASSWORD_WORKERS, max_pending=PASSWORD_MAX_PENDING,
+                 method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_SALT_LENGTH):
+        self.workers = workers
+        self.method = method
+        self.salt_length = salt_length
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        # Full method string ("scrypt" -> "scrypt:32768:8:1"), learned from the
+        # first hash so rehash decisions compare like with like
+        self._current_method = None
+        self.rejected = 0
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context(PASSWORD_START_METHOD))
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordPoolBusy('Too many password checks in progress, please retry')
+        try:
+            try:
+                future = self._get_executor().submit(fn, *args)
+            except BrokenProcessPool:
+                # A pool process died; start a fresh pool and try once more
+                with self._lock:
+                    self._executor = None
+                future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot stays taken until the pool is really done with the call, so
+        # calls that timed out still count against PASSWORD_MAX_PENDING
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=PASSWORD_TIMEOUT)
+        except FutureTimeout:
+            # Drop it if it is still queued; a running call cannot be stopped
+            future.cancel()
+            raise PasswordPoolBusy('Password check timed out, please retry')
+
+    def _method(self):
+        if self._current_method is None:
+            self._current_method = _hash_params(self._run(_hash, '', self.method, 1))[0]
+        return self._current_method
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        """
+        Returns (matches, new_hash); new_hash is set when the stored hash
+        should be replaced because the hash parameters changed.
+        """
+        if not pwhash:
+            return False, None
+        return self._run(_verify, pwhash, password, self.method, self.salt_length, self._method())
+
+
+hasher = PasswordHasher()
+
+
+def hash_password(password):
+    return hasher.hash(password)
+
+
+def verify_password(pwhash, password):
+    return hasher.verify(pwhash, password)
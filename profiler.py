@@ -0,0 +1,197 @@
+"""
+On-demand CPU profiling of individual requests.
+
+A request is profiled when it carries the admin token, either as an
+X-Profile header or a _profile query parameter, or when it is picked by
+sampling: PROFILE_SAMPLE="/get_tickets=100,/update_ticket/<int:ticket_id>=20"
+profiles 1 in 100 and 1 in 20 requests on those routes (Flask rule strings).
+With neither PROFILE_TOKEN nor PROFILE_SAMPLE set, nothing is registered and
+requests pay no overhead at all.
+
+Profiles are written to PROFILE_DIR as either:
+    pstats      cProfile output, open with snakeviz or python -m pstats
+    speedscope  stack samples for https://www.speedscope.app
+The token-triggered format can be picked per request with _profile_format.
+Only one request is profiled at a time; others run unprofiled meanwhile.
+"""
+import cProfile
+import hmac
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request
+
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_SAMPLE = os.environ.get('PROFILE_SAMPLE', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+PROFILE_FORMAT = os.environ.get('PROFILE_FORMAT', 'pstats')
+PROFILE_FORMATS = ('pstats', 'speedscope')
+# Stack sampling interval for speedscope profiles
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.001'))
+
+_busy = threading.Lock()
+
+
+def parse_sample_rates(text):
+    rates = {}
+    for item in text.split(','):
+        if '=' not in item:
+            continue
+        route, _, every = item.rpartition('=')
+        try:
+            every = int(every)
+        except ValueError:
+            continue
+        if route.strip() and every > 0:
+            rates[route.strip()] = every
+    return rates
+
+
+_sample_rates = parse_sample_rates(PROFILE_SAMPLE)
+_sample_counters = {route: itertools.count(1) for route in _sample_rates}
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack at a fixed interval from a helper thread.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.frames = []         # speedscope shared frames
+        self._frame_index = {}
+        self.samples = []
+        self.weights = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _frame_id(self, frame):
+        code = frame.f_code
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append({'name': code.co_name, 'file': code.co_filename, 'line': code.co_firstlineno})
+        return index
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_id(frame))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append(stack)
+            self.weights.append((now - last) * 1000)
+            last = now
+
+    def speedscope(self, name):
+        total = sum(self.weights)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'jira-clone profiler',
+            'shared': {'frames': self.frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': total,
+                'samples': self.samples,
+                'weights': self.weights,
+            }],
+        }
+
+
+def _token_requested():
+    if not PROFILE_TOKEN:
+        return False
+    supplied = request.headers.get('X-Profile') or request.args.get('_profile')
+    return bool(supplied) and hmac.compare_digest(supplied, PROFILE_TOKEN)
+
+
+def _sampled():
+    if request.url_rule is None:
+        return False
+    route = request.url_rule.rule
+    every = _sample_rates.get(route)
+    return every is not None and next(_sample_counters[route]) % every == 0
+
+
+def _before_request():
+    if _token_requested():
+        fmt = request.args.get('_profile_format', PROFILE_FORMAT)
+    elif _sampled():
+        fmt = PROFILE_FORMAT
+    else:
+        return
+    if fmt not in PROFILE_FORMATS or not _busy.acquire(blocking=False):
+        return
+
+    if fmt == 'speedscope':
+        profiler = StackSampler(threading.get_ident())
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    g.profile = (fmt, profiler, time.perf_counter())
+
+
+def _profile_name(elapsed):
+    route = request.url_rule.rule if request.url_rule is not None else request.path
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', route).strip('-') or 'root'
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return f"{stamp}-{request.method}-{slug}-{elapsed * 1000:.0f}ms"
+
+
+def _teardown_request(exc):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    fmt, profiler, started = profile
+    try:
+        if fmt == 'speedscope':
+            profiler.stop()
+        else:
+            profiler.disable()
+        name = _profile_name(time.perf_counter() - started)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if fmt == 'speedscope':
+            path = os.path.join(PROFILE_DIR, name + '.speedscope.json')
+            with open(path, 'w') as f:
+                json.dump(profiler.speedscope(f"{request.method} {request.full_path.rstrip('?')}"), f)
+        else:
+            path = os.path.join(PROFILE_DIR, name + '.prof')
+            profiler.dump_stats(path)
+        print(f"Wrote profile {path}")
+    except OSError as e:
+        print(f"Could not write profile: {e}")
+    finally:
+        _busy.release()
+
+
+def init_app(app):
+    if not PROFILE_TOKEN and not _sample_rates:
+        return
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
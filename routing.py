@@ -0,0 +1,38 @@
+"""
+Read-your-writes for replica reads.
+
+Read routes ask db_conn(readonly=True) for a replica connection (see db.py).
+After a user's request that may have written succeeds, their session sticks to
+the primary for DB_STICKY_SECONDS. Any request method other than GET, HEAD and
+OPTIONS counts as a write. During that window their next reads show their own
+change even if the replicas have not replayed it yet. Other users keep reading
+from the replicas.
+"""
+import os
+import time
+
+from flask import has_request_context, request, session
+
+import db
+
+DB_STICKY_SECONDS = float(os.environ.get('DB_STICKY_SECONDS', str(max(10.0, db.DB_REPLICA_MAX_LAG * 2))))
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def use_replica():
+    if not has_request_context():
+        return True
+    return session.get('db_primary_until', 0) < time.time()
+
+
+def _after_request(response):
+    if request.method not in READ_METHODS and response.status_code < 400:
+        session['db_primary_until'] = time.time() + DB_STICKY_SECONDS
+    return response
+
+
+def init_app(app):
+    if not db.DB_REPLICAS:
+        return
+    db.set_replica_filter(use_replica)
+    app.after_request(_after_request)
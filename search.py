@@ -0,0 +1,137 @@
+"""
+Indexed full-text search for tickets and projects.
+
+Tickets are matched against a weighted tsvector of summary and description
+(summary ranks above description). ticket_search_vector() computes it and a GIN
+expression index stores it, so searches are answered from the index instead of
+a sequential ILIKE scan, without a stored column that would have to be written
+for every existing ticket. Short fields such as project names use a trigram index,
+which serves substring and typo-tolerant matches.
+"""
+import re
+
+SEARCH_CONFIG = 'english'
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+# Minimum pg_trgm similarity for a project name to count as a fuzzy match
+PROJECT_SIMILARITY = 0.3
+
+# The indexed expression; queries must use exactly this for the index to apply
+TICKET_SEARCH_VECTOR = "ticket_search_vector(summary, description)"
+
+SEARCH_SCHEMA = f"""
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION ticket_search_vector(summary TEXT, description TEXT) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(summary, '')), 'A') ||
+           setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+"""
+
+# Built with CREATE INDEX CONCURRENTLY by migrations.py
+SEARCH_INDEXES = [
+    ('tickets_search_vector_idx', f'ON tickets USING GIN ({TICKET_SEARCH_VECTOR})'),
+    ('projects_game_name_trgm_idx', 'ON projects USING GIN (LOWER(game_name) gin_trgm_ops)'),
+]
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def build_tsquery(text, prefix=True):
+    """
+    Turn free text into a to_tsquery() expression that ANDs every term.
+
+    The last term is matched as a prefix so results update while the user is
+    still typing. Returns None when the text has no searchable terms.
+    """
+    terms = _TERM_RE.findall(text or '')
+    if not terms:
+        return None
+    parts = [term.lower() for term in terms]
+    if prefix:
+        parts[-1] += ':*'
+    return ' & '.join(parts)
+
+
+def parse_limit(value, default=SEARCH_DEFAULT_LIMIT):
+    try:
+        limit = int(value) if value else default
+    except ValueError:
+        limit = default
+    return max(1, min(limit, SEARCH_MAX_LIMIT))
+
+
+def ticket_search_clause(text):
+    """
+    WHERE clause and params matching tickets against the full-text index,
+    or (None, []) if the text has no searchable terms.
+    """
+    tsquery = build_tsquery(text)
+    if not tsquery:
+        return None, []
+    return f"{TICKET_SEARCH_VECTOR} @@ to_tsquery('{SEARCH_CONFIG}', %s)", [tsquery]
+
+
+def ticket_rank_expression(text):
+    tsquery = build_tsquery(text)
+    if not tsquery:
+        return None, []
+    return f"ts_rank({TICKET_SEARCH_VECTOR}, to_tsquery('{SEARCH_CONFIG}', %s))", [tsquery]
+
+
+def search_tickets(cur, text, game_name=None, limit=SEARCH_DEFAULT_LIMIT):
+    tsquery = build_tsquery(text)
+    if not tsquery:
+        return []
+
+    query = f"""
+        SELECT id, summary, status, work_type, game_name,
+               ts_rank({TICKET_SEARCH_VECTOR}, q) AS rank,
+               ts_headline('{SEARCH_CONFIG}', coalesce(summary, ''), q) AS highlight
+        FROM tickets, to_tsquery('{SEARCH_CONFIG}', %s) AS q
+        WHERE {TICKET_SEARCH_VECTOR} @@ q
+    """
+    params = [tsquery]
+    if game_name:
+        query += " AND game_name = %s"
+        params.append(game_name)
+    query += " ORDER BY rank DESC, id DESC LIMIT %s"
+    params.append(limit)
+
+    cur.execute(query, params)
+    return [{
+        'id': r[0],
+        'summary': r[1],
+        'status': r[2],
+        'work_type': r[3],
+        'game_name': r[4],
+        'rank': float(r[5]),
+        'highlight': r[6]
+    } for r in cur.fetchall()]
+
+
+def set_project_similarity(cur):
+    """
+    Make the % operator use PROJECT_SIMILARITY for the rest of the caller's
+    transaction. Run it before a query using project_search_clause().
+    """
+    cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true)", (str(PROJECT_SIMILARITY),))
+
+
+def project_search_clause(text):
+    """
+    Substring or fuzzy match on the project name; both forms use the trigram
+    index. Fuzzy matching needs set_project_similarity() on the same transaction.
+    """
+    text = text.lower()
+    return ("(LOWER(game_name) LIKE %s OR LOWER(game_name) %% %s)",
+            [f"%{escape_like(text)}%", text])
+
+
+def project_rank_expression(text):
+    return "similarity(LOWER(game_name), %s)", [text.lower()]
+
+
+def escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
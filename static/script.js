@@ -79,7 +79,7 @@ document.getElementById('openModalBtn').addEventListener('click', () => {
       if (response.ok) {
         form.reset();
         document.getElementById('ticketModal').style.display = 'none';
-        loadTickets();
+        refreshTicketCard(result.ticket_id);
       } else {
         alert('Error: ' + (result?.error || response.statusText));
       }
@@ -122,77 +122,172 @@ document.getElementById('openModalBtn').addEventListener('click', () => {
   document.getElementById('clearSearchBtn').addEventListener('click', () => {
     document.getElementById('searchInput').value = '';
     document.getElementById('filterType').value = '';
+    document.getElementById('filterTeam').value = '';
     loadTickets();
   });
 
   // === Load Tickets ===
-  async function loadTickets() {
-  console.log('Loading tickets...');
-const workType = document.getElementById('filterType').value;
-const urlParams = new URLSearchParams(window.location.search);
-const gameName = urlParams.get('game_name') || "";
-
-const searchText = document.getElementById('searchInput').value.trim();
+  const BOARD_COLUMNS = {
+    'To Do': 'todo',
+    'In Process': 'inprocess',
+    'In Review': 'inreview',
+    'Done': 'done',
+    'On-Hold': 'onhold',
+    'Suggestion': 'suggestion'
+  };
+
+  function boardQuery() {
+    const workType = document.getElementById('filterType').value;
+    const team = document.getElementById('filterTeam').value;
+    const urlParams = new URLSearchParams(window.location.search);
+    const gameName = urlParams.get('game_name') || "";
+    const searchText = document.getElementById('searchInput').value.trim();
+
+    const params = new URLSearchParams();
+    if (workType) params.set('workType', workType);
+    if (team) params.set('team', team);
+    if (gameName && gameName !== "null") params.set('gameName', gameName);
+    if (searchText) params.set('search', searchText);
+    return params;
+  }
 
+  function createTicketCard(ticket) {
+    const ticketDiv = document.createElement('div');
+    ticketDiv.classList.add('ticket');
+    ticketDiv.textContent = ticket.summary;
+    ticketDiv.dataset.ticketId = ticket.id;
 
-  console.log({ workType, gameName, searchText });
+    ticketDiv.addEventListener('click', () => showTicketDetails(ticket));
+    return ticketDiv;
+  }
 
-  let url = '/get_tickets?';
-  if (workType) url += `workType=${encodeURIComponent(workType)}&`;
-  if (gameName && gameName !== "null") {
-    url += `gameName=${encodeURIComponent(gameName)}&`;
+  function renderTicketCard(col, ticket) {
+    col.appendChild(createTicketCard(ticket));
   }
 
-  if (searchText) url += `search=${encodeURIComponent(searchText)}&`;
+  function renderColumnPage(status, page) {
+    const col = document.getElementById(BOARD_COLUMNS[status]);
+    if (!col) {
+      console.warn(`No column found for status: ${status}`);
+      return;
+    }
 
-  console.log('Fetch URL:', url);
+    col.querySelector('.un-column__load-more')?.remove();
+    page.tickets.forEach(ticket => renderTicketCard(col, ticket));
 
-  try {
-    const response = await fetch(url);
-        let tickets = await safeJson(response);
-    if (!response.ok) {
-      alert('Error loading tickets: ' + (tickets?.error || response.statusText));
-      return;
+    if (page.next_cursor) {
+      const moreBtn = document.createElement('button');
+      moreBtn.classList.add('un-column__load-more');
+      moreBtn.dataset.loader = 'false';
+      moreBtn.textContent = 'Load more';
+      moreBtn.addEventListener('click', () => loadMoreTickets(status, page.next_cursor));
+      col.appendChild(moreBtn);
     }
+  }
 
-    tickets = applyFilters(tickets);
+  // Show how many tickets each filter option would match, e.g. "Bug (12)"
+  function renderFacets(facets) {
+    if (!facets) return;
+    [['filterType', facets.workType], ['filterTeam', facets.team]].forEach(([id, counts]) => {
+      const byValue = new Map(counts.map(c => [c.value, c.count]));
+      document.querySelectorAll(`#${id} option`).forEach(option => {
+        if (!option.value) return;
+        option.dataset.label = option.dataset.label || option.textContent;
+        option.textContent = `${option.dataset.label} (${byValue.get(option.value) || 0})`;
+      });
+    });
+  }
 
+  async function loadTickets() {
+    const params = boardQuery();
+    params.set('facets', '1');
+    console.log('Loading board:', params.toString());
 
-    if (!response.ok) {
-      alert('Error loading tickets: ' + (tickets?.error || response.statusText));
-      return;
-    }
+    try {
+      const response = await fetch(`/api/board?${params}`);
+      const board = await safeJson(response);
+      if (!response.ok) {
+        alert('Error loading tickets: ' + (board?.error || response.statusText));
+        return;
+      }
 
-    console.log('Tickets fetched:', tickets);
+      Object.values(BOARD_COLUMNS).forEach(id => {
+        const col = document.getElementById(id);
+        col.innerHTML = `<h2 class="un-column__header">${col.querySelector('h2').textContent}</h2>`;
+      });
 
-    const statuses = ['todo', 'inprocess', 'inreview', 'done', 'onhold', 'suggestion'];
-    statuses.forEach(id => {
-      const col = document.getElementById(id);
-      col.innerHTML = `<h2 class="un-column__header">${col.querySelector('h2').textContent}</h2>`;
-    });
+      board.statuses.forEach(status => renderColumnPage(status, board.columns[status]));
+      renderFacets(board.facets);
+    } catch (err) {
+      alert('Network error: ' + err.message);
+    }
+  }
 
-    tickets.forEach(ticket => {
-      console.log('Rendering ticket:', ticket);
-      let colId = ticket.status.toLowerCase().replace(/\s+/g, '');
-      if (!statuses.includes(colId)) colId = 'todo';
+  async function loadMoreTickets(status, cursor) {
+    const params = boardQuery();
+    params.set('status', status);
+    params.set('cursor', cursor);
 
-      const col = document.getElementById(colId);
-      if (!col) {
-        console.warn(`No column found for status: ${ticket.status} (id: ${colId})`);
+    try {
+      const response = await fetch(`/api/board/column?${params}`);
+      const page = await safeJson(response);
+      if (!response.ok) {
+        alert('Error loading tickets: ' + (page?.error || response.statusText));
         return;
       }
-      const ticketDiv = document.createElement('div');
-      ticketDiv.classList.add('ticket');
-      ticketDiv.textContent = ticket.summary;
-      ticketDiv.dataset.ticketId = ticket.id;
+      renderColumnPage(status, page);
+    } catch (err) {
+      alert('Network error: ' + err.message);
+    }
+  }
 
-      ticketDiv.addEventListener('click', () => showTicketDetails(ticket));
-      col.appendChild(ticketDiv);
-    });
-  } catch (err) {
-    alert('Network error: ' + err.message);
+  // === Live Updates ===
+  // Re-fetch a single ticket and move its card to where it now belongs,
+  // instead of reloading the whole board
+  async function refreshTicketCard(ticketId) {
+    if (!ticketId) return;
+    try {
+      const response = await fetch(`/get_ticket/${ticketId}`);
+      document.querySelectorAll(`.ticket[data-ticket-id="${ticketId}"]`).forEach(el => el.remove());
+      if (!response.ok) return;
+
+      const ticket = await safeJson(response);
+      const params = boardQuery();
+      if (params.get('gameName') && ticket.game_name !== params.get('gameName')) return;
+      if (params.get('workType') && ticket.work_type !== params.get('workType')) return;
+      if (params.get('team') && ticket.team !== params.get('team')) return;
+      // Only the server knows whether the ticket still matches the search
+      if (params.get('search')) {
+        loadTickets();
+        return;
+      }
+
+      const col = document.getElementById(BOARD_COLUMNS[ticket.status]);
+      if (!col) return;
+
+      // Columns are newest first; a ticket older than everything loaded so far
+      // belongs to a page that has not been fetched yet
+      const cards = Array.from(col.querySelectorAll('.ticket'));
+      const next = cards.find(card => Number(card.dataset.ticketId) < ticket.id);
+      const moreBtn = col.querySelector('.un-column__load-more');
+      if (next) col.insertBefore(createTicketCard(ticket), next);
+      else if (!moreBtn) col.appendChild(createTicketCard(ticket));
+    } catch (err) {
+      console.error('Failed to refresh ticket:', err);
+    }
+  }
+
+  function subscribeToBoard() {
+    const gameName = boardQuery().get('gameName');
+    if (!gameName || !window.EventSource) return;
+
+    const source = new EventSource(`/events?game_name=${encodeURIComponent(gameName)}`);
+    source.onmessage = (e) => {
+      const event = JSON.parse(e.data);
+      if (event.ticket_id) refreshTicketCard(event.ticket_id);
+      else loadTickets();
+    };
   }
-}
 
   // === Ticket Detail Modal ===
   function showTicketDetails(ticket) {
@@ -233,7 +328,8 @@ const searchText = document.getElementById('searchInput').value.trim();
 
       if (isImage) {
         const img = document.createElement('img');
-        img.src = `/attachment/${att.id}`;
+        img.src = `/attachment/${att.id}/thumbnail?size=512`;
+        img.loading = 'lazy';
         img.alt = att.filename;
         itemDiv.appendChild(img);
       }
@@ -297,13 +393,52 @@ const searchText = document.getElementById('searchInput').value.trim();
       if (updated.ok) showTicketDetails(updatedTicket);
       else {
         document.getElementById('ticketDetailModal').classList.add('hidden');
-        loadTickets();
+        refreshTicketCard(ticketId);
       }
     } catch (err) {
       alert('Error removing attachment: ' + err.message);
     }
   }
 
+  // === Resumable Uploads ===
+  // Files go up in chunks; after each pass the server reports which chunks it
+  // is still missing, so a dropped connection only costs those chunks
+  const UPLOAD_RETRIES = 3;
+
+  async function uploadAttachment(ticketId, file) {
+    const startResp = await fetch('/api/uploads', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ ticket_id: ticketId, filename: file.name, size: file.size, content_type: file.type })
+    });
+    const upload = await safeJson(startResp);
+    if (!startResp.ok) throw new Error(upload?.error || startResp.statusText);
+
+    let missing = Array.from({ length: upload.chunk_count }, (_, i) => i * upload.chunk_size);
+    for (let attempt = 0; missing.length && attempt <= UPLOAD_RETRIES; attempt++) {
+      for (const offset of missing) {
+        try {
+          await fetch(`/api/uploads/${upload.upload_id}/chunks/${offset}`, {
+            method: 'PUT',
+            body: file.slice(offset, offset + upload.chunk_size)
+          });
+        } catch (err) {
+          console.warn(`Chunk at ${offset} of ${file.name} failed, retrying:`, err);
+        }
+      }
+      const statusResp = await fetch(`/api/uploads/${upload.upload_id}`);
+      const status = await safeJson(statusResp);
+      if (!statusResp.ok) throw new Error(status?.error || statusResp.statusText);
+      missing = status.missing_offsets;
+    }
+    if (missing.length) throw new Error(`${file.name} did not finish uploading`);
+
+    const doneResp = await fetch(`/api/uploads/${upload.upload_id}/finalize`, { method: 'POST' });
+    const done = await safeJson(doneResp);
+    if (!doneResp.ok) throw new Error(done?.error || doneResp.statusText);
+    return done.attachment_id;
+  }
+
   document.getElementById('saveTicketBtn').addEventListener('click', async () => {
     const ticketId = document.getElementById('saveTicketBtn').dataset.ticketId;
     const fileInput = document.getElementById('newAttachmentInput');
@@ -328,23 +463,16 @@ const searchText = document.getElementById('searchInput').value.trim();
 
       if (!updateResp.ok) throw new Error(await updateResp.text());
 
-      if (fileInput.files.length > 0) {
-        const formData = new FormData();
-        for (let file of fileInput.files) formData.append('attachments', file);
-
-        const attachResp = await fetch(`/upload_attachment/${ticketId}`, {
-          method: 'POST',
-          body: formData,
-        });
-
-        if (!attachResp.ok) {
-          const msg = await safeJson(attachResp);
-          alert('Attachment upload failed: ' + (msg?.message || attachResp.statusText));
+      for (const file of fileInput.files) {
+        try {
+          await uploadAttachment(ticketId, file);
+        } catch (err) {
+          alert('Attachment upload failed: ' + err.message);
           return;
         }
       }
 
-      loadTickets();
+      refreshTicketCard(ticketId);
       document.getElementById('ticketDetailModal').classList.add('hidden');
       fileInput.value = '';
     } catch (err) {
@@ -368,6 +496,7 @@ const searchText = document.getElementById('searchInput').value.trim();
 
   // === Filters & Init ===
   document.getElementById('filterType').addEventListener('change', loadTickets);
+  document.getElementById('filterTeam').addEventListener('change', loadTickets);
   document.getElementById('searchInput').addEventListener('input', loadTickets);
   document.getElementById('backToProjectBtn').addEventListener('click', () => {
     window.location.href = '/project?email=' + encodeURIComponent(userEmail);
@@ -502,35 +631,10 @@ function loadAssignees() {
         return fetch(url, options).finally(hideLoader);
     }
 
-    // TeamName Filter
-
-    const searchInput = document.getElementById('searchInput');
-    const filterType = document.getElementById('filterType');
-    const filterTeam = document.getElementById('filterTeam');
-
-    // Modify your load/display logic or add this where you're filtering tickets
-    function applyFilters(tickets) {
-      const searchTerm = searchInput.value.trim().toLowerCase();
-      const selectedType = filterType.value;
-      const selectedTeam = filterTeam.value;
-
-      return tickets.filter(ticket => {
-        const matchesSearch = !searchTerm || ticket.summary.toLowerCase().includes(searchTerm);
-        const matchesType = !selectedType || ticket.workType === selectedType;
-        const matchesTeam = !selectedTeam || ticket.team === selectedTeam;
-
-        return matchesSearch && matchesType && matchesTeam;
-      });
-    }
-
-    // Add listeners to filters
-    filterType.addEventListener('change', loadTickets);
-    filterTeam.addEventListener('change', loadTickets);
-    searchInput.addEventListener('input', loadTickets);
-
 window.addEventListener('load', () => {
   loadTickets();
   loadGameNames();
+  subscribeToBoard();
 });
 
 
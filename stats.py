@@ -0,0 +1,225 @@
+"""
+Per-project ticket statistics.
+
+ticket_stats holds one counter row per (game_name, dimension, value): the
+project total, and tickets per status, per assignee and per work type. Each
+row has a total count and the number of tickets that are not Done. Statement
+level triggers fold every insert, update and delete on tickets into the
+counters, aggregated per statement. A bulk import therefore costs one upsert
+per group, not one per row. An update that does not touch a counted column
+writes nothing. Reading a project's numbers costs the number of groups,
+however many tickets it has.
+
+The table and triggers are installed by migrations.py, which then fills the
+counters with reconcile(). Run ``python stats.py reconcile [game_name]``
+periodically to recount from tickets and correct any drift, e.g. after rows
+were changed with triggers disabled. Games are recounted one at a time, each
+in its own short transaction, so ticket writes only wait for one game's
+recount, never for a whole-table scan.
+"""
+import sys
+
+from db import db_conn
+
+STATS_DIMENSIONS = ('status', 'assignee', 'work_type')
+
+# (dimension, value) pairs each ticket row counts towards, for a row alias t
+_TICKET_GROUPS = """
+    CROSS JOIN LATERAL (VALUES
+        ('total', ''),
+        ('status', COALESCE(t.status, '')),
+        ('assignee', COALESCE(t.assignee, '')),
+        ('work_type', COALESCE(t.work_type, ''))
+    ) AS d(dimension, value)
+"""
+
+STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ticket_stats (
+    game_name TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    ticket_count BIGINT NOT NULL DEFAULT 0,
+    open_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (game_name, dimension, value)
+);
+
+CREATE OR REPLACE FUNCTION ticket_stats_on_change() RETURNS trigger AS $$
+DECLARE
+    changes TEXT;
+BEGIN
+    changes := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT *, 1 AS sign FROM new_rows'
+        WHEN 'DELETE' THEN 'SELECT *, -1 AS sign FROM old_rows'
+        ELSE 'SELECT *, 1 AS sign FROM new_rows UNION ALL SELECT *, -1 FROM old_rows'
+    END;
+    -- Keys are upserted in order so concurrent writers lock rows in the same
+    -- order; groups whose changes cancel out are not touched at all
+    EXECUTE format($q$
+        INSERT INTO ticket_stats AS s (game_name, dimension, value, ticket_count, open_count)
+        SELECT COALESCE(t.game_name, ''), d.dimension, d.value,
+               sum(t.sign), COALESCE(sum(t.sign) FILTER (WHERE t.status IS DISTINCT FROM 'Done'), 0)
+        FROM (%s) AS t
+        """ + _TICKET_GROUPS + """
+        GROUP BY 1, 2, 3
+        HAVING sum(t.sign) <> 0
+            OR COALESCE(sum(t.sign) FILTER (WHERE t.status IS DISTINCT FROM 'Done'), 0) <> 0
+        ORDER BY 1, 2, 3
+        ON CONFLICT (game_name, dimension, value) DO UPDATE
+            SET ticket_count = s.ticket_count + EXCLUDED.ticket_count,
+                open_count = s.open_count + EXCLUDED.open_count
+    $q$, changes);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ticket_stats_insert ON tickets;
+CREATE TRIGGER ticket_stats_insert AFTER INSERT ON tickets
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION ticket_stats_on_change();
+
+DROP TRIGGER IF EXISTS ticket_stats_update ON tickets;
+CREATE TRIGGER ticket_stats_update AFTER UPDATE ON tickets
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION ticket_stats_on_change();
+
+DROP TRIGGER IF EXISTS ticket_stats_delete ON tickets;
+CREATE TRIGGER ticket_stats_delete AFTER DELETE ON tickets
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION ticket_stats_on_change();
+"""
+
+
+def project_stats(cur, game_name=None):
+    """
+    {game_name: {'tickets', 'open', 'status': {value: count},
+    'assignee': {value: open count}, 'work_type': {value: open count}}}
+    """
+    query = """
+        SELECT game_name, dimension, value, ticket_count, open_count
+        FROM ticket_stats
+        WHERE ticket_count > 0
+    """
+    params = []
+    if game_name is not None:
+        query += " AND game_name = %s"
+        params.append(game_name)
+    cur.execute(query, params)
+
+    stats = {}
+    for game, dimension, value, ticket_count, open_count in cur.fetchall():
+        project = stats.get(game)
+        if project is None:
+            project = stats[game] = {'tickets': 0, 'open': 0}
+            project.update({name: {} for name in STATS_DIMENSIONS})
+        if dimension == 'total':
+            project['tickets'], project['open'] = ticket_count, open_count
+        elif dimension == 'status':
+            project['status'][value] = ticket_count
+        elif dimension in project and open_count:
+            project[dimension][value] = open_count
+    return stats
+
+
+def reconcile(game_name=None):
+    """
+    Recount from tickets and fix every counter that drifted, one game per
+    transaction. Returns the corrected rows as (game_name, dimension, value,
+    old counts, new counts).
+    """
+    with db_conn() as conn:
+        cur = conn.cursor()
+        if game_name is not None:
+            games = [game_name]
+        else:
+            # Games that lost all their tickets still have counters to clear
+            cur.execute(
+                """
+                SELECT COALESCE(game_name, '') FROM tickets
+                UNION SELECT game_name FROM ticket_stats
+                ORDER BY 1
+                """
+            )
+            games = [row[0] for row in cur.fetchall()]
+            conn.commit()
+
+        corrected = []
+        for game in games:
+            corrected.extend(_reconcile_game(cur, game))
+            conn.commit()
+        cur.close()
+    return corrected
+
+
+def _reconcile_game(cur, game_name):
+    # Rows without a game are counted under ''; spelled out so the game_name
+    # indexes can serve the recount
+    if game_name:
+        game_clause, game_params = "t.game_name = %s", [game_name]
+    else:
+        game_clause, game_params = "(t.game_name IS NULL OR t.game_name = '')", []
+
+    # Triggers already running finish first and later ones wait for us,
+    # so the recount and the counters describe the same set of tickets
+    cur.execute("LOCK TABLE ticket_stats IN SHARE ROW EXCLUSIVE MODE")
+    cur.execute(
+        f"""
+        WITH actual AS (
+            SELECT COALESCE(t.game_name, '') AS game_name, d.dimension, d.value,
+                   count(*) AS ticket_count,
+                   count(*) FILTER (WHERE t.status IS DISTINCT FROM 'Done') AS open_count
+            FROM tickets AS t
+            {_TICKET_GROUPS}
+            WHERE {game_clause}
+            GROUP BY 1, 2, 3
+        ), recorded AS (
+            SELECT game_name, dimension, value, ticket_count, open_count
+            FROM ticket_stats WHERE game_name = %s
+        )
+        SELECT game_name, dimension, value,
+               COALESCE(r.ticket_count, 0), COALESCE(r.open_count, 0),
+               COALESCE(a.ticket_count, 0), COALESCE(a.open_count, 0)
+        FROM actual AS a
+        FULL JOIN recorded AS r USING (game_name, dimension, value)
+        WHERE COALESCE(a.ticket_count, 0) <> COALESCE(r.ticket_count, 0)
+           OR COALESCE(a.open_count, 0) <> COALESCE(r.open_count, 0)
+        ORDER BY 1, 2, 3
+        """,
+        game_params + [game_name]
+    )
+    drift = cur.fetchall()
+
+    for game, dimension, value, _, _, ticket_count, open_count in drift:
+        if ticket_count:
+            cur.execute(
+                """
+                INSERT INTO ticket_stats (game_name, dimension, value, ticket_count, open_count)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (game_name, dimension, value) DO UPDATE
+                    SET ticket_count = EXCLUDED.ticket_count, open_count = EXCLUDED.open_count
+                """,
+                (game, dimension, value, ticket_count, open_count)
+            )
+        else:
+            cur.execute(
+                "DELETE FROM ticket_stats WHERE game_name = %s AND dimension = %s AND value = %s",
+                (game, dimension, value)
+            )
+    # Groups that emptied out normally leave a zero row behind; drop those too
+    cur.execute(
+        "DELETE FROM ticket_stats WHERE game_name = %s AND ticket_count = 0 AND open_count = 0",
+        (game_name,)
+    )
+    return [(game, dimension, value, (old_total, old_open), (new_total, new_open))
+            for game, dimension, value, old_total, old_open, new_total, new_open in drift]
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'reconcile':
+        corrected = reconcile(sys.argv[2] if len(sys.argv) > 2 else None)
+        for game, dimension, value, old, new in corrected:
+            print(f"{game or '(none)'} {dimension}={value!r}: {old[0]}/{old[1]} -> {new[0]}/{new[1]} (total/open)")
+        print(f"Corrected {len(corrected)} counters.")
+    else:
+        print("Usage: python stats.py reconcile [game_name]")
+        sys.exit(1)
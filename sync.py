@@ -0,0 +1,196 @@
+"""
+Delta sync for ticket listings.
+
+Triggers stamp every ticket row with the 64-bit id of the transaction that last
+wrote it (change_xid) and an updated_at time. Attachment changes touch their
+parent ticket, and deleted tickets leave a tombstone, as do tickets moved to
+another game (under the game they left). A sync token records the
+oldest transaction that could still have been running when the client last
+synced, so asking for changes since a token returns every ticket written since
+then. Some may be repeated, but none are missed, even when transactions commit
+out of order. Requires PostgreSQL 13 or newer.
+
+The columns and triggers are installed by migrations.py. Run
+``python sync.py prune`` periodically to drop expired tombstones.
+"""
+import base64
+import json
+import os
+import sys
+import time
+
+from db import db_conn
+
+# Tokens older than this may have missed deletions, so clients must resync
+SYNC_TOMBSTONE_RETENTION = int(os.environ.get('SYNC_TOMBSTONE_RETENTION', str(7 * 24 * 3600)))
+
+# A volatile default on ADD COLUMN rewrites the whole table, so change_xid is
+# added empty and the default set afterwards: rows written before the
+# migration stay NULL, which no sync token can ask for anyway
+SYNC_SCHEMA = """
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS change_xid xid8;
+ALTER TABLE tickets ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id();
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+ALTER TABLE ticket_attachments ADD COLUMN IF NOT EXISTS change_xid xid8;
+ALTER TABLE ticket_attachments ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id();
+
+CREATE TABLE IF NOT EXISTS ticket_tombstones (
+    ticket_id INTEGER NOT NULL,
+    game_name TEXT NOT NULL DEFAULT '',
+    change_xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    deleted_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (ticket_id, game_name)
+);
+
+CREATE INDEX IF NOT EXISTS ticket_tombstones_change_xid_idx ON ticket_tombstones (change_xid);
+
+CREATE OR REPLACE FUNCTION tickets_add_tombstone(INTEGER, TEXT) RETURNS void AS $$
+    INSERT INTO ticket_tombstones (ticket_id, game_name) VALUES ($1, COALESCE($2, ''))
+    ON CONFLICT (ticket_id, game_name) DO UPDATE
+        SET change_xid = pg_current_xact_id(), deleted_at = now();
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION tickets_stamp_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.game_name IS DISTINCT FROM NEW.game_name THEN
+        -- Clients syncing the old game must drop it
+        PERFORM tickets_add_tombstone(OLD.id, OLD.game_name);
+    END IF;
+    NEW.change_xid := pg_current_xact_id();
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION tickets_record_tombstone() RETURNS trigger AS $$
+BEGIN
+    PERFORM tickets_add_tombstone(OLD.id, OLD.game_name);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ticket_attachments_touch_ticket() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE tickets SET updated_at = now() WHERE id = OLD.ticket_id;
+        RETURN OLD;
+    END IF;
+    NEW.change_xid := pg_current_xact_id();
+    UPDATE tickets SET updated_at = now() WHERE id = NEW.ticket_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tickets_stamp_change ON tickets;
+CREATE TRIGGER tickets_stamp_change BEFORE INSERT OR UPDATE ON tickets
+    FOR EACH ROW EXECUTE FUNCTION tickets_stamp_change();
+
+DROP TRIGGER IF EXISTS tickets_record_tombstone ON tickets;
+CREATE TRIGGER tickets_record_tombstone AFTER DELETE ON tickets
+    FOR EACH ROW EXECUTE FUNCTION tickets_record_tombstone();
+
+DROP TRIGGER IF EXISTS ticket_attachments_touch_ticket ON ticket_attachments;
+CREATE TRIGGER ticket_attachments_touch_ticket
+    BEFORE INSERT OR UPDATE OR DELETE ON ticket_attachments
+    FOR EACH ROW EXECUTE FUNCTION ticket_attachments_touch_ticket();
+"""
+
+# Built with CREATE INDEX CONCURRENTLY by migrations.py
+SYNC_INDEXES = [
+    ('tickets_change_xid_idx', 'ON tickets (change_xid)'),
+]
+
+
+class SyncTokenError(ValueError):
+    pass
+
+
+class SyncTokenExpired(SyncTokenError):
+    pass
+
+
+def encode_token(xmin, issued_at=None):
+    raw = json.dumps({'xmin': str(xmin), 'at': int(issued_at or time.time())}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_token(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded))
+        xmin, issued_at = int(data['xmin']), int(data['at'])
+    except (ValueError, KeyError, TypeError):
+        raise SyncTokenError('Invalid sync token')
+    if time.time() - issued_at > SYNC_TOMBSTONE_RETENTION:
+        raise SyncTokenExpired('Sync token expired, fetch the full listing again')
+    return xmin
+
+
+def current_watermark(cur):
+    """
+    Oldest transaction id that may still be uncommitted. Read it before the
+    rows so anything committed later is picked up by the next sync.
+    """
+    cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+    return int(cur.fetchone()[0])
+
+
+def changes_since(cur, columns, clauses, params, xmin, game_name=None):
+    """
+    Rows of the game written since the token's watermark, split into those
+    matching the filters and the ids of those that no longer do, plus the ids
+    of tickets deleted from or moved out of the game.
+    """
+    matches = ' AND '.join(clauses) if clauses else 'TRUE'
+    # Tickets of other games never were in the client's listing
+    scope, scope_params = ("game_name = %s", [game_name]) if game_name else ("TRUE", [])
+    cur.execute(
+        f"""
+        SELECT {columns}, ({matches}) AS matches
+        FROM tickets
+        WHERE change_xid >= %s::text::xid8 AND {scope}
+        ORDER BY id
+        """,
+        list(params) + [str(xmin)] + scope_params
+    )
+    matching, removed = [], []
+    for row in cur.fetchall():
+        if row[-1]:
+            matching.append(row[:-1])
+        else:
+            removed.append(row[0])
+
+    # A ticket moved back into the game is live again, not deleted
+    cur.execute(
+        f"""
+        SELECT DISTINCT ticket_id FROM ticket_tombstones d
+        WHERE change_xid >= %s::text::xid8{" AND d.game_name = %s" if game_name else ""}
+          AND NOT EXISTS (SELECT 1 FROM tickets t WHERE t.id = d.ticket_id AND {scope})
+        ORDER BY ticket_id
+        """,
+        [str(xmin)] + scope_params + scope_params
+    )
+    deleted = [row[0] for row in cur.fetchall()]
+    return matching, removed + deleted
+
+
+def prune_tombstones():
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM ticket_tombstones WHERE deleted_at < now() - make_interval(secs => %s)",
+            (SYNC_TOMBSTONE_RETENTION,)
+        )
+        removed = cur.rowcount
+        conn.commit()
+        cur.close()
+    return removed
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'prune':
+        print(f"Removed {prune_tombstones()} expired tombstones.")
+    else:
+        print("Usage: python sync.py prune")
+        sys.exit(1)
@@ -0,0 +1,89 @@
+"""
+A board load must cost the same number of queries however many tickets it
+shows. Runs against a fake connection, so no database is needed.
+"""
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MIGRATE_ON_START', 'off')
+
+import app as app_module  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, tickets):
+        self.tickets = tickets
+        self.queries = []
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        if 'FROM ticket_attachments' in query:
+            # Two attachments per ticket on the page
+            self._rows = [(ticket_id, ticket_id * 10 + n, f'file{n}.png')
+                          for ticket_id in params[0] for n in range(2)]
+        elif 'FROM tickets' in query:
+            self._rows = list(self.tickets)
+        else:
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def make_tickets(count):
+    statuses = app_module.BOARD_STATUSES
+    return [(i, f'Ticket {i}', 'Project', 'Bug', statuses[i % len(statuses)], '', '1', 'Developer', 'Game')
+            for i in range(count, 0, -1)]
+
+
+def count_queries(monkeypatch, url, ticket_count):
+    cursor = FakeCursor(make_tickets(ticket_count))
+
+    @contextmanager
+    def fake_db_conn(readonly=False):
+        yield FakeConnection(cursor)
+
+    monkeypatch.setattr(app_module, 'db_conn', fake_db_conn)
+    response = app_module.app.test_client().get(url)
+    assert response.status_code == 200
+    return len(cursor.queries), response.get_json()
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('/get_tickets?gameName=Game', 2),
+    ('/api/board?gameName=Game', 2),
+])
+def test_board_load_query_count_is_constant(monkeypatch, url, expected):
+    few, _ = count_queries(monkeypatch, url, 1)
+    many, _ = count_queries(monkeypatch, url, 60)
+    assert few == many == expected
+
+
+def test_attachments_are_attached_to_their_tickets(monkeypatch):
+    _, tickets = count_queries(monkeypatch, '/get_tickets?gameName=Game', 3)
+    assert [len(ticket['attachments']) for ticket in tickets] == [2, 2, 2]
@@ -0,0 +1,153 @@
+"""
+The email outbox drain: sent rows are marked sent, failures are retried with
+backoff and dead-lettered once they cannot succeed. Runs against a fake
+connection and an SMTP stand-in, so no database or mail server is needed.
+"""
+import os
+import smtplib
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mailer  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, claimable):
+        self.claimable = claimable
+        self.queries = []
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.queries.append((' '.join(query.split()), params))
+        if 'RETURNING id, to_email' in query:
+            self._rows, self.claimable = self.claimable, []
+        else:
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        pass
+
+
+class FakeSMTP:
+    """
+    Stands in for smtplib.SMTP. refuse maps an address to the (code, message)
+    the server answers with; disconnect_next drops the connection once.
+    """
+    refuse = {}
+    disconnect_next = False
+    connections = 0
+    sent = []
+
+    def __init__(self, host, port, timeout=None):
+        FakeSMTP.connections += 1
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def noop(self):
+        return 250, b'OK'
+
+    def send_message(self, msg):
+        if FakeSMTP.disconnect_next:
+            FakeSMTP.disconnect_next = False
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        if msg['To'] in FakeSMTP.refuse:
+            raise smtplib.SMTPRecipientsRefused({msg['To']: FakeSMTP.refuse[msg['To']]})
+        FakeSMTP.sent.append(msg['To'])
+
+    def quit(self):
+        pass
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    FakeSMTP.refuse = {}
+    FakeSMTP.disconnect_next = False
+    FakeSMTP.connections = 0
+    FakeSMTP.sent = []
+    monkeypatch.setattr(smtplib, 'SMTP', FakeSMTP)
+    monkeypatch.setattr(mailer, 'SMTP_STARTTLS', False)
+
+    def drain(rows):
+        cursor = FakeCursor(rows)
+
+        @contextmanager
+        def fake_db_conn(readonly=False):
+            yield FakeConnection(cursor)
+
+        monkeypatch.setattr(mailer, 'db_conn', fake_db_conn)
+        session = mailer.SmtpSession()
+        claimed = mailer.drain_once(session)
+        session.close()
+        return claimed, [(query, params) for query, params in cursor.queries
+                         if 'SET status = \'sent\'' in query or 'WHERE id = %s' in query]
+
+    return drain
+
+
+def row(outbox_id, to_email, attempts=1):
+    return (outbox_id, to_email, 'Subject', '<p>Body</p>', attempts)
+
+
+def test_sent_messages_are_marked_sent(outbox):
+    claimed, updates = outbox([row(1, 'a@example.com'), row(2, 'b@example.com')])
+    assert claimed == 2
+    assert FakeSMTP.sent == ['a@example.com', 'b@example.com']
+    assert FakeSMTP.connections == 1
+    assert len(updates) == 1 and updates[0][1] == ([1, 2],)
+
+
+def test_dropped_connection_is_retried_once_on_a_fresh_session(outbox):
+    FakeSMTP.disconnect_next = True
+    outbox([row(1, 'a@example.com')])
+    assert FakeSMTP.sent == ['a@example.com']
+    assert FakeSMTP.connections == 2
+
+
+def test_temporary_failure_is_retried_with_backoff(outbox):
+    FakeSMTP.refuse = {'busy@example.com': (450, b'Mailbox busy')}
+    _, updates = outbox([row(1, 'busy@example.com', attempts=3)])
+    query, params = updates[0]
+    assert "SET status = 'pending'" in query
+    assert params[1] == mailer.backoff_seconds(3)
+
+
+def test_permanently_refused_recipient_is_dead_lettered(outbox):
+    FakeSMTP.refuse = {'gone@example.com': (550, b'No such user')}
+    _, updates = outbox([row(1, 'gone@example.com'), row(2, 'ok@example.com')])
+    assert FakeSMTP.sent == ['ok@example.com']
+    dead = [params for query, params in updates if "SET status = 'dead'" in query]
+    assert [params[1] for params in dead] == [1]
+
+
+def test_failures_are_dead_lettered_after_max_attempts(outbox):
+    FakeSMTP.refuse = {'busy@example.com': (450, b'Mailbox busy')}
+    _, updates = outbox([row(1, 'busy@example.com', attempts=mailer.OUTBOX_MAX_ATTEMPTS)])
+    assert "SET status = 'dead'" in updates[0][0]
+
+
+def test_backoff_grows_and_is_capped():
+    assert mailer.backoff_seconds(1) == mailer.OUTBOX_BACKOFF_BASE
+    assert mailer.backoff_seconds(2) == mailer.OUTBOX_BACKOFF_BASE * 2
+    assert mailer.backoff_seconds(100) == mailer.OUTBOX_BACKOFF_MAX
@@ -0,0 +1,144 @@
+"""
+Read routing between the primary and the replicas: readonly checkouts go to
+the least busy healthy replica, everything else and every fallback goes to
+the primary, and a user who just wrote keeps reading from the primary. Runs
+against stand-in pools, so no database is needed.
+"""
+import os
+import sys
+import time
+
+import psycopg2
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import routing  # noqa: E402
+
+
+class FakePool:
+    def __init__(self, name, in_use=0, fail=None):
+        self.name = name
+        self.in_use = in_use
+        self.fail = fail
+
+    def getconn(self, timeout=None):
+        if self.fail:
+            raise self.fail
+        return FakeConnection(self.name)
+
+    def putconn(self, conn):
+        pass
+
+    def closeall(self):
+        pass
+
+    def stats(self):
+        return {'in_use': self.in_use}
+
+
+class FakeConnection:
+    def __init__(self, name):
+        self.name = name
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    replica_set = db.ReplicaSet(['host=replica1', 'host=replica2'])
+    for replica, name in zip(replica_set.replicas, ('replica1', 'replica2')):
+        replica.pool = FakePool(name)
+    # No monitor thread; the tests drive health checks themselves
+    replica_set._pid = os.getpid()
+    monkeypatch.setattr(db, '_replicas', replica_set)
+    monkeypatch.setattr(db, '_pool', FakePool('primary'))
+    monkeypatch.setattr(db, '_replica_filter', None)
+    return replica_set
+
+
+def checkout(readonly):
+    with db.db_conn(readonly=readonly) as conn:
+        return conn.name
+
+
+def test_writes_use_the_primary_and_reads_a_replica(replicas):
+    assert checkout(readonly=False) == 'primary'
+    assert checkout(readonly=True) in ('replica1', 'replica2')
+
+
+def test_reads_go_to_the_least_busy_replica(replicas):
+    replicas.replicas[0].pool.in_use = 3
+    assert {checkout(readonly=True) for _ in range(4)} == {'replica2'}
+
+
+def test_reads_fall_back_to_the_primary_without_a_healthy_replica(replicas):
+    for replica in replicas.replicas:
+        replica.healthy = False
+    assert checkout(readonly=True) == 'primary'
+    assert replicas.fallbacks == 1
+
+
+def test_unreachable_replica_is_marked_down_and_skipped(replicas):
+    broken, working = replicas.replicas
+    broken.pool.fail = psycopg2.OperationalError('could not connect to server')
+    working.pool.in_use = 1
+    assert checkout(readonly=True) == 'replica2'
+    assert not broken.healthy
+    assert broken.error == 'could not connect to server'
+
+
+def test_busy_replica_pool_hands_the_read_to_the_primary(replicas):
+    for replica in replicas.replicas:
+        replica.pool.fail = db.PoolTimeout('busy')
+    assert checkout(readonly=True) == 'primary'
+    assert all(replica.healthy for replica in replicas.replicas)
+
+
+@pytest.mark.parametrize('replayed, healthy', [(150.0, True), (50.0, False)])
+def test_replica_lag_is_measured_against_primary_wal_samples(monkeypatch, replicas, replayed, healthy):
+    now = time.monotonic()
+    # The primary was at 100 ten seconds ago and is at 200 now
+    replicas._primary_lsns = [(now - 10, 100.0), (now, 200.0)]
+    monkeypatch.setattr(replicas, '_query', lambda kwargs, query: (True, replayed))
+    replica = replicas.replicas[0]
+    replicas.check(replica)
+    assert replica.healthy is healthy
+    assert (replica.lag > replicas.max_lag) is not healthy
+
+
+def test_stopped_replica_does_not_look_caught_up(monkeypatch, replicas):
+    replicas._primary_lsns = [(time.monotonic() - 30, 100.0)]
+    monkeypatch.setattr(replicas, '_query', lambda kwargs, query: (True, 90.0))
+    replica = replicas.replicas[0]
+    replicas.check(replica)
+    assert not replica.healthy
+
+
+def test_writer_reads_from_the_primary_until_the_sticky_window_ends(monkeypatch, replicas):
+    monkeypatch.setattr(db, 'DB_REPLICAS', ['host=replica1', 'host=replica2'])
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    routing.init_app(app)
+
+    @app.route('/read')
+    def read():
+        return checkout(readonly=True)
+
+    @app.route('/write', methods=['POST'])
+    def write():
+        return checkout(readonly=False)
+
+    client = app.test_client()
+    assert client.get('/read').text != 'primary'
+    assert client.post('/write').text == 'primary'
+    assert client.get('/read').text == 'primary'
+
+    later = time.time() + routing.DB_STICKY_SECONDS + 1
+    monkeypatch.setattr(routing.time, 'time', lambda: later)
+    assert client.get('/read').text != 'primary'
+    # Other users were never pinned
+    assert app.test_client().get('/read').text != 'primary'
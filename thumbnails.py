@@ -0,0 +1,230 @@
+"""
+Thumbnail previews for image attachments.
+
+Thumbnails are rendered off the request path by a small thread pool as soon
+as an upload commits, and cached on disk keyed by attachment id and size.
+Rendering needs Pillow; without it previews fall back to the original file.
+
+Run ``python thumbnails.py backfill`` to render previews for existing images.
+"""
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db import db_conn
+from blobstore import get_blob_store, iter_chunks, BlobNotFound
+
+try:
+    from PIL import Image
+    # Register every codec up front so the output format is decided once
+    Image.init()
+except ImportError:
+    Image = None
+
+THUMBNAIL_SIZES = (128, 512)
+THUMBNAIL_ROOT = os.environ.get(
+    'THUMBNAIL_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thumbnails'))
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '2'))
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', '80'))
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
+
+
+def is_image(filename, content_type=None):
+    if content_type and content_type.startswith('image/'):
+        return True
+    return (filename or '').rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS
+
+
+def _format():
+    # WebP is smaller, but Pillow may be built without it
+    if Image is not None and 'WEBP' in Image.SAVE:
+        return 'WEBP', 'webp', 'image/webp'
+    return 'JPEG', 'jpg', 'image/jpeg'
+
+
+def thumbnail_path(attachment_id, size):
+    _, extension, _ = _format()
+    return os.path.join(THUMBNAIL_ROOT, str(attachment_id), f'{size}.{extension}')
+
+
+def thumbnail_mimetype():
+    return _format()[2]
+
+
+def failed_marker(attachment_id):
+    # Left behind when rendering fails, so misses stop rescheduling it
+    return os.path.join(THUMBNAIL_ROOT, str(attachment_id), 'failed')
+
+
+def can_render(filename, content_type, blob_sha256):
+    """
+    Whether a thumbnail could ever exist: legacy BYTEA rows and non-images never get one.
+    """
+    return Image is not None and bool(blob_sha256) and is_image(filename, content_type)
+
+
+def open_seekable(body):
+    # Pillow needs to seek; remote blob bodies are spooled to a temp file first
+    if getattr(body, 'seekable', lambda: False)():
+        return body
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    with body:
+        for chunk in iter_chunks(body):
+            spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def render_thumbnails(attachment_id, blob_sha256):
+    if Image is None:
+        return
+    pil_format, _, _ = _format()
+    store = get_blob_store()
+
+    with open_seekable(store.open(blob_sha256)) as source:
+        with Image.open(source) as image:
+            # Let the JPEG decoder downscale while decoding
+            image.draft('RGB', (max(THUMBNAIL_SIZES), max(THUMBNAIL_SIZES)))
+            image.load()
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            if pil_format == 'JPEG' and image.mode == 'RGBA':
+                image = image.convert('RGB')
+
+            for size in sorted(THUMBNAIL_SIZES, reverse=True):
+                target = thumbnail_path(attachment_id, size)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                thumb = image.copy()
+                thumb.thumbnail((size, size))
+                # Write then rename so readers never see a partial file
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target))
+                try:
+                    with os.fdopen(fd, 'wb') as tmp:
+                        thumb.save(tmp, pil_format, quality=THUMBNAIL_QUALITY)
+                    os.replace(tmp_path, target)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.unlink(tmp_path)
+                    raise
+
+
+def _mark_failed(attachment_id):
+    marker = failed_marker(attachment_id)
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    open(marker, 'w').close()
+
+
+def generate_for_attachments(attachment_ids):
+    try:
+        _generate(attachment_ids)
+    finally:
+        with _executor_lock:
+            _pending.difference_update(attachment_ids)
+
+
+def _generate(attachment_ids):
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, filename, content_type, blob_sha256 FROM ticket_attachments WHERE id = ANY(%s)",
+            (list(attachment_ids),)
+        )
+        rows = cur.fetchall()
+        cur.close()
+
+    for attachment_id, filename, content_type, blob_sha256 in rows:
+        if not blob_sha256 or not is_image(filename, content_type):
+            continue
+        try:
+            render_thumbnails(attachment_id, blob_sha256)
+        except BlobNotFound:
+            print(f"Thumbnail skipped, blob missing for attachment {attachment_id}")
+            _mark_failed(attachment_id)
+        except Exception as e:
+            print(f"Thumbnail generation failed for attachment {attachment_id}: {e}")
+            _mark_failed(attachment_id)
+        else:
+            try:
+                os.unlink(failed_marker(attachment_id))
+            except FileNotFoundError:
+                pass
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+# Attachment ids queued or rendering in this process
+_pending = set()
+
+
+def schedule_thumbnails(attachment_ids):
+    """
+    Render thumbnails in the background. Call after the attachment rows commit.
+    """
+    global _executor, _executor_pid
+    if Image is None or not attachment_ids:
+        return
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(THUMBNAIL_WORKERS, thread_name_prefix='thumbnail')
+                _executor_pid = os.getpid()
+    with _executor_lock:
+        attachment_ids = [i for i in attachment_ids if i not in _pending]
+        _pending.update(attachment_ids)
+    if attachment_ids:
+        _executor.submit(generate_for_attachments, attachment_ids)
+
+
+def schedule_missing(attachment_id, filename, content_type, blob_sha256):
+    """
+    Schedule a render after a thumbnail miss, unless it can never succeed or
+    already failed.
+    """
+    if can_render(filename, content_type, blob_sha256) and not os.path.exists(failed_marker(attachment_id)):
+        schedule_thumbnails([attachment_id])
+
+
+def delete_thumbnails(attachment_id):
+    for path in [thumbnail_path(attachment_id, size) for size in THUMBNAIL_SIZES] + [failed_marker(attachment_id)]:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    try:
+        os.rmdir(os.path.join(THUMBNAIL_ROOT, str(attachment_id)))
+    except OSError:
+        pass
+
+
+def backfill(batch_size=200):
+    last_id = 0
+    while True:
+        with db_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT id FROM ticket_attachments WHERE id > %s AND blob_sha256 IS NOT NULL ORDER BY id LIMIT %s",
+                (last_id, batch_size)
+            )
+            ids = [row[0] for row in cur.fetchall()]
+            cur.close()
+        if not ids:
+            break
+        missing = [i for i in ids if not os.path.exists(thumbnail_path(i, max(THUMBNAIL_SIZES)))]
+        generate_for_attachments(missing)
+        last_id = ids[-1]
+        print(f"Processed attachments up to id {last_id}")
+
+
+if __name__ == '__main__':
+    if Image is None:
+        print("Pillow is required to render thumbnails (pip install Pillow)")
+        sys.exit(1)
+    if sys.argv[1:] == ['backfill']:
+        backfill()
+    else:
+        print("Usage: python thumbnails.py backfill")
+        sys.exit(1)
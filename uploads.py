@@ -0,0 +1,382 @@
+"""
+Resumable chunked uploads for large attachments.
+
+    POST   /api/uploads                       start a session: ticket_id, filename, size
+                                              and optionally content_type and sha256
+    PUT    /api/uploads/<id>/chunks/<offset>  send one chunk, in any order, retried freely
+    GET    /api/uploads/<id>                  byte ranges received so far
+    POST   /api/uploads/<id>/finalize         store the file and attach it to the ticket
+    DELETE /api/uploads/<id>                  abandon the session
+
+Every chunk except the last is exactly chunk_size bytes and starts at a multiple
+of it, so each request stays far below MAX_CONTENT_LENGTH. Chunk bodies are
+streamed into a sparse spool file under UPLOAD_DIR and hashed as they arrive.
+An X-Chunk-SHA256 header, when sent, is checked before the chunk is recorded.
+The spool directory must be shared by all app servers.
+
+Finalizing streams the spool file into the blob store. The attachment row is
+inserted and the session closed in one transaction, so an upload is either
+attached once or not at all. A retried finalize returns the same attachment.
+
+Sessions idle for longer than UPLOAD_SESSION_TTL expire. Run
+``python uploads.py cleanup`` periodically to delete them and their spool files.
+"""
+import hashlib
+import os
+import secrets
+import sys
+import time
+
+import events
+from db import db_conn
+from blobstore import get_blob_store, hold_blob, CHUNK_SIZE
+
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', str(4 * 1024 * 1024 * 1024)))
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', str(24 * 3600)))
+
+UPLOAD_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id TEXT PRIMARY KEY,
+    ticket_id INTEGER NOT NULL REFERENCES tickets (id) ON DELETE CASCADE,
+    filename TEXT NOT NULL,
+    content_type TEXT,
+    size BIGINT NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    sha256 CHAR(64),
+    attachment_id INTEGER REFERENCES ticket_attachments (id) ON DELETE SET NULL,
+    finalized_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS upload_sessions_expires_at_idx ON upload_sessions (expires_at);
+
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    upload_id TEXT NOT NULL REFERENCES upload_sessions (id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    received_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (upload_id, chunk_index)
+);
+"""
+
+
+class UploadError(ValueError):
+    pass
+
+
+class UploadNotFound(UploadError):
+    pass
+
+
+class UploadConflict(UploadError):
+    pass
+
+
+def spool_path(upload_id):
+    return os.path.join(UPLOAD_DIR, upload_id)
+
+
+def chunk_count(size, chunk_size):
+    return max(1, -(-size // chunk_size))
+
+
+def chunk_length(index, size, chunk_size):
+    return min(chunk_size, size - index * chunk_size)
+
+
+def received_ranges(indexes, size, chunk_size):
+    """
+    Merge received chunk indexes into [start, end) byte ranges.
+    """
+    ranges = []
+    for index in sorted(indexes):
+        start = index * chunk_size
+        end = start + chunk_length(index, size, chunk_size)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def _load_session(cur, upload_id, lock=False):
+    cur.execute(
+        f"""
+        SELECT ticket_id, filename, content_type, size, chunk_size, sha256, attachment_id,
+               finalized_at IS NOT NULL, expires_at < now()
+        FROM upload_sessions WHERE id = %s {'FOR UPDATE' if lock else ''}
+        """,
+        (upload_id,)
+    )
+    row = cur.fetchone()
+    if row is None or (row[8] and not row[7]):
+        raise UploadNotFound('Upload not found or expired')
+    return row
+
+
+def create_session(ticket_id, filename, size, content_type=None, sha256=None):
+    if size is None or size < 0:
+        raise UploadError('size must be a non-negative integer')
+    if size > UPLOAD_MAX_SIZE:
+        raise UploadError(f'Uploads are limited to {UPLOAD_MAX_SIZE} bytes')
+    if sha256 is not None and (len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256)):
+        raise UploadError('sha256 must be 64 lowercase hex digits')
+
+    upload_id = secrets.token_urlsafe(24)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    # A sparse file of the final size, so chunks can land at any offset
+    with open(spool_path(upload_id), 'wb') as spool:
+        spool.truncate(size)
+
+    try:
+        with db_conn() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT 1 FROM tickets WHERE id = %s", (ticket_id,))
+            if cur.fetchone() is None:
+                cur.close()
+                raise UploadNotFound('Ticket not found')
+            cur.execute(
+                """
+                INSERT INTO upload_sessions
+                    (id, ticket_id, filename, content_type, size, chunk_size, sha256, expires_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, now() + make_interval(secs => %s))
+                RETURNING expires_at
+                """,
+                (upload_id, ticket_id, filename, content_type, size, UPLOAD_CHUNK_SIZE, sha256, UPLOAD_SESSION_TTL)
+            )
+            expires_at = cur.fetchone()[0]
+            conn.commit()
+            cur.close()
+    except BaseException:
+        _remove_spool(upload_id)
+        raise
+
+    return {
+        'upload_id': upload_id,
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'chunk_count': chunk_count(size, UPLOAD_CHUNK_SIZE),
+        'expires_at': expires_at,
+    }
+
+
+def _load_with_chunks(upload_id):
+    with db_conn() as conn:
+        cur = conn.cursor()
+        session = _load_session(cur, upload_id)
+        cur.execute("SELECT chunk_index FROM upload_chunks WHERE upload_id = %s", (upload_id,))
+        indexes = [row[0] for row in cur.fetchall()]
+        cur.close()
+    return session, indexes
+
+
+def session_status(upload_id):
+    return _status(*_load_with_chunks(upload_id))
+
+
+def _status(session, indexes):
+    size, chunk_size, attachment_id, finalized = session[3], session[4], session[6], session[7]
+    missing = sorted(set(range(chunk_count(size, chunk_size))) - set(indexes))
+    return {
+        'size': size,
+        'chunk_size': chunk_size,
+        'received': received_ranges(indexes, size, chunk_size),
+        'missing_offsets': [index * chunk_size for index in missing] if size else [],
+        'complete': not missing or not size,
+        'attachment_id': attachment_id if finalized else None,
+    }
+
+
+def write_chunk(upload_id, offset, stream, expected_sha256=None):
+    """
+    Stream one chunk from ``stream`` into the spool file at ``offset``.
+    """
+    with db_conn() as conn:
+        cur = conn.cursor()
+        session = _load_session(cur, upload_id)
+        cur.close()
+    size, chunk_size, finalized = session[3], session[4], session[7]
+    if finalized:
+        raise UploadConflict('Upload already finalized')
+    if offset % chunk_size or offset >= max(size, 1):
+        raise UploadError(f'offset must be a multiple of {chunk_size} below {size}')
+    index = offset // chunk_size
+    length = chunk_length(index, size, chunk_size)
+
+    digest = hashlib.sha256()
+    received = 0
+    with open(spool_path(upload_id), 'r+b') as spool:
+        spool.seek(offset)
+        while True:
+            data = stream.read(min(CHUNK_SIZE, length - received + 1))
+            if not data:
+                break
+            received += len(data)
+            if received > length:
+                raise UploadError(f'Chunk at offset {offset} must be {length} bytes')
+            digest.update(data)
+            spool.write(data)
+        spool.flush()
+        os.fsync(spool.fileno())
+
+    if received != length:
+        raise UploadError(f'Chunk at offset {offset} must be {length} bytes, got {received}')
+    chunk_sha256 = digest.hexdigest()
+    if expected_sha256 and expected_sha256.lower() != chunk_sha256:
+        raise UploadError(f'Checksum mismatch for chunk at offset {offset}')
+
+    with db_conn() as conn:
+        cur = conn.cursor()
+        session = _load_session(cur, upload_id, lock=True)
+        if session[7]:
+            conn.rollback()
+            cur.close()
+            raise UploadConflict('Upload already finalized')
+        cur.execute(
+            """
+            INSERT INTO upload_chunks (upload_id, chunk_index, size, sha256) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (upload_id, chunk_index) DO UPDATE
+                SET size = EXCLUDED.size, sha256 = EXCLUDED.sha256, received_at = now()
+            """,
+            (upload_id, index, received, chunk_sha256)
+        )
+        # Each chunk keeps a slow but live upload from expiring
+        cur.execute(
+            "UPDATE upload_sessions SET expires_at = now() + make_interval(secs => %s) WHERE id = %s",
+            (UPLOAD_SESSION_TTL, upload_id)
+        )
+        cur.execute("SELECT chunk_index FROM upload_chunks WHERE upload_id = %s", (upload_id,))
+        indexes = [row[0] for row in cur.fetchall()]
+        conn.commit()
+        cur.close()
+    return dict(_status(session, indexes), sha256=chunk_sha256)
+
+
+def finalize(upload_id):
+    """
+    Store the completed file and attach it to the ticket. Returns
+    (ticket_id, attachment_id, created), where created is False when the
+    upload had already been finalized.
+
+    The session row stays locked until the attachment commits, so a retried
+    or concurrent finalize waits for this one and then returns its attachment.
+    """
+    with db_conn() as conn:
+        cur = conn.cursor()
+        session = _load_session(cur, upload_id, lock=True)
+        ticket_id, filename, content_type, expected_size, _, expected_sha256, attachment_id, finalized, _ = session
+        if finalized:
+            conn.rollback()
+            cur.close()
+            return ticket_id, attachment_id, False
+        cur.execute("SELECT chunk_index FROM upload_chunks WHERE upload_id = %s", (upload_id,))
+        status = _status(session, [row[0] for row in cur.fetchall()])
+        if not status['complete']:
+            conn.rollback()
+            cur.close()
+            raise UploadConflict(f"Upload incomplete, missing offsets {status['missing_offsets'][:10]}")
+
+        store = get_blob_store()
+        try:
+            with open(spool_path(upload_id), 'rb') as spool:
+                blob_sha256, size = store.put(spool)
+                if size != expected_size or (expected_sha256 and expected_sha256 != blob_sha256):
+                    conn.rollback()
+                    cur.close()
+                    raise UploadError('Uploaded file does not match the declared size or sha256')
+                if not hold_blob(cur, blob_sha256):
+                    spool.seek(0)
+                    store.put(spool)
+        except FileNotFoundError:
+            conn.rollback()
+            cur.close()
+            raise UploadNotFound('Upload data is gone, start a new upload')
+
+        cur.execute(
+            """
+            INSERT INTO ticket_attachments (ticket_id, filename, blob_sha256, size, content_type)
+            VALUES (%s, %s, %s, %s, %s) RETURNING id
+            """,
+            (ticket_id, filename, blob_sha256, size, content_type)
+        )
+        attachment_id = cur.fetchone()[0]
+        cur.execute(
+            """
+            UPDATE upload_sessions
+            SET attachment_id = %s, finalized_at = now(), expires_at = now() + make_interval(secs => %s)
+            WHERE id = %s
+            """,
+            (attachment_id, UPLOAD_SESSION_TTL, upload_id)
+        )
+        cur.execute("DELETE FROM upload_chunks WHERE upload_id = %s", (upload_id,))
+        cur.execute("SELECT game_name FROM tickets WHERE id = %s", (ticket_id,))
+        row = cur.fetchone()
+        if row:
+            events.publish(cur, 'updated', row[0], ticket_id)
+        conn.commit()
+        cur.close()
+
+    _remove_spool(upload_id)
+    return ticket_id, attachment_id, True
+
+
+def abort(upload_id):
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM upload_sessions WHERE id = %s AND finalized_at IS NULL", (upload_id,))
+        deleted = cur.rowcount
+        conn.commit()
+        cur.close()
+    if not deleted:
+        raise UploadNotFound('Upload not found or already finalized')
+    _remove_spool(upload_id)
+
+
+def _remove_spool(upload_id):
+    try:
+        os.unlink(spool_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+
+def cleanup_expired():
+    """
+    Delete expired sessions and their spool files, plus spool files with no
+    session that are older than the TTL. Returns the number of sessions removed.
+    """
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM upload_sessions WHERE expires_at < now() RETURNING id")
+        expired = [row[0] for row in cur.fetchall()]
+        conn.commit()
+
+        for upload_id in expired:
+            _remove_spool(upload_id)
+
+        if os.path.isdir(UPLOAD_DIR):
+            cutoff = time.time() - UPLOAD_SESSION_TTL
+            for name in os.listdir(UPLOAD_DIR):
+                path = os.path.join(UPLOAD_DIR, name)
+                try:
+                    if os.path.getmtime(path) > cutoff:
+                        continue
+                except FileNotFoundError:
+                    # Finalized or aborted while we were listing
+                    continue
+                cur.execute("SELECT 1 FROM upload_sessions WHERE id = %s", (name,))
+                if cur.fetchone() is None:
+                    _remove_spool(name)
+        cur.close()
+    return len(expired)
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'cleanup':
+        print(f"Removed {cleanup_expired()} expired upload sessions.")
+    else:
+        print("Usage: python uploads.py cleanup")
+        sys.exit(1)